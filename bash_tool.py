@@ -0,0 +1,457 @@
+"""BashTool over a pool of persistent shell sessions.
+
+Each conversation gets its own long-lived bash process, so `cd`, exported
+variables and functions carry over from one command to the next as the
+tool description promises. Commands are written to the shell's stdin as a
+quoted here-document, read into a variable by the `read` builtin and run
+with `eval`: a command costs a pipe write, and only the programs it runs
+are forked, never a new shell. After each command the shell prints a
+marker line holding the exit status and working directory on stdout, and
+a marker on stderr, which is how the end of its output is found.
+
+Output is read from both pipes as it arrives (and can be streamed to a
+callback), and capped: past `max_output_chars`, the middle is dropped and
+the head and tail kept, since errors tend to come last. The `timeout`
+argument is in milliseconds, 600000 at most, which is also the default. A
+command that times out is killed with its whole shell, as is a shell that
+exits or closes its own stdout or stderr (`exec >log`), since it can no
+longer mark where a command ends; the next command gets a new shell
+started in the last working directory, and the result says that shell
+state was lost.
+
+A ShellPool keeps a few sessions started ahead of time, so a conversation's
+first command does not wait for bash to start either. Sessions belong to
+the conversation (see conversation()) and are closed when it ends.
+
+Commands naming a program from the description's banned list (curl, wget,
+nc and the like) are refused, also when they are hidden in the arguments
+of `eval` or of `bash -c` and the like. There is no sandbox: this is a
+check on the command text, and a script, an interpreter (`python -c`) or
+an unlisted program still reaches whatever the harness's user can. The
+shell can `cd` and write anywhere that user can. The only thing held back
+from it is the environment: sessions get shell_environment(), so the
+harness's API keys and tokens are not handed to the commands.
+"""
+import codecs
+import contextlib
+import contextvars
+import os
+import re
+import secrets
+import selectors
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+MAX_OUTPUT_CHARS = 30000
+MAX_TIMEOUT_MS = 600000
+# The tool description promises 30 minutes when no timeout is given, but no call may outlast the maximum.
+DEFAULT_TIMEOUT_MS = MAX_TIMEOUT_MS
+BANNED_COMMANDS = {"alias", "curl", "curlie", "wget", "axel", "aria2c", "nc", "telnet", "lynx", "w3m", "links",
+                   "httpie", "xh", "http-prompt", "chrome", "firefox", "safari"}
+# Words that run the command after them.
+_PREFIXES = {"env", "command", "exec", "nohup", "time", "nice", "sudo", "xargs", "builtin", "timeout", "stdbuf"}
+# Their options that take the next word as a value, which is not the command.
+_PREFIX_OPTIONS = {
+    "sudo": {"-u", "--user", "-g", "--group", "-C", "--close-from", "-D", "--chdir", "-h", "--host", "-p", "--prompt",
+             "-U", "--other-user", "-r", "--role", "-t", "--type", "-T", "--command-timeout"},
+    "env": {"-u", "--unset", "-C", "--chdir", "-S", "--split-string"},
+    "exec": {"-a"},
+    "time": {"-f", "--format", "-o", "--output"},
+    "nice": {"-n", "--adjustment"},
+    "timeout": {"-s", "--signal", "-k", "--kill-after"},
+    "stdbuf": {"-i", "--input", "-o", "--output", "-e", "--error"},
+    "xargs": {"-a", "--arg-file", "-d", "--delimiter", "-E", "-I", "-L", "--max-lines", "-n", "--max-args", "-P",
+              "--max-procs", "-s", "--max-chars"},
+}
+# Operands that come before the command: `timeout DURATION COMMAND`.
+_PREFIX_OPERANDS = {"timeout": 1}
+_SHELLS = {"sh", "bash", "dash", "zsh", "ksh", "mksh"}
+_SEPARATORS = re.compile(r"[;&|()\n`]|\$\(")
+_ASSIGNMENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+_SCRIPT_OPTION = re.compile(r"^-[A-Za-z]*c[A-Za-z]*$")
+# What a session inherits from the harness's environment, besides the LC_* locale variables.
+SHELL_ENVIRONMENT = ("PATH", "HOME", "USER", "LOGNAME", "SHELL", "LANG", "LANGUAGE", "TERM", "TMPDIR", "TZ")
+
+_conversation = contextvars.ContextVar("bash_conversation", default=None)
+_pools = weakref.WeakSet()
+
+@contextlib.contextmanager
+def conversation():
+    """Give the BashTool calls made inside the block a shell session of their own, closed afterwards."""
+    key = object()
+    token = _conversation.set(key)
+    try:
+        yield key
+    finally:
+        _conversation.reset(token)
+        for pool in list(_pools):
+            pool.release(key)
+
+def shell_environment(environ=None):
+    """The SHELL_ENVIRONMENT and LC_* variables of `environ` (default os.environ)."""
+    environ = os.environ if environ is None else environ
+    return {name: value for name, value in environ.items() if name in SHELL_ENVIRONMENT or name.startswith("LC_")}
+
+def banned_command(command):
+    """The first banned program `command` would run, or None.
+
+    Wrappers such as sudo, env and timeout are looked through, along with
+    their options' values. The arguments of `eval`, the string of `env -S`
+    and the script of a shell's -c option are checked as commands of their
+    own.
+    """
+    for segment in _SEPARATORS.split(command):
+        try:
+            words = shlex.split(segment)
+        except ValueError:
+            # A quote cut in two by a separator: fall back to plain words.
+            words = [word.strip("'\"") for word in segment.split()]
+        position, prefix, operands = 0, None, 0
+        while position < len(words):
+            word = words[position]
+            position += 1
+            if _ASSIGNMENT.match(word):
+                continue
+            if word in _PREFIXES:
+                prefix, operands = word, _PREFIX_OPERANDS.get(word, 0)
+                continue
+            if word.startswith("-"):
+                if word in _PREFIX_OPTIONS.get(prefix, ()) and position < len(words):
+                    value = words[position]
+                    position += 1
+                    banned = word in ("-S", "--split-string") and banned_command(value)
+                    if banned:
+                        return banned
+                continue
+            if operands:
+                operands -= 1
+                continue
+            program = os.path.basename(word)
+            if program in BANNED_COMMANDS:
+                return program
+            inner = None
+            if program == "eval":
+                inner = " ".join(words[position:])
+            elif program in _SHELLS:
+                rest = words[position:]
+                inner = next((rest[index + 1] for index, option in enumerate(rest[:-1])
+                              if _SCRIPT_OPTION.match(option)), None)
+            banned = inner and banned_command(inner)
+            if banned:
+                return banned
+            break
+    return None
+
+class _Capture:
+    """Output of one stream: the head and tail within the cap, and how much was dropped between them."""
+    def __init__(self, max_chars, on_output=None):
+        self.half = max_chars // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+        self.on_output = on_output
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") if on_output else None
+
+    def write(self, data):
+        if self.on_output is not None:
+            self.on_output(self._decoder.decode(data))
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.half:
+            self.dropped += len(self.tail) - self.half
+            del self.tail[:len(self.tail) - self.half]
+
+    def text(self):
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{head}\n... ({self.dropped} bytes of output truncated) ...\n{tail}"
+        return head + tail
+
+class _Stream:
+    """One pipe of a session, read until the command's end marker shows up."""
+    def __init__(self, fd, marker):
+        self.fd = fd
+        self.marker = b"\n" + marker
+        self.pending = b""
+
+    def start(self, capture):
+        self.capture = capture
+        self.trailer = None
+
+    def feed(self, data):
+        """Take data read from the pipe; returns True once the marker line is complete."""
+        self.pending += data
+        if self.trailer is None:
+            found = self.pending.find(self.marker)
+            if found < 0:
+                # Keep what could be the start of a marker split across reads.
+                keep = len(self.marker) - 1
+                if len(self.pending) > keep:
+                    self.capture.write(self.pending[:-keep])
+                    self.pending = self.pending[-keep:]
+                return False
+            self.capture.write(self.pending[:found])
+            self.trailer = b""
+            self.pending = self.pending[found + len(self.marker):]
+        end = self.pending.find(b"\n")
+        if end < 0:
+            return False
+        self.trailer = self.pending[:end]
+        self.pending = self.pending[end + 1:]
+        return True
+
+class ShellSession:
+    """A bash process kept alive across commands."""
+    def __init__(self, cwd, env=None, shell="bash"):
+        self.cwd = cwd
+        self.env = env
+        self.shell = shell
+        self.commands = 0
+        self.lock = threading.Lock()
+        self._start()
+
+    def _start(self):
+        self.marker = f"__BASH_TOOL_{secrets.token_hex(8)}__".encode()
+        self.process = subprocess.Popen([self.shell, "--noprofile", "--norc"], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=self.cwd,
+                                        env=self.env, start_new_session=True)
+        self.streams = {}
+        for name, pipe in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            os.set_blocking(pipe.fileno(), False)
+            self.streams[name] = _Stream(pipe.fileno(), self.marker)
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def _script(self, command):
+        delimiter = f"__BASH_TOOL_COMMAND_{secrets.token_hex(8)}__"
+        marker = self.marker.decode()
+        return (f"IFS= read -r -d '' __bash_tool_command <<'{delimiter}'\n{command}\n{delimiter}\n"
+                f"eval \"$__bash_tool_command\" < /dev/null\n"
+                f"printf '\\n{marker} %d %s\\n' \"$?\" \"$PWD\"\n"
+                f"printf '\\n{marker}\\n' >&2\n")
+
+    def run(self, command, timeout=None, max_output_chars=MAX_OUTPUT_CHARS, on_output=None):
+        """Run a command: (stdout, stderr, exit code or None, timed out, whether the shell was stopped).
+
+        The exit code is None on a timeout, and when the command closed the
+        shell's stdout, which carries it.
+        """
+        with self.lock:
+            if not self.alive:
+                self._start()
+            self.commands += 1
+            captures = {name: _Capture(max_output_chars // 2, on_output) for name in self.streams}
+            for name, stream in self.streams.items():
+                stream.start(captures[name])
+            try:
+                self.process.stdin.write(self._script(command).encode("utf-8"))
+                self.process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass
+            deadline = time.monotonic() + timeout if timeout is not None else None
+            done, closed, exited = set(), set(), False
+            with selectors.DefaultSelector() as selector:
+                for name, stream in self.streams.items():
+                    selector.register(stream.fd, selectors.EVENT_READ, name)
+                while len(done) + len(closed) < len(self.streams):
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self.kill()
+                        return (captures["stdout"].text(), captures["stderr"].text(), None, True, True)
+                    events = selector.select(remaining)
+                    for key, _ in events:
+                        try:
+                            data = os.read(key.fd, 1 << 16)
+                        except BlockingIOError:
+                            continue
+                        if not data:
+                            selector.unregister(key.fd)
+                            closed.add(key.data)
+                            # End of file is the shell exiting, or a command closing or redirecting the
+                            # shell's own output (`exec >log`); only the first means no marker is coming.
+                            exited = self._exited(remaining)
+                            break
+                        if self.streams[key.data].feed(data):
+                            selector.unregister(key.fd)
+                            done.add(key.data)
+                    if exited:
+                        break
+            if exited or closed:
+                # A background job may still hold the pipes open, so take what is already there
+                # rather than wait for it.
+                for name, stream in self.streams.items():
+                    if name not in done:
+                        try:
+                            stream.pending += os.read(stream.fd, 1 << 20)
+                        except (BlockingIOError, OSError):
+                            pass
+                        captures[name].write(stream.pending)
+            if exited:
+                code = self.process.wait()
+                self.kill()
+                return (captures["stdout"].text(), captures["stderr"].text(), code, False, True)
+            if closed:
+                # The shell lives on but can no longer report where a command ends: replace it.
+                code = self._status() if "stdout" in done else None
+                self.kill()
+                return (captures["stdout"].text(), captures["stderr"].text(), code, False, True)
+            return (captures["stdout"].text(), captures["stderr"].text(), self._status(), False, False)
+
+    def _status(self):
+        """The exit status from the stdout marker line, "<marker> <status> <cwd>", noting the cwd."""
+        status, _, cwd = self.streams["stdout"].trailer.decode("utf-8", errors="replace")[1:].partition(" ")
+        self.cwd = cwd or self.cwd
+        return int(status)
+
+    def _exited(self, remaining):
+        """Whether the shell has exited, giving it a moment since its pipes close just before it ends."""
+        try:
+            self.process.wait(timeout=0.1 if remaining is None else max(0.0, min(0.1, remaining)))
+        except subprocess.TimeoutExpired:
+            return False
+        return True
+
+    def kill(self):
+        """Kill the shell and everything it started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            pipe.close()
+
+    def close(self):
+        if self.alive:
+            self.kill()
+
+class ShellPool:
+    """Shell sessions per conversation, with `spare` sessions started ahead of time.
+
+    At most `max_sessions` are kept; past that, the least recently used
+    conversation's shell is closed and it gets a new one on its next command.
+    Shells start with `env`, by default shell_environment().
+    """
+    def __init__(self, cwd=".", spare=2, max_sessions=32, env=None):
+        self.cwd = os.path.realpath(cwd)
+        self.spare = spare
+        self.max_sessions = max_sessions
+        self.env = shell_environment() if env is None else env
+        self.sessions = OrderedDict()
+        self.stats = {"started": 0, "warm": 0, "cold": 0}
+        self._spares = []
+        self._closed = False
+        self._lock = threading.Lock()
+        _pools.add(self)
+        self._refill()
+
+    def _new_session(self):
+        self.stats["started"] += 1
+        return ShellSession(self.cwd, self.env)
+
+    def _refill(self):
+        """Start sessions in the background until `spare` are ready."""
+        def refill():
+            while True:
+                with self._lock:
+                    if self._closed or len(self._spares) >= self.spare:
+                        return
+                session = self._new_session()
+                with self._lock:
+                    if self._closed:
+                        session.close()
+                        return
+                    self._spares.append(session)
+        threading.Thread(target=refill, name="shell-pool", daemon=True).start()
+
+    def session(self, key):
+        """The session of conversation `key`, taking a spare one for a new conversation."""
+        evicted = []
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is not None:
+                self.sessions.move_to_end(key)
+                return session
+            if self._spares:
+                session = self._spares.pop()
+                self.stats["warm"] += 1
+            while len(self.sessions) >= self.max_sessions:
+                evicted.append(self.sessions.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+        if session is None:
+            session = self._new_session()
+            self.stats["cold"] += 1
+        with self._lock:
+            self.sessions[key] = session
+        self._refill()
+        return session
+
+    def release(self, key):
+        """Close the session of a finished conversation."""
+        with self._lock:
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            sessions = list(self.sessions.values()) + self._spares
+            self.sessions.clear()
+            self._spares = []
+        for session in sessions:
+            session.close()
+
+class BashTool:
+    """BashTool: {"command", "timeout"} -> output and exit code from the conversation's shell session."""
+    def __init__(self, root=".", pool=None, max_output_chars=MAX_OUTPUT_CHARS, default_timeout_ms=DEFAULT_TIMEOUT_MS,
+                 on_output=None):
+        self.pool = pool or ShellPool(root)
+        self.max_output_chars = max_output_chars
+        self.default_timeout_ms = min(default_timeout_ms, MAX_TIMEOUT_MS)
+        self.on_output = on_output
+
+    def __call__(self, arguments):
+        command = arguments["command"]
+        if not command or not command.strip():
+            return "Error: Empty command"
+        banned = banned_command(command)
+        if banned:
+            return f"Error: '{banned}' is not allowed in BashTool commands"
+        timeout_ms = arguments.get("timeout")
+        if timeout_ms is None:
+            timeout_ms = self.default_timeout_ms
+        else:
+            try:
+                timeout_ms = min(float(timeout_ms), MAX_TIMEOUT_MS)
+            except (TypeError, ValueError):
+                return f"Error: timeout must be a number of milliseconds, got {timeout_ms!r}"
+            if timeout_ms <= 0:
+                return f"Error: timeout must be positive, got {timeout_ms:g}"
+        session = self.pool.session(_conversation.get())
+        stdout, stderr, code, timed_out, restarted = session.run(command, timeout_ms / 1000, self.max_output_chars,
+                                                                 self.on_output)
+        parts = [text.rstrip("\n") for text in (stdout, stderr) if text.strip()]
+        if timed_out:
+            parts.append(f"Command timed out after {timeout_ms:g} ms")
+        elif code is not None:
+            parts.append(f"Exit code: {code}")
+        if restarted:
+            parts.append(f"(The shell was stopped. The next command runs in a new shell in {session.cwd}, "
+                         "without the environment changes of earlier commands.)")
+        return "\n".join(parts)
+
+    def close(self):
+        self.pool.close()
@@ -0,0 +1,431 @@
+"""File tools over real files: FileReadTool, FileEditTool and FileWriteTool.
+
+FileReadTool reads a window of lines (`offset`, 1-indexed, and `limit`,
+2000 by default) out of a memory-mapped file, in `cat -n` format. Lines
+longer than 2000 characters are cut, decoding only the bytes that are
+shown, so neither a huge file nor a huge line is ever copied whole.
+
+Finding line N needs the offsets of the newlines before it. A LineIndex
+records the start offset of every line, but only as far as reads have
+gone: reading the head of a 10 GB log scans one chunk, not the file.
+Indexes are cached per file across calls (LineIndexCache), so paging
+through a file costs one scan in total and every later offset is an
+array lookup. A cached index is kept while the file's inode, size and
+mtime are unchanged, and also when it only grew, as logs do; that is
+checked by comparing the bytes just before the end of the scanned part.
+Anything else builds a new index.
+
+FileEditTool replaces old_string when it occurs exactly once, and creates
+the file when old_string is empty. Uniqueness costs one pass over the
+file: the search for a second occurrence starts where the first ended.
+FileWriteTool replaces a file's content. Both write a temporary file next
+to the target and rename it over it, keeping the file's mode, so a file is
+never seen half-written. Consecutive FileEditTool calls of one turn come
+as a batch (see tool_executor): the edits are applied in memory, in
+order, with one read and one write per file, and each call still gets the
+result it would have had alone.
+"""
+import itertools
+import mmap
+import os
+import stat as stat_module
+import tempfile
+import threading
+from array import array
+from collections import OrderedDict
+
+MAX_LINES = 2000
+MAX_LINE_CHARS = 2000
+MAX_OUTPUT_CHARS = 256 * 1024
+SCAN_CHUNK = 1 << 20
+TAIL_BYTES = 4096
+BINARY_SNIFF_BYTES = 8192
+
+# Read once: new files get the mode open() would give them, 0o666 minus the umask.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+class LineIndex:
+    """Start offsets of a file's lines, scanned on demand."""
+    def __init__(self, identity):
+        self.identity = identity
+        self.version = None
+        self.size = 0
+        self.starts = array("Q", [0])
+        self.scanned = 0
+        # The bytes just before `scanned`, to tell an appended file from a rewritten one.
+        self.tail = b""
+        self.lock = threading.Lock()
+
+    def still_valid(self, identity, version, data):
+        """Whether the file, now at `version` (size, mtime_ns), is the indexed one or an extension of it."""
+        if identity != self.identity:
+            return False
+        if version == self.version:
+            return True
+        if self.version is None or version[0] <= self.version[0]:
+            return False
+        return data[self.scanned - len(self.tail):self.scanned] == self.tail
+
+    def extend(self, data, size, line):
+        """Scan until the start of 0-based `line` is known or the file ends."""
+        self.size = size
+        starts = self.starts
+        while len(starts) <= line and self.scanned < size:
+            chunk = data[self.scanned:min(size, self.scanned + SCAN_CHUNK)]
+            end = chunk.rfind(b"\n")
+            if end < 0:
+                # No newline in a whole chunk: one long line, or the last one.
+                self.scanned += len(chunk)
+                continue
+            pieces = chunk[:end].split(b"\n")
+            # Each piece's length plus its newline, summed: the starts of the lines after them.
+            starts.extend(itertools.islice(
+                itertools.accumulate((len(piece) + 1 for piece in pieces), initial=self.scanned), 1, None))
+            self.scanned += end + 1
+        self.tail = bytes(data[max(0, self.scanned - TAIL_BYTES):self.scanned])
+
+    @property
+    def complete(self):
+        return self.scanned >= self.size
+
+    def line_count(self):
+        """Lines known so far; the total once complete."""
+        starts = self.starts
+        return len(starts) - (starts[-1] >= self.size)
+
+    def span(self, line):
+        """(start, end) bytes of 0-based `line`, without its newline."""
+        start = self.starts[line]
+        end = self.starts[line + 1] - 1 if line + 1 < len(self.starts) else self.size
+        return start, end
+
+class LineIndexCache:
+    """LineIndexes of recently read files, bounded by file count and total offsets held."""
+    def __init__(self, max_files=64, max_offsets=8 * 1024 * 1024):
+        self.max_files = max_files
+        self.max_offsets = max_offsets
+        self.indexes = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def get(self, path, stat, data):
+        identity = (stat.st_dev, stat.st_ino)
+        version = (stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            index = self.indexes.get(path)
+            if index is not None and index.still_valid(identity, version, data):
+                self.indexes.move_to_end(path)
+                self.stats["hits"] += 1
+            else:
+                self.stats["misses"] += 1
+                index = self.indexes[path] = LineIndex(identity)
+            index.version = version
+            return index
+
+    def trim(self):
+        with self._lock:
+            held = sum(len(index.starts) for index in self.indexes.values())
+            while len(self.indexes) > 1 and (len(self.indexes) > self.max_files or held > self.max_offsets):
+                _, index = self.indexes.popitem(last=False)
+                held -= len(index.starts)
+
+    def discard(self, path):
+        with self._lock:
+            self.indexes.pop(path, None)
+
+def _number(value, name, minimum):
+    try:
+        number = int(float(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    return max(number, minimum)
+
+class FileReadTool:
+    """FileReadTool: {"file_path", "offset", "limit"} -> numbered lines of the file.
+
+    Relative paths resolve against `root`.
+    """
+    side_effect_free = True
+
+    def __init__(self, root=".", cache=None, max_lines=MAX_LINES, max_line_chars=MAX_LINE_CHARS,
+                 max_output_chars=MAX_OUTPUT_CHARS):
+        self.root = os.path.realpath(root)
+        self.cache = cache or LineIndexCache()
+        self.max_lines = max_lines
+        self.max_line_chars = max_line_chars
+        self.max_output_chars = max_output_chars
+
+    def read(self, path, offset=1, limit=None):
+        """([(line number, text, truncated)], line count or None if not known yet, bytes in the file)."""
+        limit = limit or self.max_lines
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                return [], 0, 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                size = len(data)
+                if b"\0" in data[:BINARY_SNIFF_BYTES]:
+                    raise ValueError("binary file")
+                index = self.cache.get(path, stat, data)
+                with index.lock:
+                    # One past the window, to know where its last line ends and whether more follow.
+                    index.extend(data, size, offset - 1 + limit)
+                    lines = []
+                    for line in range(offset - 1, min(offset - 1 + limit, index.line_count())):
+                        start, end = index.span(line)
+                        raw = data[start:min(end, start + 4 * self.max_line_chars)]
+                        text = raw.decode("utf-8", errors="replace").rstrip("\r")
+                        truncated = end - start > len(raw) or len(text) > self.max_line_chars
+                        lines.append((line + 1, text[:self.max_line_chars], truncated))
+                    count = index.line_count() if index.complete else None
+        self.cache.trim()
+        return lines, count, size
+
+    def __call__(self, arguments):
+        file_path = arguments["file_path"]
+        path = os.path.join(self.root, file_path)
+        try:
+            offset = _number(arguments.get("offset") or 1, "offset", 1)
+            limit = min(_number(arguments.get("limit") or self.max_lines, "limit", 1), self.max_lines)
+        except ValueError as e:
+            return f"Error: {e}"
+        if os.path.isdir(path):
+            return f"Error: {file_path} is a directory, not a file"
+        try:
+            lines, count, size = self.read(path, offset, limit)
+        except FileNotFoundError:
+            return f"Error: File not found: {file_path}"
+        except ValueError:
+            return f"Error: {file_path} is a binary file and cannot be shown as text"
+        except OSError as e:
+            return f"Error: Cannot read {file_path}: {e.strerror}"
+        if size == 0:
+            return "(File is empty)"
+        if not lines:
+            return f"Error: offset {offset} is past the end of the file ({count} lines)"
+        output, used = [], 0
+        for number, text, truncated in lines:
+            line = f"{number:6}\t{text}" + ("... (line truncated)" if truncated else "")
+            if output and used + len(line) > self.max_output_chars:
+                break
+            output.append(line)
+            used += len(line) + 1
+        last = lines[len(output) - 1][0]
+        if count is None or last < count:
+            total = f" of {count}" if count is not None else ""
+            output.append(f"(Showing lines {offset}-{last}{total}. Use offset={last + 1} to read more.)")
+        return "\n".join(output)
+
+def write_atomically(path, data):
+    """Replace `path` (following symlinks) with `data` through a temporary file and a rename."""
+    path = os.path.realpath(path)
+    directory, name = os.path.split(path)
+    try:
+        mode = stat_module.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        os.makedirs(directory, exist_ok=True)
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            os.fchmod(f.fileno(), mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _outside(root, path):
+    """Whether `path` resolves to somewhere outside `root`; the writing tools refuse such paths."""
+    path = os.path.realpath(path)
+    return path != root and not path.startswith(root.rstrip(os.sep) + os.sep)
+
+class FileEditTool:
+    """FileEditTool: {"file_path", "old_string", "new_string"} -> replace one unique occurrence, or create.
+
+    Relative paths resolve against `root`, and nothing outside it is changed.
+    """
+    def __init__(self, root="."):
+        self.root = os.path.realpath(root)
+        self.stats = {"edits": 0, "reads": 0, "writes": 0}
+
+    def _apply(self, file_path, edits):
+        """Apply (old_string, new_string) edits to one file in order, with one read and one write."""
+        path = os.path.join(self.root, file_path)
+        if _outside(self.root, path):
+            return [f"Error: {file_path} is outside {self.root}"] * len(edits)
+        try:
+            with open(path, "rb") as f:
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                del data[f.readinto(data):]
+            self.stats["reads"] += 1
+        except FileNotFoundError:
+            data = None
+        except IsADirectoryError:
+            return [f"Error: {file_path} is a directory, not a file"] * len(edits)
+        results, changed = [], False
+        for old_string, new_string in edits:
+            self.stats["edits"] += 1
+            if old_string == new_string:
+                results.append("Error: No changes to make: old_string and new_string are exactly the same")
+                continue
+            old, new = old_string.encode("utf-8"), new_string.encode("utf-8")
+            if not old:
+                if data is not None:
+                    results.append(f"Error: Cannot create {file_path}: the file already exists")
+                    continue
+                data, changed = bytearray(new), True
+                results.append(f"Successfully created file: {file_path}")
+                continue
+            if data is None:
+                results.append(f"Error: File not found: {file_path}")
+                continue
+            first = data.find(old)
+            if first < 0:
+                results.append(f"Error: old_string not found in {file_path}")
+                continue
+            # Overlapping occurrences count too: either would be a valid place for the edit.
+            if data.find(old, first + 1) >= 0:
+                results.append(f"Error: old_string matches more than one location in {file_path}; "
+                               "include more surrounding context to make it unique")
+                continue
+            data[first:first + len(old)] = new
+            changed = True
+            results.append(f"Successfully edited file: {file_path}")
+        if changed:
+            try:
+                write_atomically(path, data)
+                self.stats["writes"] += 1
+            except OSError as e:
+                failed = f"Error: Cannot write {file_path}: {e.strerror}"
+                return [failed if result.startswith("Successfully") else result for result in results]
+        return results
+
+    def call_batch(self, arguments_list):
+        """Results of consecutive calls, as if run one by one; one read and one write per file."""
+        by_file = OrderedDict()
+        for position, arguments in enumerate(arguments_list):
+            key = os.path.realpath(os.path.join(self.root, arguments["file_path"]))
+            by_file.setdefault(key, []).append(
+                (position, arguments["file_path"], arguments["old_string"], arguments["new_string"]))
+        results = [None] * len(arguments_list)
+        for edits in by_file.values():
+            file_path = edits[0][1]
+            for (position, _, _, _), result in zip(edits, self._apply(file_path, [edit[2:] for edit in edits])):
+                results[position] = result
+        return results
+
+    def __call__(self, arguments):
+        return self.call_batch([arguments])[0]
+
+class FileWriteTool:
+    """FileWriteTool: {"file_path", "content"} -> the file replaced atomically, created with its parents if needed.
+
+    Relative paths resolve against `root`, and nothing outside it is changed.
+    """
+    def __init__(self, root="."):
+        self.root = os.path.realpath(root)
+
+    def __call__(self, arguments):
+        file_path = arguments["file_path"]
+        content = arguments["content"]
+        path = os.path.join(self.root, file_path)
+        if _outside(self.root, path):
+            return f"Error: {file_path} is outside {self.root}"
+        if os.path.isdir(path):
+            return f"Error: {file_path} is a directory, not a file"
+        try:
+            write_atomically(path, content.encode("utf-8"))
+        except OSError as e:
+            return f"Error: Cannot write {file_path}: {e.strerror}"
+        return f"Successfully wrote to file: {file_path}"
+
+def benchmark_edits(directory, size_mb=8, edits=50):
+    """Time `edits` edits to one file of `size_mb` MB: naive read/count/replace/write per edit, FileEditTool
+    per edit, and FileEditTool batched. Returns {approach: seconds}; all three must leave the same file."""
+    import time
+
+    lines = []
+    total = 0
+    while total < size_mb * 1024 * 1024:
+        lines.append(f"value_{len(lines):08d} = compute({len(lines)}, scale=0.5)  # generated\n")
+        total += len(lines[-1])
+    original = "".join(lines)
+    step = len(lines) // edits
+    changes = [(lines[i * step], lines[i * step].replace("scale=0.5", "scale=0.25")) for i in range(edits)]
+    tool = FileEditTool(directory)
+    timings, results = {}, {}
+
+    def naive(path):
+        for old, new in changes:
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+            if content.count(old) != 1:
+                raise AssertionError(old)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content.replace(old, new, 1))
+
+    def per_call(path):
+        for old, new in changes:
+            tool({"file_path": path, "old_string": old, "new_string": new})
+
+    def batched(path):
+        tool.call_batch([{"file_path": path, "old_string": old, "new_string": new} for old, new in changes])
+
+    for name, run in (("naive", naive), ("per call", per_call), ("batched", batched)):
+        path = os.path.join(directory, f"bench-{name.replace(' ', '-')}.py")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(original)
+        start = time.perf_counter()
+        run(path)
+        timings[name] = time.perf_counter() - start
+        with open(path, encoding="utf-8") as f:
+            results[name] = f.read()
+        os.unlink(path)
+    if len(set(results.values())) != 1:
+        raise AssertionError("edit approaches disagree")
+    return timings
+
+def main(argv=None):
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description="Read a file with FileReadTool, or benchmark the file tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    read = commands.add_parser("read", help="Read a file, timing repeated reads")
+    read.add_argument("file_path")
+    read.add_argument("--offset", type=int)
+    read.add_argument("--limit", type=int)
+    read.add_argument("--repeat", type=int, default=1, help="Run the read this many times and report timings")
+    bench = commands.add_parser("bench-edit", help="Compare per-call and batched FileEditTool on a large file")
+    bench.add_argument("--size-mb", type=float, action="append", help="File size; repeatable (default 1, 8, 32)")
+    bench.add_argument("--edits", type=int, default=50, help="Edits per file")
+    bench.add_argument("--dir", help="Where to write the files (default a temporary directory)")
+    args = parser.parse_args(argv)
+
+    if args.command == "bench-edit":
+        with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+            for size_mb in args.size_mb or [1, 8, 32]:
+                timings = benchmark_edits(directory, size_mb, args.edits)
+                print(f"{size_mb:g} MB, {args.edits} edits: "
+                      + ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in timings.items()))
+        return
+
+    tool = FileReadTool()
+    arguments = {"file_path": os.path.abspath(args.file_path), "offset": args.offset, "limit": args.limit}
+    for attempt in range(args.repeat):
+        start = time.perf_counter()
+        output = tool(arguments)
+        elapsed = time.perf_counter() - start
+        if attempt == 0:
+            print(output)
+        print(f"read {attempt + 1}: {elapsed * 1000:.1f} ms", file=sys.stderr)
+    print(f"line index cache: {tool.cache.stats}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
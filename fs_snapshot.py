@@ -0,0 +1,411 @@
+"""In-memory snapshot of a directory tree, shared by the file-search tools.
+
+GlobTool, LSTool and GrepTool's index all need the names, mtimes and sizes
+under the same tree, turn after turn. A TreeSnapshot lists it once, with
+os.scandir on a thread pool one directory level at a time, and then only
+re-lists directories that changed:
+
+- On Linux, inotify (through ctypes, no dependency) reports every
+  directory whose entries were created, deleted, moved or modified, so a
+  refresh only drains the pending events.
+- Elsewhere, or once the inotify watch limit is reached, each refresh
+  (at most every `refresh_interval` seconds) stats every directory and
+  re-lists those whose mtime moved. Adding, removing or renaming an entry
+  moves it, and so does saving through a temporary file and a rename, as
+  most editors do. An in-place write to an existing file is only seen once
+  its directory changes for another reason.
+
+Version-control directories are never listed.
+"""
+import concurrent.futures
+import ctypes
+import ctypes.util
+import errno
+import os
+import re
+import struct
+import sys
+import threading
+import time
+
+SKIP_DIRS = {".git", ".hg", ".svn"}
+DIRECTORY, FILE, OTHER = "directory", "file", "other"
+
+def expand_braces(pattern):
+    """Expand shell-style braces: "*.{ts,tsx}" -> ["*.ts", "*.tsx"], nesting allowed."""
+    depth = 0
+    for index, char in enumerate(pattern):
+        if char == "{":
+            if depth == 0:
+                start = index
+            depth += 1
+        elif char == "}" and depth:
+            depth -= 1
+            if depth == 0:
+                options, level, part = [], 0, []
+                for inner in pattern[start + 1:index]:
+                    if inner == "," and level == 0:
+                        options.append("".join(part))
+                        part = []
+                        continue
+                    level += inner == "{"
+                    level -= inner == "}"
+                    part.append(inner)
+                options.append("".join(part))
+                if len(options) == 1:
+                    break
+                prefix, suffix = pattern[:start], pattern[index + 1:]
+                return [expanded for option in options for expanded in expand_braces(prefix + option + suffix)]
+    return [pattern]
+
+def _glob_to_regex(pattern):
+    parts = []
+    index = 0
+    while index < len(pattern):
+        char = pattern[index]
+        if pattern.startswith("**", index):
+            at_start = index == 0 or pattern[index - 1] == "/"
+            if at_start and pattern.startswith("**/", index):
+                parts.append("(?:.*/)?")
+                index += 3
+                continue
+            if at_start and index + 2 == len(pattern):
+                parts.append(".*")
+                index += 2
+                continue
+            parts.append("[^/]*")
+            index += 2
+            continue
+        if char == "*":
+            parts.append("[^/]*")
+        elif char == "?":
+            parts.append("[^/]")
+        elif char == "[":
+            close = pattern.find("]", index + 2)
+            if close < 0:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[index + 1:close]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                index = close
+        else:
+            parts.append(re.escape(char))
+        index += 1
+    return "".join(parts)
+
+def glob_regex(pattern):
+    """Compile a glob with "**", "*", "?", [classes] and {braces} into a regex over "/"-separated relative paths.
+
+    "**/" matches any number of directories, including none, and a
+    trailing "/**" everything below a directory.
+    """
+    return re.compile("(?:" + "|".join(_glob_to_regex(expanded) for expanded in expand_braces(pattern)) + r")\Z")
+
+def literal_prefix(pattern):
+    """The leading directories of a glob that contain no wildcard, e.g. "src/app" for "src/app/**/*.ts"."""
+    directories = []
+    for part in pattern.split("/")[:-1]:
+        if any(char in part for char in "*?[{"):
+            break
+        directories.append(part)
+    return "/".join(directories)
+
+def literal_suffixes(pattern):
+    """The literal endings every match of a glob has, e.g. (".ts", ".tsx") for "**/*.{ts,tsx}", or None."""
+    suffixes = []
+    for expanded in expand_braces(pattern):
+        name = expanded.rpartition("/")[2]
+        suffix = name[max(name.rfind(char) for char in "*?]") + 1:]
+        if not suffix:
+            return None
+        suffixes.append(suffix)
+    return tuple(suffixes)
+
+# inotify(7) constants.
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+IN_DELETE_SELF, IN_MOVE_SELF, IN_ONLYDIR = 0x400, 0x800, 0x1000000
+IN_Q_OVERFLOW, IN_IGNORED = 0x4000, 0x8000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+              | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """Non-blocking inotify descriptor; read() drains whatever events are pending."""
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        return wd
+
+    def remove_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """[(wd, mask)] of the pending events."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT.unpack_from(data, offset)
+                events.append((wd, mask))
+                offset += EVENT.size + length
+
+    def close(self):
+        os.close(self.fd)
+
+def list_directory(path):
+    """(mtime_ns, {name: (kind, mtime_ns, size)}) for one directory, or None if it is gone.
+
+    The kind is DIRECTORY for a directory (symlinks to directories are not
+    followed, so there are no cycles), FILE for a regular file or a
+    symlink to one, and OTHER for anything else.
+    """
+    entries = {}
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in SKIP_DIRS:
+                            continue
+                        kind, stat = DIRECTORY, entry.stat(follow_symlinks=False)
+                    elif entry.is_file():
+                        kind, stat = FILE, entry.stat()
+                    else:
+                        kind, stat = OTHER, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entries[entry.name] = (kind, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+    return mtime, entries
+
+class TreeSnapshot:
+    def __init__(self, root, workers=8, refresh_interval=1.0, use_inotify=True):
+        self.root = os.path.realpath(root)
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.directories = {}
+        self.version = 0
+        self.stats = {"listed": 0, "refreshes": 0}
+        self._watches = {}
+        self._watched = {}
+        self._files = None
+        self._refreshed = None
+        self._lock = threading.RLock()
+        self.inotify = None
+        if use_inotify and sys.platform.startswith("linux"):
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError):
+                self.inotify = None
+        self._list([""])
+
+    def _absolute(self, relative):
+        return os.path.join(self.root, relative) if relative else self.root
+
+    def _list(self, relatives):
+        """List directories and, level by level, everything below them."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while relatives:
+                below = []
+                for relative in relatives:
+                    self._forget(relative)
+                    # Watched before it is listed, so nothing created in between is missed.
+                    self._watch(relative)
+                for relative, listing in zip(relatives, pool.map(list_directory, map(self._absolute, relatives))):
+                    if listing is None:
+                        continue
+                    self.directories[relative] = listing
+                    self.stats["listed"] += 1
+                    below.extend(f"{relative}/{name}" if relative else name
+                                 for name, (kind, _, _) in listing[1].items() if kind == DIRECTORY)
+                relatives = below
+        self.version += 1
+        self._files = None
+
+    def _forget(self, relative):
+        """Drop a directory and everything below it from the snapshot."""
+        _, entries = self.directories.pop(relative, (None, {}))
+        for name, (kind, _, _) in entries.items():
+            if kind == DIRECTORY:
+                self._forget(f"{relative}/{name}" if relative else name)
+        wd = self._watched.pop(relative, None)
+        if wd is not None:
+            self._watches.pop(wd, None)
+            self.inotify.remove_watch(wd)
+
+    def _watch(self, relative):
+        if self.inotify is None:
+            return
+        try:
+            wd = self.inotify.add_watch(self._absolute(relative))
+        except OSError as e:
+            if e.errno not in (errno.ENOSPC, errno.ENOMEM):
+                return
+            # Out of watches (fs.inotify.max_user_watches): poll directory mtimes instead.
+            self.inotify.close()
+            self.inotify = None
+            self._watches, self._watched = {}, {}
+            return
+        self._watches[wd] = relative
+        self._watched[relative] = wd
+
+    def _changed_directories(self):
+        if self.inotify is not None:
+            changed = set()
+            for wd, mask in self.inotify.read():
+                if mask & IN_Q_OVERFLOW:
+                    return list(self.directories)
+                relative = self._watches.get(wd)
+                if relative is None:
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    self._watched.pop(relative, None)
+                # A directory that went away is re-listed from its parent.
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) and relative:
+                    relative = relative.rpartition("/")[0]
+                changed.add(relative)
+            return changed
+        def moved(relative):
+            try:
+                return os.stat(self._absolute(relative)).st_mtime_ns != self.directories[relative][0]
+            except OSError:
+                return True
+        relatives = list(self.directories)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return [relative for relative, changed in zip(relatives, pool.map(moved, relatives)) if changed]
+
+    def refresh(self, force=False):
+        """Re-list the directories that changed; returns how many there were."""
+        with self._lock:
+            # Draining inotify is cheap enough to do every time; polling is rate-limited.
+            if (self.inotify is None and not force and self._refreshed is not None
+                    and time.monotonic() - self._refreshed < self.refresh_interval):
+                return 0
+            changed = self._changed_directories()
+            self._refreshed = time.monotonic()
+            self.stats["refreshes"] += 1
+            # Parents first: re-listing one forgets the subdirectories that are gone.
+            for relative in sorted(changed, key=lambda relative: relative.count("/") if relative else -1):
+                if relative in self.directories or not relative:
+                    self._relist(relative)
+            return len(changed)
+
+    def _relist(self, relative):
+        listing = list_directory(self._absolute(relative))
+        if listing is None:
+            self._forget(relative)
+            if relative:
+                self._relist(relative.rpartition("/")[0])
+            return
+        previous = self.directories.get(relative)
+        self.directories[relative] = listing
+        self.stats["listed"] += 1
+        old_directories = {name for name, (kind, _, _) in (previous[1] if previous else {}).items() if kind == DIRECTORY}
+        new_directories = {name for name, (kind, _, _) in listing[1].items() if kind == DIRECTORY}
+        for name in old_directories - new_directories:
+            self._forget(f"{relative}/{name}" if relative else name)
+        added = [f"{relative}/{name}" if relative else name for name in new_directories - old_directories]
+        if added:
+            self._list(added)
+        self.version += 1
+        self._files = None
+
+    def files(self):
+        """[(relative path, mtime_ns, size)] of every FILE entry, cached until something changes."""
+        with self._lock:
+            if self._files is None:
+                files = []
+                for relative, (_, entries) in self.directories.items():
+                    prefix = relative + "/" if relative else ""
+                    files.extend((prefix + name, mtime, size) for name, (kind, mtime, size) in entries.items()
+                                 if kind == FILE)
+                self._files = files
+            return self._files
+
+    def entries(self, relative):
+        """{name: (kind, mtime_ns, size)} of a directory in the snapshot, or None."""
+        with self._lock:
+            listing = self.directories.get(relative)
+            return listing[1] if listing else None
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+class Snapshots:
+    """TreeSnapshots shared between tools: one per tree, reused for the directories below it.
+
+    A directory under `root` (the workspace) always resolves to the
+    snapshot of the whole workspace, so tools asking about different
+    subdirectories share one listing. Given a root, no snapshot is built
+    outside it.
+    """
+    def __init__(self, root=None, workers=8, refresh_interval=1.0, use_inotify=True):
+        self.root = os.path.realpath(root) if root is not None else None
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.use_inotify = use_inotify
+        self.snapshots = {}
+        self._lock = threading.Lock()
+
+    def find(self, directory):
+        """(snapshot, "/"-separated path of `directory` inside it) of an existing snapshot, or None."""
+        directory = os.path.realpath(directory)
+        with self._lock:
+            for root, snapshot in self.snapshots.items():
+                if directory == root:
+                    return snapshot, ""
+                if directory.startswith(root.rstrip(os.sep) + os.sep):
+                    return snapshot, os.path.relpath(directory, root).replace(os.sep, "/")
+        return None
+
+    def inside(self, directory):
+        """Whether `directory` is in the workspace, the only place snapshots are built when there is one."""
+        if self.root is None:
+            return True
+        directory = os.path.realpath(directory)
+        return directory == self.root or directory.startswith(self.root.rstrip(os.sep) + os.sep)
+
+    def get(self, directory):
+        """Like find(), but a missing snapshot is created; an existing one is refreshed.
+
+        A snapshot lists and watches its whole tree for as long as it lives,
+        so a directory outside the workspace raises ValueError rather than
+        get one: a search of "/" must not walk the disk.
+        """
+        found = self.find(directory)
+        if found is not None:
+            found[0].refresh()
+            return found
+        if not self.inside(directory):
+            raise ValueError(f"{directory} is outside {self.root}")
+        directory = os.path.realpath(directory)
+        root = self.root if self.root is not None else directory
+        snapshot = TreeSnapshot(root, self.workers, self.refresh_interval, self.use_inotify)
+        with self._lock:
+            # Another thread may have listed the same tree meanwhile; keep the first.
+            if self.snapshots.setdefault(root, snapshot) is not snapshot:
+                snapshot.close()
+        return self.find(directory)
+
+    def close(self):
+        for snapshot in self.snapshots.values():
+            snapshot.close()
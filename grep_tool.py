@@ -0,0 +1,582 @@
+"""GrepTool backed by a persistent trigram index.
+
+A TrigramIndex holds, for one directory tree, which files contain each
+three-byte sequence (ASCII-lowercased, so case-insensitive patterns can
+use it too). A search pulls the literal strings every match must contain
+out of the regex. Only files holding all of their trigrams are read, and
+those are verified on a process pool across cores, newest first, so
+results stream out in the modification-time order GrepTool promises. A
+search can stop as soon as it has enough files.
+
+The index lives in `index_dir` as two files per tree:
+
+- <key>.tri, the base: MAGIC, a "<II" struct (header length, trigram
+  count), a JSON header with the root and the file table ([path,
+  mtime_ns, size, indexed] per file id, null for deleted ids), padding to
+  4 bytes, then uint32 arrays of the sorted trigrams, their n + 1 offsets
+  into the postings, and the postings (file ids), all little-endian. It
+  is memory-mapped and posting lists are read straight out of the map.
+- <key>.delta, JSON with the root and the files changed since the base
+  was written, with their trigrams. A changed file keeps its id and its
+  base postings are masked.
+
+Before searching, the tree is re-walked (at most every
+`refresh_interval` seconds) and files whose mtime or size changed are
+re-indexed into the delta. Given an fs_snapshot.TreeSnapshot, the file
+list is read from the snapshot instead. With inotify the snapshot also
+sees in-place writes, so the walk is skipped while it has not changed;
+when it is polling directory mtimes it does not, and every listed file
+is stat'ed as before. Once the delta holds more than a fifth of the
+files, base and delta are compacted into a new base. Binary files are
+skipped like grep -I does. Files over `max_index_bytes` are not indexed,
+but every search reads them.
+"""
+import bisect
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
+import json
+import mmap
+import multiprocessing
+import os
+import re
+import struct
+import sys
+import threading
+import time
+from array import array
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+from fs_snapshot import Snapshots, expand_braces
+
+MAGIC = b"TRG1"
+HEADER = struct.Struct("<II")
+SKIP_DIRS = {".git", ".hg", ".svn", "node_modules", "__pycache__", ".venv", ".mypy_cache", ".pytest_cache"}
+BINARY_SNIFF_BYTES = 8192
+MAX_RESULTS = 100
+MAX_WORKERS = 8
+
+def trigrams(data):
+    """Trigrams of `data` (bytes) as ints, ASCII-lowercased."""
+    data = data.lower()
+    return {(a << 16) | (b << 8) | c for a, b, c in set(zip(data, data[1:], data[2:]))}
+
+def _is_binary(data):
+    return b"\0" in data[:BINARY_SNIFF_BYTES]
+
+def index_file(path, max_bytes):
+    """(trigrams, indexed) for one file; indexed is False for oversized files and None for binary ones."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            if _is_binary(head):
+                return None, None
+            if os.fstat(f.fileno()).st_size > max_bytes:
+                return None, False
+            return trigrams(head + f.read()), True
+    except OSError:
+        return None, None
+
+def _index_files(paths, max_bytes):
+    # Runs on the process pool: trigrams travel back as packed uint32 bytes.
+    results = []
+    for path in paths:
+        found, indexed = index_file(path, max_bytes)
+        results.append((array("I", sorted(found)).tobytes() if found else b"", indexed))
+    return results
+
+@functools.lru_cache(maxsize=64)
+def _compile(pattern, flags=0):
+    return re.compile(pattern, flags)
+
+def _verify(paths, pattern, flags=0):
+    """The paths whose text matches `pattern`; runs on the process pool."""
+    regex = _compile(pattern, flags)
+    matched = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        if not _is_binary(data) and regex.search(data.decode("utf-8", "replace")):
+            matched.append(path)
+    return matched
+
+# Plans are None (any file may match), a frozenset of trigrams that must all
+# be present, or ("and" | "or", [plans]).
+
+def _literal_plan(text, ignore_case):
+    if ignore_case and any(ord(char) > 127 or char in "iks" for char in text.lower()):
+        # Case folding maps these to non-ASCII letters too: i to İ and ı, k to the Kelvin sign, s to the long s.
+        return None
+    data = text.encode("utf-8")
+    if len(data) < 3:
+        return None
+    return frozenset(trigrams(data))
+
+def _and(plans):
+    plans = [plan for plan in plans if plan is not None]
+    if not plans:
+        return None
+    return plans[0] if len(plans) == 1 else ("and", plans)
+
+def _sequence_plan(items, ignore_case):
+    plans = []
+    run = []
+
+    def flush():
+        if run:
+            plans.append(_literal_plan("".join(run), ignore_case))
+            run.clear()
+
+    for op, value in items:
+        if op is sre_constants.LITERAL:
+            run.append(chr(value))
+            continue
+        if op is sre_constants.AT:
+            continue
+        flush()
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, _, sub = value
+            plans.append(_sequence_plan(sub, ignore_case or bool(add_flags & sre_constants.SRE_FLAG_IGNORECASE)))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and value[0] >= 1:
+            plans.append(_sequence_plan(value[2], ignore_case))
+        elif op is sre_constants.BRANCH:
+            branches = [_sequence_plan(branch, ignore_case) for branch in value[1]]
+            plans.append(None if any(branch is None for branch in branches) else ("or", branches))
+    flush()
+    return _and(plans)
+
+def query_plan(pattern, flags=0):
+    """What a file must contain for `pattern` to match it, as trigram sets."""
+    parsed = sre_parse.parse(pattern, flags)
+    return _sequence_plan(list(parsed), bool(parsed.state.flags & re.IGNORECASE))
+
+def _file_matches_plan(plan, present):
+    if plan is None:
+        return True
+    if isinstance(plan, frozenset):
+        return plan <= present
+    operation, plans = plan
+    check = all if operation == "and" else any
+    return check(_file_matches_plan(item, present) for item in plans)
+
+class TrigramIndex:
+    def __init__(self, root, index_dir, refresh_interval=1.0, max_index_bytes=4 * 1024 * 1024, pool=None,
+                 workers=1, snapshot=None):
+        self.root = os.path.realpath(root)
+        key = hashlib.sha1(self.root.encode("utf-8")).hexdigest()[:16]
+        os.makedirs(index_dir, exist_ok=True)
+        self.base_path = os.path.join(index_dir, key + ".tri")
+        self.delta_path = os.path.join(index_dir, key + ".delta")
+        self.refresh_interval = refresh_interval
+        self.max_index_bytes = max_index_bytes
+        self.pool = pool
+        self.workers = workers
+        self.snapshot = snapshot
+        self.snapshot_version = None
+        self.refreshed = None
+        self.stats = {"refreshes": 0, "reindexed": 0, "compactions": 0}
+        self._lock = threading.Lock()
+        self._load()
+
+    # Loading and saving
+
+    def _load(self):
+        self.files = []
+        self.ids = {}
+        self.delta = {}
+        self._map = None
+        self._views = []
+        self._trigrams = self._offsets = self._postings = array("I")
+        if os.path.exists(self.base_path):
+            with open(self.base_path, "rb") as f:
+                if f.read(len(MAGIC)) == MAGIC:
+                    header_length, count = HEADER.unpack(f.read(HEADER.size))
+                    header = json.loads(f.read(header_length))
+                    if header["root"] == self.root:
+                        self.files = header["files"]
+                        start = -(-(len(MAGIC) + HEADER.size + header_length) // 4) * 4
+                        self._map_arrays(f, start, count)
+        self.ids = {entry[0]: file_id for file_id, entry in enumerate(self.files) if entry}
+        if os.path.exists(self.delta_path):
+            with open(self.delta_path, encoding="utf-8") as f:
+                delta = json.load(f)
+            if delta["root"] == self.root:
+                self.delta = {path: entry and (entry[0], entry[1], entry[2], frozenset(entry[3]))
+                              for path, entry in delta["files"].items()}
+
+    def _map_arrays(self, f, start, count):
+        lengths = [count, count + 1]
+        if sys.byteorder != "little" or os.fstat(f.fileno()).st_size == start:
+            f.seek(start)
+            arrays = []
+            for length in lengths + [None]:
+                values = array("I")
+                values.frombytes(f.read(length * 4) if length is not None else f.read())
+                if sys.byteorder != "little":
+                    values.byteswap()
+                arrays.append(values)
+            self._trigrams, self._offsets, self._postings = arrays
+            return
+        self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        offsets_start = start + count * 4
+        postings_start = offsets_start + (count + 1) * 4
+        slices = [view[start:offsets_start], view[offsets_start:postings_start], view[postings_start:]]
+        self._trigrams, self._offsets, self._postings = [piece.cast("I") for piece in slices]
+        self._views = [self._trigrams, self._offsets, self._postings] + slices + [view]
+
+    def _close_map(self):
+        # Every view into the map has to be released before it can close.
+        self._trigrams = self._offsets = self._postings = array("I")
+        for view in self._views:
+            view.release()
+        self._views = []
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    @staticmethod
+    def _replace(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _save_delta(self):
+        files = {path: entry and [entry[0], entry[1], entry[2], sorted(entry[3])] for path, entry in self.delta.items()}
+        encoded = json.dumps({"root": self.root, "files": files}, separators=(",", ":"))
+        self._replace(self.delta_path, encoded.encode("utf-8"))
+
+    def _compact(self):
+        """Fold the delta into a new base file."""
+        files = [list(entry) if entry else None for entry in self.files]
+        changed = set()
+        postings = {}
+        for path, entry in self.delta.items():
+            file_id = self.ids.get(path)
+            if file_id is not None:
+                changed.add(file_id)
+            if entry is None:
+                if file_id is not None:
+                    files[file_id] = None
+                continue
+            if file_id is None:
+                file_id = len(files)
+                files.append(None)
+            files[file_id] = [path, entry[0], entry[1], entry[2]]
+            for trigram in entry[3]:
+                postings.setdefault(trigram, []).append(file_id)
+        for index, trigram in enumerate(self._trigrams):
+            kept = self._postings[self._offsets[index]:self._offsets[index + 1]].tolist()
+            if changed:
+                kept = [file_id for file_id in kept if file_id not in changed]
+            if kept:
+                postings.setdefault(trigram, []).extend(kept)
+        sorted_trigrams = array("I", sorted(postings))
+        offsets = array("I", [0])
+        flat = array("I")
+        for trigram in sorted_trigrams:
+            flat.extend(sorted(postings[trigram]))
+            offsets.append(len(flat))
+        header = json.dumps({"root": self.root, "files": files}, separators=(",", ":")).encode("utf-8")
+        padding = b"\0" * (-(len(MAGIC) + HEADER.size + len(header)) % 4)
+        if sys.byteorder != "little":
+            for values in (sorted_trigrams, offsets, flat):
+                values.byteswap()
+        self._close_map()
+        self._replace(self.base_path, b"".join([MAGIC, HEADER.pack(len(header), len(sorted_trigrams)), header,
+                                                padding, sorted_trigrams.tobytes(), offsets.tobytes(),
+                                                flat.tobytes()]))
+        if os.path.exists(self.delta_path):
+            os.unlink(self.delta_path)
+        self.stats["compactions"] += 1
+        self._load()
+
+    # Keeping up with the tree
+
+    def walk(self):
+        """{relative path: (mtime_ns, size)} of the regular files under the root."""
+        if self.snapshot is not None:
+            files = [(path, mtime, size) for path, mtime, size in self.snapshot.files()
+                     if not SKIP_DIRS.intersection(path.split("/")[:-1])]
+            if self.snapshot.inotify is not None:
+                return {path: (mtime, size) for path, mtime, size in files}
+            # A polled snapshot only re-lists directories whose mtime moved, so writes in place are not in it.
+            found = {}
+            for path, _, _ in files:
+                try:
+                    stat = os.stat(os.path.join(self.root, path), follow_symlinks=False)
+                except OSError:
+                    continue
+                found[path] = (stat.st_mtime_ns, stat.st_size)
+            return found
+        found = {}
+        stack = [""]
+        while stack:
+            relative = stack.pop()
+            try:
+                entries = os.scandir(os.path.join(self.root, relative))
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    path = f"{relative}/{entry.name}" if relative else entry.name
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in SKIP_DIRS:
+                                stack.append(path)
+                        elif entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            found[path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        continue
+        return found
+
+    def entry(self, path):
+        """(mtime_ns, size, indexed) for a path, from the delta or the base."""
+        if path in self.delta:
+            entry = self.delta[path]
+            return entry and entry[:3]
+        file_id = self.ids.get(path)
+        if file_id is None:
+            return None
+        return tuple(self.files[file_id][1:4])
+
+    def refresh(self, force=False):
+        """Re-index files that changed since the last walk; returns how many did."""
+        with self._lock:
+            if not force and self.refreshed is not None and time.monotonic() - self.refreshed < self.refresh_interval:
+                return 0
+            if self.snapshot is not None and self.snapshot.inotify is not None:
+                if self.snapshot.version == self.snapshot_version and not force:
+                    return 0
+                self.snapshot_version = self.snapshot.version
+            current = self.walk()
+            stale = [path for path, (mtime, size) in current.items()
+                     if (self.entry(path) or (None, None))[:2] != (mtime, size)]
+            removed = [path for path in list(self.ids) + list(self.delta)
+                       if path not in current and self.entry(path) is not None]
+            for path in removed:
+                self.delta[path] = None
+            for path, (trigram_bytes, indexed) in zip(stale, self._index(stale)):
+                found = array("I")
+                found.frombytes(trigram_bytes)
+                mtime, size = current[path]
+                self.delta[path] = (mtime, size, indexed, frozenset(found))
+            self.refreshed = time.monotonic()
+            self.stats["refreshes"] += 1
+            self.stats["reindexed"] += len(stale)
+            if stale or removed:
+                if len(self.delta) > max(64, len(self.ids) // 5):
+                    self._compact()
+                else:
+                    self._save_delta()
+            return len(stale) + len(removed)
+
+    def _index(self, paths):
+        absolute = [os.path.join(self.root, path) for path in paths]
+        if self.pool is None or len(paths) < 64:
+            return _index_files(absolute, self.max_index_bytes)
+        chunks = [absolute[start:start + 256] for start in range(0, len(absolute), 256)]
+        results = []
+        for chunk in self.pool.map(_index_files, chunks, [self.max_index_bytes] * len(chunks)):
+            results.extend(chunk)
+        return results
+
+    # Searching
+
+    def _posting(self, trigram):
+        index = bisect.bisect_left(self._trigrams, trigram)
+        if index == len(self._trigrams) or self._trigrams[index] != trigram:
+            return set()
+        return set(self._postings[self._offsets[index]:self._offsets[index + 1]])
+
+    def _base_candidates(self, plan):
+        """Base file ids that may match, or None for all of them."""
+        if plan is None:
+            return None
+        if isinstance(plan, frozenset):
+            result = None
+            # Rarest trigrams first keeps the intersections small.
+            for posting in sorted((self._posting(trigram) for trigram in plan), key=len):
+                result = posting if result is None else result & posting
+                if not result:
+                    break
+            return result
+        operation, plans = plan
+        sets = [self._base_candidates(item) for item in plans]
+        if operation == "and":
+            known = [candidates for candidates in sets if candidates is not None]
+            return set.intersection(*known) if known else None
+        return None if any(candidates is None for candidates in sets) else set().union(*sets)
+
+    def candidates(self, plan, prefix="", include=None):
+        """Relative paths that may match, newest first, with unindexed files always included."""
+        with self._lock:
+            base_ids = self._base_candidates(plan)
+            if base_ids is None:
+                base_ids = range(len(self.files))
+            found = []
+            for file_id in base_ids:
+                entry = self.files[file_id]
+                if entry and entry[3] and entry[0] not in self.delta:
+                    found.append((entry[0], entry[1]))
+            for file_id, entry in enumerate(self.files):
+                if entry and entry[3] is False and entry[0] not in self.delta:
+                    found.append((entry[0], entry[1]))
+            for path, entry in self.delta.items():
+                if entry and entry[2] is not None and (entry[2] is False or _file_matches_plan(plan, entry[3])):
+                    found.append((path, entry[0]))
+        if prefix:
+            found = [item for item in found if item[0] == prefix or item[0].startswith(prefix + "/")]
+        if include:
+            patterns = expand_braces(include)
+            found = [item for item in found
+                     if any(fnmatch.fnmatch(item[0] if "/" in pattern else os.path.basename(item[0]), pattern)
+                            for pattern in patterns)]
+        found.sort(key=lambda item: item[1], reverse=True)
+        return [path for path, _ in found]
+
+    def search(self, pattern, prefix="", include=None, flags=0, chunk_size=32):
+        """Yield the absolute paths of matching files, newest first."""
+        self.refresh()
+        plan = query_plan(pattern, flags)
+        paths = [os.path.join(self.root, path) for path in self.candidates(plan, prefix, include)]
+        if self.pool is None or len(paths) <= chunk_size:
+            yield from _verify(paths, pattern, flags)
+            return
+        chunks = [paths[start:start + chunk_size] for start in range(0, len(paths), chunk_size)]
+        # A window of chunks runs ahead; results come back in candidate (mtime) order.
+        window = max(2, self.workers * 2)
+        futures = [self.pool.submit(_verify, chunk, pattern, flags) for chunk in chunks[:window]]
+        submitted = len(futures)
+        try:
+            for index in range(len(chunks)):
+                yield from futures[index].result()
+                if submitted < len(chunks):
+                    futures.append(self.pool.submit(_verify, chunks[submitted], pattern, flags))
+                    submitted += 1
+        finally:
+            for future in futures:
+                future.cancel()
+
+class GrepTool:
+    """GrepTool over real files: {"pattern", "path", "include"} -> matching file paths, newest first.
+
+    Relative paths resolve against `root`. The index follows the tree of
+    `snapshots` (shared with GlobTool and LSTool), so a search anywhere in
+    the workspace uses the workspace's index; directories outside it are
+    refused rather than walked and indexed. Files are verified on at most
+    MAX_WORKERS processes, started from a forkserver because the harness
+    around the tool runs threads.
+    """
+    side_effect_free = True
+
+    def __init__(self, root=".", index_dir=None, workers=None, refresh_interval=1.0, max_results=MAX_RESULTS,
+                 snapshots=None):
+        self.root = os.path.realpath(root)
+        self._own_snapshots = snapshots is None
+        self.snapshots = snapshots or Snapshots(self.root, refresh_interval=refresh_interval)
+        self.index_dir = index_dir or os.path.join(os.path.expanduser("~"), ".cache", "grep-tool")
+        self.refresh_interval = refresh_interval
+        self.max_results = max_results
+        self.workers = workers if workers is not None else min(os.cpu_count() or 1, MAX_WORKERS)
+        self.pool = None
+        if self.workers > 1:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("forkserver"))
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    def index_for(self, directory):
+        """(index, prefix of `directory` within the index's root); ValueError outside the workspace."""
+        snapshot, prefix = self.snapshots.get(directory)
+        with self._lock:
+            index = self.indexes.get(snapshot.root)
+            if index is None:
+                index = TrigramIndex(snapshot.root, self.index_dir, refresh_interval=self.refresh_interval,
+                                     pool=self.pool, workers=self.workers, snapshot=snapshot)
+                self.indexes[snapshot.root] = index
+            return index, prefix
+
+    def search(self, pattern, path=None, include=None):
+        directory = os.path.realpath(os.path.join(self.root, path or ""))
+        index, prefix = self.index_for(directory)
+        return index.search(pattern, prefix, include)
+
+    def __call__(self, arguments):
+        pattern = arguments["pattern"]
+        path = arguments.get("path")
+        directory = os.path.join(self.root, path or "")
+        if not os.path.isdir(directory):
+            return f"Error: Directory not found: {path}"
+        try:
+            _compile(pattern)
+        except re.error as e:
+            return f"Error: Invalid regular expression {pattern!r}: {e}"
+        matches = []
+        try:
+            results = self.search(pattern, path, arguments.get("include"))
+        except ValueError:
+            return f"Error: {path} is outside {self.root}; GrepTool only searches the workspace"
+        try:
+            # One past the limit tells whether the output is truncated; the rest is never verified.
+            for match in results:
+                matches.append(match)
+                if len(matches) > self.max_results:
+                    break
+        finally:
+            results.close()
+        if not matches:
+            return "No files found"
+        lines = [f"Found {len(matches) if len(matches) <= self.max_results else f'more than {self.max_results}'} files"]
+        lines.extend(matches[:self.max_results])
+        if len(matches) > self.max_results:
+            lines.append("(Results are truncated. Consider using a more specific path or pattern.)")
+        return "\n".join(lines)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        if self._own_snapshots:
+            self.snapshots.close()
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search files with the GrepTool index, or benchmark it")
+    parser.add_argument("pattern")
+    parser.add_argument("path", nargs="?", default=".")
+    parser.add_argument("--include")
+    parser.add_argument("--index-dir")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--repeat", type=int, default=1, help="Run the search this many times and report timings")
+    args = parser.parse_args(argv)
+
+    tool = GrepTool(args.path, index_dir=args.index_dir, workers=args.workers, refresh_interval=0.0)
+    try:
+        for attempt in range(args.repeat):
+            start = time.perf_counter()
+            output = tool({"pattern": args.pattern, "include": args.include})
+            elapsed = time.perf_counter() - start
+            if attempt == 0:
+                print(output)
+            print(f"search {attempt + 1}: {elapsed * 1000:.1f} ms", file=sys.stderr)
+        for index in tool.indexes.values():
+            print(f"{index.root}: {len(index.ids)} files in base, {len(index.delta)} in delta, {index.stats}",
+                  file=sys.stderr)
+    finally:
+        tool.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,632 @@
+"""Interchangeable inference backends for the tool-calling harness.
+
+Every backend exposes complete(request, stream=False, on_tool_call=None) and
+returns (content, tool_calls, stats):
+
+- content is the assistant text (or None),
+- tool_calls is a list of OpenAI-format tool call dicts,
+- stats holds latency, ttft, time_to_first_tool_call, prompt_tokens,
+  completion_tokens and cached_tokens, with None where a backend cannot
+  measure a value. Backends that see tokens as they are generated (streamed
+  HTTP and mlx) add reasoning_tokens, answer_tokens, reasoning_time and
+  answer_time from response_parsing.ThinkParser, and the early-stop stats
+  described at _early_stop_stats when an early_stop mode is set.
+
+`request` is an OpenAI chat-completions request dict. When given,
+on_tool_call is called with each tool call as soon as it is complete, which
+may be before the completion finishes. The HTTP and fake backends also take
+a Cancellation, letting another thread abandon the call; complete() then
+raises Cancelled.
+"""
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from multiprocessing.connection import Client, Listener
+
+from response_parsing import THINK_OPEN, ThinkParser
+
+def _parse_complete_arguments(arguments):
+    """Return the parsed arguments once the streamed JSON object is complete, else None."""
+    if not arguments.rstrip().endswith("}"):
+        return None
+    try:
+        parsed = json.loads(arguments)
+    except json.JSONDecodeError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+def _tool_call(call_id, name, arguments):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+
+def _stats(start, ttft=None, first_tool_call=None, prompt_tokens=None, completion_tokens=None, cached_tokens=None):
+    return {
+        "latency": time.perf_counter() - start,
+        "ttft": ttft,
+        "time_to_first_tool_call": first_tool_call,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cached_tokens": cached_tokens,
+    }
+
+def _usage_stats(usage):
+    if not usage:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", None),
+    }
+
+class Cancelled(RuntimeError):
+    """complete() was abandoned through its Cancellation."""
+
+class Cancellation:
+    """Lets one thread abandon complete() calls running in others.
+
+    Streaming backends check `cancelled` between chunks and close the
+    stream; callbacks registered with on_cancel run on cancel(), or at once
+    if it already happened.
+    """
+    def __init__(self):
+        self.cancelled = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+# "measure": generate to the end but record where a complete tool call allowed stopping.
+# "stop": cancel generation there (closing the HTTP stream, or breaking out of mlx generation).
+EARLY_STOP_MODES = ("measure", "stop")
+
+def _early_stop_stats(stats, stop_at, stop_tokens, total_tokens, stopped):
+    """Add where generation could end once a tool call was complete, and what ending there saves.
+
+    early_stop_at is seconds from the request, early_stop_tokens the tokens
+    (streamed chunks over HTTP) generated by then. Only a run that kept
+    generating knows what stopping saves, so tokens_saved and time_saved
+    are reported in "measure" mode and early_stopped in "stop" mode.
+    """
+    if stop_at is None:
+        return stats
+    stats["early_stop_at"] = stop_at
+    stats["early_stop_tokens"] = stop_tokens
+    if stopped:
+        stats["early_stopped"] = True
+    else:
+        stats["tokens_saved"] = total_tokens - stop_tokens
+        stats["time_saved"] = stats["latency"] - stop_at
+    return stats
+
+def _message_result(completion, start):
+    assistant_message = completion.choices[0].message
+    tool_calls = [
+        _tool_call(tool_call.id, tool_call.function.name, tool_call.function.arguments)
+        for tool_call in assistant_message.tool_calls or []
+    ]
+    return assistant_message.content, tool_calls, _stats(start, **_usage_stats(completion.usage))
+
+class _StreamAssembler:
+    """Accumulates streamed chunks into content, tool calls, timings and usage."""
+    def __init__(self, start):
+        self.start = start
+        self.content_parts = []
+        self.calls = {}
+        self.announced = set()
+        self.ttft = None
+        self.first_tool_call = None
+        self.usage = None
+        self.think = ThinkParser()
+        self.stop_tokens = None
+
+    def feed(self, chunk):
+        """Consume one chunk and return the tool calls whose arguments it completed."""
+        if chunk.usage:
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return []
+        delta = chunk.choices[0].delta
+        if self.ttft is None and (delta.content or delta.tool_calls):
+            self.ttft = time.perf_counter() - self.start
+        if delta.content:
+            self.content_parts.append(delta.content)
+            self.think.feed(delta.content)
+        # Servers that split reasoning out themselves send it as reasoning_content.
+        if getattr(delta, "reasoning_content", None):
+            self.think.feed_reasoning(delta.reasoning_content)
+        if delta.tool_calls and not delta.content:
+            self.think.feed("")
+        completed = []
+        for tool_call_delta in delta.tool_calls or []:
+            call = self.calls.setdefault(tool_call_delta.index, {"id": None, "name": "", "arguments": ""})
+            if tool_call_delta.id:
+                call["id"] = tool_call_delta.id
+            if tool_call_delta.function:
+                call["name"] += tool_call_delta.function.name or ""
+                call["arguments"] += tool_call_delta.function.arguments or ""
+            if tool_call_delta.index in self.announced or _parse_complete_arguments(call["arguments"]) is None:
+                continue
+            self.announced.add(tool_call_delta.index)
+            if self.first_tool_call is None:
+                self.first_tool_call = time.perf_counter() - self.start
+                self.stop_tokens = self.tokens
+            completed.append(_tool_call(call["id"], call["name"], call["arguments"]))
+        return completed
+
+    @property
+    def tokens(self):
+        return self.think.reasoning_tokens + self.think.answer_tokens
+
+    @property
+    def can_stop(self):
+        """True once a tool call is complete, so the rest of the generation can be cancelled."""
+        return self.first_tool_call is not None
+
+    def result(self, early_stop=None, stopped=False):
+        """Return (content, tool_calls, stats); with stopped=True only the tool calls complete so far are kept."""
+        calls = sorted(self.calls.items())
+        if stopped:
+            calls = [(index, call) for index, call in calls if index in self.announced]
+        tool_calls = [_tool_call(call["id"], call["name"], call["arguments"]) for _, call in calls]
+        content = "".join(self.content_parts) if self.content_parts else None
+        stats = _stats(self.start, self.ttft, self.first_tool_call, **_usage_stats(self.usage))
+        stats.update(self.think.stats())
+        if early_stop:
+            _early_stop_stats(stats, self.first_tool_call, self.stop_tokens, self.tokens, stopped)
+        return content, tool_calls, stats
+
+class OpenAIBackend:
+    """Any OpenAI-compatible chat-completions endpoint, through an OpenAI client.
+
+    early_stop (see EARLY_STOP_MODES) applies to streamed completions; in
+    "stop" mode the stream is closed once a tool call is complete, which
+    drops the connection so the server can abandon the generation. A
+    cancelled stream is closed the same way; a cancelled non-streamed
+    request runs to the end and its response is dropped.
+    """
+    name = "openai"
+
+    def __init__(self, client, early_stop=None):
+        self.client = client
+        self.early_stop = early_stop
+
+    def complete(self, request, stream=False, on_tool_call=None, cancel=None):
+        start = time.perf_counter()
+        if not stream:
+            content, tool_calls, stats = _message_result(self.client.chat.completions.create(**request), start)
+            if cancel is not None and cancel.cancelled:
+                raise Cancelled()
+            if on_tool_call:
+                for tool_call in tool_calls:
+                    on_tool_call(tool_call)
+            return content, tool_calls, stats
+        # Tool calls are handed to on_tool_call as soon as their arguments are complete.
+        assembler = _StreamAssembler(start)
+        response = self.client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request)
+        stopped = False
+        try:
+            for chunk in response:
+                if cancel is not None and cancel.cancelled:
+                    raise Cancelled()
+                for tool_call in assembler.feed(chunk):
+                    if on_tool_call:
+                        on_tool_call(tool_call)
+                if self.early_stop == "stop" and assembler.can_stop:
+                    stopped = True
+                    break
+        finally:
+            # Hands the pooled connection back, or drops it if the stream is unfinished.
+            response.close()
+        return assembler.result(self.early_stop, stopped)
+
+# Errors worth retrying: connection failures, timeouts, rate limits and server-side 5xx.
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+class StreamInterrupted(RuntimeError):
+    """A stream failed after output had arrived, so it is not retried."""
+
+class AsyncOpenAIBackend:
+    """Pooled AsyncOpenAI client shared by every caller through one event loop.
+
+    The loop runs in a daemon thread, so the synchronous complete() can be
+    called from any number of harness threads while the HTTP connections,
+    the in-flight limit and the retry policy are shared:
+
+    - a keep-alive pool of `max_connections` (HTTP/2 multiplexing when
+      http2=True and the h2 package is installed),
+    - at most `max_in_flight` requests outstanding at once,
+    - a total `timeout` per attempt and `connect_timeout` for new connections,
+    - up to `retries` retries with full-jitter exponential backoff on
+      connection errors, timeouts, 429 and 5xx. Streams are only retried
+      if they fail before their first chunk.
+
+    Latency and TTFT are measured from the first attempt, so they include
+    any retries. Streamed tool calls run on the loop's thread pool while the
+    rest of the completion streams in. early_stop works as for OpenAIBackend;
+    cancelling a call cancels its task, which closes the request whether
+    or not it streams.
+    """
+    name = "openai-async"
+
+    def __init__(self, base_url, api_key, max_connections=32, max_in_flight=8, timeout=600.0,
+                 connect_timeout=10.0, retries=2, backoff=0.5, max_backoff=8.0, http2=False, early_stop=None):
+        import httpx
+        from openai import AsyncOpenAI
+
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                print("h2 is not installed; falling back to HTTP/1.1 keep-alive", file=sys.stderr)
+                http2 = False
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_in_flight = max_in_flight
+        self.early_stop = early_stop
+        self.retried = 0
+        http_client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                                keepalive_expiry=60.0),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        )
+        self.client = AsyncOpenAI(base_url=str(base_url), api_key=api_key, http_client=http_client, max_retries=0)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-openai", daemon=True)
+        self._thread.start()
+        self._semaphore = self._run(self._make_semaphore())
+
+    async def _make_semaphore(self):
+        return asyncio.Semaphore(self.max_in_flight)
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    @staticmethod
+    def _retryable(error):
+        import openai
+
+        if isinstance(error, (openai.APIConnectionError, asyncio.TimeoutError)):
+            return True
+        return isinstance(error, openai.APIStatusError) and error.status_code in RETRYABLE_STATUS
+
+    async def _attempt(self, request, stream, on_tool_call, start):
+        if not stream:
+            completion = await asyncio.wait_for(self.client.chat.completions.create(**request), self.timeout)
+            content, tool_calls, stats = _message_result(completion, start)
+            if on_tool_call:
+                for tool_call in tool_calls:
+                    on_tool_call(tool_call)
+            return content, tool_calls, stats
+        deadline = time.perf_counter() + self.timeout
+        response = await asyncio.wait_for(
+            self.client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request),
+            self.timeout)
+        assembler = _StreamAssembler(start)
+        pending_tools = []
+        iterator = response.__aiter__()
+        received = False
+        stopped = False
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(iterator.__anext__(), max(0.0, deadline - time.perf_counter()))
+                except StopAsyncIteration:
+                    break
+                except Exception as e:
+                    if received:
+                        raise StreamInterrupted(f"Stream failed after output arrived: {e!r}") from e
+                    raise
+                received = True
+                for tool_call in assembler.feed(chunk):
+                    if on_tool_call:
+                        pending_tools.append(self._loop.run_in_executor(None, on_tool_call, tool_call))
+                if self.early_stop == "stop" and assembler.can_stop:
+                    stopped = True
+                    break
+        finally:
+            # Also on errors and when the task is cancelled, as every losing speculative sample is.
+            await response.close()
+        await asyncio.gather(*pending_tools)
+        return assembler.result(self.early_stop, stopped)
+
+    async def complete_async(self, request, stream=False, on_tool_call=None):
+        start = time.perf_counter()
+        attempt = 0
+        async with self._semaphore:
+            while True:
+                try:
+                    content, tool_calls, stats = await self._attempt(request, stream, on_tool_call, start)
+                    stats["retries"] = attempt
+                    return content, tool_calls, stats
+                except Exception as e:
+                    if attempt >= self.retries or not self._retryable(e):
+                        raise
+                attempt += 1
+                self.retried += 1
+                await asyncio.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def complete(self, request, stream=False, on_tool_call=None, cancel=None):
+        future = asyncio.run_coroutine_threadsafe(self.complete_async(request, stream, on_tool_call), self._loop)
+        if cancel is None:
+            return future.result()
+        cancel.on_cancel(future.cancel)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise Cancelled() from None
+
+    def close(self):
+        self._run(self.client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+TOOL_CALL_RE = re.compile(r"<tool_call>\s*(.*?)\s*</tool_call>", re.DOTALL)
+
+def parse_tool_call_blocks(text):
+    """Split Qwen-style <tool_call>{"name": ..., "arguments": ...}</tool_call> blocks out of generated text.
+
+    Returns (content, tool_calls). Blocks that are not valid JSON stay in the content.
+    """
+    tool_calls = []
+
+    def extract(match):
+        try:
+            call = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            return match.group(0)
+        arguments = call.get("arguments", {})
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments)
+        tool_calls.append(_tool_call(f"call_{len(tool_calls)}", call.get("name", ""), arguments))
+        return ""
+
+    content = TOOL_CALL_RE.sub(extract, text).strip()
+    return content or None, tool_calls
+
+class MLXBackend:
+    """In-process generation with mlx_lm, using the tokenizer's chat template for tools.
+
+    With a prompt_cache.PromptCache, rendered prompts and their token IDs are
+    reused across calls and runs, and generation starts from the cached IDs.
+    early_stop (see EARLY_STOP_MODES) triggers once the answer, not the
+    reasoning, contains a complete <tool_call> block.
+    """
+    name = "mlx"
+
+    def __init__(self, model_path, verbose=False, prompt_cache=None, early_stop=None):
+        from mlx_lm import load
+
+        self.model_path = model_path
+        self.verbose = verbose
+        self.prompt_cache = prompt_cache
+        self.early_stop = early_stop
+        start = time.perf_counter()
+        self.model, self.tokenizer = load(model_path)
+        self.load_time = time.perf_counter() - start
+
+    def render_prompt(self, messages, tools):
+        if getattr(self.tokenizer, "chat_template", None) is None:
+            return "\n\n".join(message["content"] or "" for message in messages)
+        return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True, tools=tools)
+
+    def complete(self, request, stream=False, on_tool_call=None):
+        # mlx_lm always generates incrementally, so TTFT is measured whether or not stream is set.
+        from mlx_lm import stream_generate
+        from mlx_lm.sample_utils import make_sampler
+
+        start = time.perf_counter()
+        if self.prompt_cache is not None:
+            import mlx.core as mx
+            import numpy as np
+
+            rendered, token_ids = self.prompt_cache.get(self.tokenizer, request["messages"], request.get("tools"),
+                                                        self.render_prompt)
+            prompt = mx.array(np.frombuffer(token_ids, dtype=np.uint32))
+        else:
+            prompt = rendered = self.render_prompt(request["messages"], request.get("tools"))
+        sampler = make_sampler(temp=request.get("temperature", 0.0))
+        think = ThinkParser(starts_in_think=rendered.rstrip().endswith(THINK_OPEN))
+        text = ""
+        ttft = None
+        first_tool_call = None
+        closed_blocks = 0
+        announced = 0
+        stop_at = stop_tokens = None
+        stopped = False
+        response = None
+        for response in stream_generate(self.model, self.tokenizer, prompt,
+                                        max_tokens=request.get("max_tokens", 1024), sampler=sampler):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            text += response.text
+            think.feed(response.text)
+            if self.verbose:
+                print(response.text, end="", flush=True)
+            if text.count("</tool_call>") > closed_blocks:
+                closed_blocks = text.count("</tool_call>")
+                _, calls = parse_tool_call_blocks(text)
+                for call in calls[announced:]:
+                    if first_tool_call is None:
+                        first_tool_call = time.perf_counter() - start
+                    if on_tool_call:
+                        on_tool_call(call)
+                announced = len(calls)
+            if stop_at is None and think.answer_tool_calls:
+                stop_at = time.perf_counter() - start
+                stop_tokens = response.generation_tokens
+                if self.early_stop == "stop":
+                    stopped = True
+                    break
+        if self.verbose:
+            print()
+        content, tool_calls = parse_tool_call_blocks(text)
+        stats = _stats(start, ttft, first_tool_call,
+                       prompt_tokens=response.prompt_tokens if response else None,
+                       completion_tokens=response.generation_tokens if response else None)
+        stats.update(think.stats())
+        if self.early_stop:
+            _early_stop_stats(stats, stop_at, stop_tokens, response.generation_tokens if response else 0, stopped)
+        return content, tool_calls, stats
+
+# Rules for FakeBackend: the first rule whose "match" regex matches the last
+# user message wins. "arguments" values and "content" are str.format templates
+# over the regex groups; rules without "tool" answer with content directly.
+DEFAULT_FAKE_SCRIPT = [
+    {"match": r"^Run a bash command:\s*$", "content": "Please specify which command you would like me to run."},
+    {"match": r"^Run a bash command:\s*(.+)$", "tool": "BashTool", "arguments": {"command": "{0}"}},
+    {"match": r"^Read the contents of (\S+)", "tool": "FileReadTool", "arguments": {"file_path": "{0}"}},
+    {"match": r"^Write '(.*)' to a file called (\S+)", "tool": "FileWriteTool",
+     "arguments": {"file_path": "{1}", "content": "{0}"}},
+    {"match": r"^Edit (\S+) and replace '(.*)' with '(.*)'", "tool": "FileEditTool",
+     "arguments": {"file_path": "{0}", "old_string": "{1}", "new_string": "{2}"}},
+    {"match": r"^Search for the word '(.*)' in the (\S+) directory", "tool": "GrepTool",
+     "arguments": {"pattern": "{0}", "path": "{1}"}},
+    {"match": r"^Find all (\.\w+) files in the (\S+) directory", "tool": "GlobTool",
+     "arguments": {"pattern": "**/*{0}", "path": "{1}"}},
+    {"match": r"^List the contents of the (\S+) directory", "tool": "LSTool", "arguments": {"path": "{0}"}},
+    {"match": r"^Use an agent to (.+)$", "tool": "AgentTool", "arguments": {"prompt": "{0}"}},
+    {"match": r"^Help me architect a solution to (.+)$", "tool": "ArchitectTool", "arguments": {"prompt": "{0}"}},
+    {"match": r"^List stuff", "content": "Could you clarify what you would like me to list?"},
+    {"match": r"best programming language",
+     "content": "There is no single best programming language. Python, JavaScript, Go and Rust each suit different kinds of software."},
+    {"match": r"", "content": "I can help with that. Let me know which files or commands are involved."},
+]
+
+class FakeBackend:
+    """Deterministic scripted backend for CI and for measuring harness overhead.
+
+    Picks a tool call or reply from `script` (see DEFAULT_FAKE_SCRIPT); after
+    a tool result it answers with `after_tool` formatted with the result.
+    Latency is simulated from `ttft` and `tokens_per_sec` (0 disables the
+    sleep), and token counts are estimated at four characters per token.
+    """
+    name = "fake"
+
+    def __init__(self, script=None, after_tool="Done. {result}", ttft=0.0, tokens_per_sec=0.0):
+        self.script = [dict(rule, pattern=re.compile(rule["match"], re.DOTALL)) for rule in script or DEFAULT_FAKE_SCRIPT]
+        self.after_tool = after_tool
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+
+    def respond(self, messages):
+        """Return (content, tool_calls) for the conversation so far."""
+        last = messages[-1]
+        if last["role"] == "tool":
+            return self.after_tool.format(result=last["content"]), []
+        user_messages = [message for message in messages if message["role"] == "user"]
+        text = user_messages[-1]["content"] if user_messages else ""
+        for rule in self.script:
+            match = rule["pattern"].search(text)
+            if not match:
+                continue
+            groups = [group or "" for group in match.groups()]
+            if "tool" not in rule:
+                return rule["content"].format(*groups), []
+            arguments = {key: value.format(*groups) for key, value in rule["arguments"].items()}
+            call_id = f"call_{sum(1 for message in messages if message['role'] == 'assistant')}"
+            return rule.get("content"), [_tool_call(call_id, rule["tool"], json.dumps(arguments))]
+        return None, []
+
+    def complete(self, request, stream=False, on_tool_call=None, cancel=None):
+        start = time.perf_counter()
+        content, tool_calls = self.respond(request["messages"])
+        completion_tokens = max(1, len((content or "") + "".join(call["function"]["arguments"] for call in tool_calls)) // 4)
+        prompt_tokens = len(json.dumps(request["messages"])) // 4
+        if self.ttft:
+            time.sleep(self.ttft)
+        ttft = time.perf_counter() - start
+        if self.tokens_per_sec:
+            time.sleep(completion_tokens / self.tokens_per_sec)
+        if cancel is not None and cancel.cancelled:
+            raise Cancelled()
+        first_tool_call = None
+        for tool_call in tool_calls:
+            if first_tool_call is None:
+                first_tool_call = time.perf_counter() - start
+            if on_tool_call:
+                on_tool_call(tool_call)
+        stats = _stats(start, ttft, first_tool_call, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        return content, tool_calls, stats
+
+def serve_backend(backend, address):
+    """Serve complete() calls for `backend` on a Unix socket until interrupted.
+
+    Jobs and replies are JSON, one message per request, so the worker never
+    unpickles anything a client sends. Jobs run one at a time, in arrival order
+    per connection.
+    """
+    if os.path.exists(address):
+        os.unlink(address)
+    with Listener(address, family="AF_UNIX") as listener:
+        while True:
+            with listener.accept() as conn:
+                while True:
+                    try:
+                        job = json.loads(conn.recv_bytes())
+                    except EOFError:
+                        break
+                    try:
+                        content, tool_calls, stats = backend.complete(job["request"], stream=job.get("stream", False))
+                        reply = {"content": content, "tool_calls": tool_calls, "stats": stats,
+                                 "load_time": getattr(backend, "load_time", None)}
+                    except Exception as e:
+                        reply = {"error": f"{type(e).__name__}: {e}"}
+                    conn.send_bytes(json.dumps(reply).encode("utf-8"))
+
+class WorkerBackend:
+    """Client for a backend kept warm by serve_backend in another process.
+
+    Tool calls are only reported once the worker's completion finishes, so
+    on_tool_call never fires early. Stats are the worker's generation numbers;
+    load_time is the worker's one-off model load, not paid by this process.
+    """
+    name = "worker"
+
+    def __init__(self, address):
+        self.address = address
+        self.load_time = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def complete(self, request, stream=False, on_tool_call=None):
+        with self._lock:
+            if self._conn is None:
+                self._conn = Client(self.address, family="AF_UNIX")
+            self._conn.send_bytes(json.dumps({"request": request, "stream": stream}).encode("utf-8"))
+            reply = json.loads(self._conn.recv_bytes())
+        if "error" in reply:
+            raise RuntimeError(f"Worker error: {reply['error']}")
+        self.load_time = reply["load_time"]
+        if on_tool_call:
+            for tool_call in reply["tool_calls"]:
+                on_tool_call(tool_call)
+        return reply["content"], reply["tool_calls"], reply["stats"]
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+BACKENDS = ("openai", "openai-async", "mlx", "fake", "worker")
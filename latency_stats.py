@@ -0,0 +1,14 @@
+"""Summary statistics shared by the benchmark, load generator and trace query reports."""
+import math
+
+def percentile(values, q):
+    """Linearly interpolated percentile of `values` (0 <= q <= 100), or None if empty.
+
+    None entries (metrics a backend could not measure) are skipped.
+    """
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return values[low] + (values[high] - values[low]) * (rank - low)
@@ -0,0 +1,183 @@
+"""Sustained-load driver for tool-calling conversations.
+
+Runs a weighted mix of scenarios either open-loop, with arrivals at a
+target rate regardless of how fast the endpoint answers, or closed-loop
+with a fixed number of concurrent workers. Open-loop latency is measured
+from each conversation's scheduled start, so queueing behind a saturated
+endpoint shows up in the numbers instead of silently lowering the load.
+
+The harness supplies run_one(scenario) -> record, where record has a
+"status" ("ok", "FAIL", "ERROR", ...) and a "turns" list of per-turn
+metrics; a turn with an "error" key means the request itself failed.
+"""
+import bisect
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from latency_stats import percentile
+
+# Latency histogram bucket upper bounds: from 10ms, each sqrt(2) times the last (two buckets per doubling),
+# up to ~15 minutes.
+HISTOGRAM_BOUNDS = [0.01 * 2 ** (i / 2) for i in range(34)]
+
+def parse_mix(spec, scenarios):
+    """Parse "name=weight,name=weight" into {scenario: weight}; an empty spec weights every scenario 1."""
+    if not spec:
+        return {scenario: 1.0 for scenario in scenarios}
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        matches = [scenario for scenario in scenarios if scenario in (name, f"test_{name}")]
+        if not matches:
+            raise ValueError(f"Unknown scenario {name!r}; choose from {', '.join(scenarios)}")
+        mix[matches[0]] = float(weight or 1)
+    return mix
+
+def classify(record):
+    if any("error" in turn for turn in record["turns"]):
+        return "error"
+    return "valid" if record["status"] in ("ok", "SKIP") else "invalid"
+
+class LoadGenerator:
+    def __init__(self, run_one, mix, duration, rate=None, concurrency=None, arrivals="poisson",
+                 max_workers=256, seed=None):
+        if (rate is None) == (concurrency is None):
+            raise ValueError("Give exactly one of rate (open loop) or concurrency (closed loop)")
+        self.run_one = run_one
+        self.scenarios = list(mix)
+        self.weights = [mix[scenario] for scenario in self.scenarios]
+        self.duration = duration
+        self.rate = rate
+        self.concurrency = concurrency
+        self.arrivals = arrivals
+        self.max_workers = max_workers
+        self.random = random.Random(seed)
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def _pick(self):
+        with self._lock:
+            return self.random.choices(self.scenarios, self.weights)[0]
+
+    def _execute(self, scenario, scheduled):
+        started = time.perf_counter()
+        try:
+            record = self.run_one(scenario)
+        except Exception as e:
+            record = {"status": "ERROR", "turns": [{"error": str(e)}]}
+        finished = time.perf_counter()
+        sample = {
+            "scenario": scenario,
+            "scheduled": scheduled - self.start,
+            "queue_delay": started - scheduled,
+            "latency": finished - scheduled,
+            "requests": len(record["turns"]),
+            "outcome": classify(record),
+        }
+        with self._lock:
+            self.samples.append(sample)
+
+    def _open_loop(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            next_arrival = self.start
+            while next_arrival < self.start + self.duration:
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self._execute, self._pick(), next_arrival)
+                if self.arrivals == "poisson":
+                    next_arrival += self.random.expovariate(self.rate)
+                else:
+                    next_arrival += 1 / self.rate
+
+    def _closed_loop(self):
+        def worker():
+            while time.perf_counter() < self.start + self.duration:
+                self._execute(self._pick(), time.perf_counter())
+
+        threads = [threading.Thread(target=worker) for _ in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run(self):
+        self.start = time.perf_counter()
+        if self.rate is not None:
+            self._open_loop()
+        else:
+            self._closed_loop()
+        self.elapsed = time.perf_counter() - self.start
+        return self.samples
+
+def summarize(samples, elapsed):
+    latencies = [sample["latency"] for sample in samples]
+    outcomes = [sample["outcome"] for sample in samples]
+    total = len(samples) or 1
+    return {
+        "conversations": len(samples),
+        "requests": sum(sample["requests"] for sample in samples),
+        "conversations_per_sec": len(samples) / elapsed if elapsed else None,
+        "requests_per_sec": sum(sample["requests"] for sample in samples) / elapsed if elapsed else None,
+        "error_rate": outcomes.count("error") / total,
+        "valid_rate": outcomes.count("valid") / total,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max_queue_delay": max((sample["queue_delay"] for sample in samples), default=None),
+    }
+
+def timeline(samples, interval):
+    """Summaries of the conversations scheduled in each `interval`-second window."""
+    windows = {}
+    for sample in samples:
+        windows.setdefault(int(sample["scheduled"] // interval), []).append(sample)
+    return [dict(summarize(windows[index], interval), start=index * interval) for index in sorted(windows)]
+
+def histogram(samples):
+    counts = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+    for sample in samples:
+        counts[bisect.bisect_left(HISTOGRAM_BOUNDS, sample["latency"])] += 1
+    return [{"le": bound, "count": count} for bound, count in zip(HISTOGRAM_BOUNDS + [None], counts)]
+
+def _format_latency(value):
+    if value is None:
+        return "-"
+    return f"{value * 1000:.0f}ms" if value < 1 else f"{value:.2f}s"
+
+def print_report(samples, elapsed, interval):
+    print(f"{'window':>7}  {'conv/s':>7}  {'req/s':>7}  {'errors':>6}  {'valid':>6}  {'p50':>8}  {'p95':>8}  {'p99':>8}")
+    for window in timeline(samples, interval):
+        print(f"{window['start']:>6.0f}s  {window['conversations_per_sec']:>7.2f}  {window['requests_per_sec']:>7.2f}  "
+              f"{window['error_rate']:>6.1%}  {window['valid_rate']:>6.1%}  {_format_latency(window['p50']):>8}  "
+              f"{_format_latency(window['p95']):>8}  {_format_latency(window['p99']):>8}")
+    overall = summarize(samples, elapsed)
+    print(f"\n{overall['conversations']} conversations ({overall['requests']} requests) in {elapsed:.1f}s: "
+          f"{overall['conversations_per_sec']:.2f} conv/s, {overall['requests_per_sec']:.2f} req/s")
+    print(f"Errors {overall['error_rate']:.1%}, valid tool calling {overall['valid_rate']:.1%}, "
+          f"latency p50 {_format_latency(overall['p50'])} p95 {_format_latency(overall['p95'])} "
+          f"p99 {_format_latency(overall['p99'])}, max queue delay {_format_latency(overall['max_queue_delay'])}")
+    buckets = [bucket for bucket in histogram(samples) if bucket["count"]]
+    peak = max((bucket["count"] for bucket in buckets), default=1)
+    print("\nLatency histogram")
+    for bucket in buckets:
+        label = f"<= {_format_latency(bucket['le'])}" if bucket["le"] is not None else "> max"
+        print(f"{label:>10}  {bucket['count']:>7}  {'#' * max(1, round(40 * bucket['count'] / peak))}")
+
+def write_results(path, samples, elapsed, interval, config):
+    with open(path, "w") as f:
+        json.dump({
+            "config": config,
+            "summary": summarize(samples, elapsed),
+            "timeline": timeline(samples, interval),
+            "histogram": histogram(samples),
+            "per_scenario": {
+                scenario: summarize([sample for sample in samples if sample["scenario"] == scenario], elapsed)
+                for scenario in sorted({sample["scenario"] for sample in samples})
+            },
+        }, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -1,16 +1,67 @@
-from mlx_lm import load, generate
-
-model, tokenizer = load("mlx-community/QwQ-32B-Preview-8bit")
+import argparse
 
+from inference_backends import MLXBackend, WorkerBackend, serve_backend
+from prompt_cache import PromptCache
 from prompts import prompts
 
-messages = prompts['messages']
-tools = prompts['tools']
+DEFAULT_MODEL = "mlx-community/QwQ-32B-Preview-8bit"
+DEFAULT_SOCKET = "/tmp/mlx-test-worker.sock"
+
+def print_result(tool_calls, stats, load_time):
+    for tool_call in tool_calls:
+        print(f"Tool call: {tool_call['function']['name']}({tool_call['function']['arguments']})")
+    load = f"{load_time:.2f}s" if load_time is not None else "n/a"
+    print(f"Load: {load}, TTFT: {stats['ttft']:.2f}s, generation: {stats['latency']:.2f}s, "
+          f"prompt tokens: {stats['prompt_tokens']}, completion tokens: {stats['completion_tokens']}")
+    if stats.get("reasoning_tokens") is not None:
+        reasoning_time = f"{stats['reasoning_time']:.2f}s" if stats["reasoning_time"] is not None else "n/a"
+        answer_time = f"{stats['answer_time']:.2f}s" if stats["answer_time"] is not None else "n/a"
+        print(f"Reasoning: {stats['reasoning_tokens']} tokens in {reasoning_time}, "
+              f"answer: {stats['answer_tokens']} tokens in {answer_time}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the prompts.py payload through QwQ with mlx_lm")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--serve", action="store_true",
+                        help="Load the model once and keep serving prompt jobs on --socket")
+    parser.add_argument("--submit", action="store_true",
+                        help="Send the prompts.py payload to a running --serve worker instead of loading the model")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET)
+    parser.add_argument("--prompt-cache-dir", default=".prompt_cache",
+                        help="Where rendered prompts and token IDs are cached (empty string disables)")
+    parser.add_argument("--prompt-cache-max-mb", type=int, default=256,
+                        help="Delete the least recently used prompt cache entries past this size")
+    parser.add_argument("--stop-on-tool-call", action="store_true",
+                        help="Stop generating once the answer contains a complete tool call")
+    args = parser.parse_args()
+    prompt_cache = None
+    if args.prompt_cache_dir:
+        prompt_cache = PromptCache(args.prompt_cache_dir, max_bytes=args.prompt_cache_max_mb * 1024 * 1024)
+
+    if args.serve:
+        backend = MLXBackend(args.model, verbose=True, prompt_cache=prompt_cache,
+                             early_stop="stop" if args.stop_on_tool_call else None)
+        print(f"Loaded {args.model} in {backend.load_time:.2f}s, serving on {args.socket}")
+        try:
+            serve_backend(backend, args.socket)
+        except KeyboardInterrupt:
+            pass
+        return
 
-if hasattr(tokenizer, "apply_chat_template") and tokenizer.chat_template is not None:
-    prompt = tokenizer.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True, 
-        tools=tools
-    )
+    if args.submit:
+        backend = WorkerBackend(args.socket)
+    else:
+        backend = MLXBackend(args.model, verbose=True, prompt_cache=prompt_cache,
+                             early_stop="stop" if args.stop_on_tool_call else None)
+    content, tool_calls, stats = backend.complete({
+        "messages": prompts['messages'],
+        "tools": prompts['tools'],
+        "max_tokens": args.max_tokens,
+    })
+    if args.submit:
+        print(content)
+    print_result(tool_calls, stats, backend.load_time)
 
-response = generate(model, tokenizer, prompt=prompt, verbose=True)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Chat-completions client that serializes each message only once.
+
+The OpenAI SDK re-encodes the whole request body on every turn, including
+the long system prompt and the tools array. PreparedClient keeps the encoded
+JSON of every message and tools list it has seen, so a turn only encodes the
+messages appended since the previous turn and splices the cached fragments
+into the body. Messages must not be mutated after they have been sent.
+
+Like the SDK, failed requests are retried `max_retries` times with backoff
+when the error is worth retrying (see inference_backends.RETRYABLE_STATUS),
+and errors surface as the openai exceptions the harness already handles.
+
+Run this file directly for a micro-benchmark on the prompts.py payload.
+"""
+import json
+import random
+import threading
+import time
+import tracemalloc
+import types
+from collections import OrderedDict
+
+import httpx
+import openai
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from inference_backends import RETRYABLE_STATUS
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+class FragmentCache:
+    """Encoded JSON keyed on object identity, bounded in entries.
+
+    Holding a reference to each object keeps its id from being reused while
+    the entry is cached.
+    """
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, value):
+        key = id(value)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] is value:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        encoded = _dumps(value)
+        self._entries[key] = (value, encoded)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return encoded
+
+def build_body(request, fragments):
+    """Assemble the request body, reusing cached fragments for messages and tools."""
+    parts = [b'{"messages":[', b",".join(fragments.encode(message) for message in request["messages"]), b"]"]
+    for name, value in request.items():
+        if name == "messages":
+            continue
+        parts.append(b',"' + name.encode() + b'":')
+        parts.append(fragments.encode(value) if name == "tools" else _dumps(value))
+    parts.append(b"}")
+    return b"".join(parts)
+
+_STATUS_ERRORS = {
+    400: openai.BadRequestError,
+    401: openai.AuthenticationError,
+    403: openai.PermissionDeniedError,
+    404: openai.NotFoundError,
+    409: openai.ConflictError,
+    422: openai.UnprocessableEntityError,
+    429: openai.RateLimitError,
+}
+
+def _status_error(response):
+    """The openai exception the SDK raises for an error response (which must have been read)."""
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text or None
+    error = body.get("error", body) if isinstance(body, dict) else body
+    message = error.get("message") if isinstance(error, dict) else None
+    cls = _STATUS_ERRORS.get(response.status_code)
+    if cls is None:
+        cls = openai.InternalServerError if response.status_code >= 500 else openai.APIStatusError
+    return cls(message or f"Error code: {response.status_code} - {body}", response=response, body=error)
+
+class _Stream:
+    """Chunks of a streamed completion; close() releases the connection whether or not iteration began."""
+    def __init__(self, response):
+        self.response = response
+
+    def __iter__(self):
+        try:
+            for line in self.response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield ChatCompletionChunk.model_validate_json(data)
+        finally:
+            self.response.close()
+
+    def close(self):
+        self.response.close()
+
+class _PreparedCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **request):
+        owner = self._owner
+        with owner.lock:
+            body = build_body(request, owner.fragments)
+        if request.get("stream"):
+            return _Stream(self._send(body, stream=True))
+        return ChatCompletion.model_validate_json(self._send(body).content)
+
+    def _send(self, body, stream=False):
+        """POST the body, retrying like the SDK; a stream is retried only until its response starts."""
+        owner = self._owner
+        attempt = 0
+        while True:
+            try:
+                response = owner.http.send(owner.http.build_request("POST", "chat/completions", content=body),
+                                           stream=stream)
+                if response.status_code < 400:
+                    return response
+                response.read()
+                response.close()
+                error = _status_error(response)
+                retryable = response.status_code in RETRYABLE_STATUS
+            except httpx.TimeoutException as e:
+                error, retryable = openai.APITimeoutError(request=e.request), True
+            except httpx.TransportError as e:
+                error, retryable = openai.APIConnectionError(request=e.request), True
+            if attempt >= owner.max_retries or not retryable:
+                raise error
+            attempt += 1
+            time.sleep(random.uniform(0, min(owner.max_backoff, owner.backoff * 2 ** attempt)))
+
+class PreparedClient:
+    """Drop-in for the subset of the OpenAI client the harness uses."""
+    def __init__(self, base_url, api_key, timeout=600.0, max_fragments=4096, max_retries=2, backoff=0.5,
+                 max_backoff=8.0):
+        self.base_url = str(base_url).rstrip("/") + "/"
+        self.api_key = api_key
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.http = httpx.Client(
+            base_url=self.base_url,
+            timeout=timeout,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        )
+        self.fragments = FragmentCache(max_fragments)
+        self.lock = threading.Lock()
+        self.chat = types.SimpleNamespace(completions=_PreparedCompletions(self))
+
+    @classmethod
+    def from_client(cls, client, **kwargs):
+        """A PreparedClient for the same server, with the client's timeout and retry policy unless overridden."""
+        kwargs.setdefault("timeout", client.timeout)
+        kwargs.setdefault("max_retries", client.max_retries)
+        return cls(client.base_url, client.api_key, **kwargs)
+
+def benchmark_serialization(messages, tools, turns=5, iterations=200):
+    """Compare per-turn encoding cost of a full json.dumps against build_body.
+
+    Simulates `turns` turns of a conversation that appends an assistant
+    tool call and a tool result each turn. Returns per-turn CPU seconds and
+    peak traced allocation for both approaches.
+    """
+    conversations = []
+    for _ in range(iterations):
+        history = list(messages)
+        requests = []
+        for turn in range(turns):
+            requests.append({"model": "qwq-32b", "messages": list(history), "tools": tools,
+                             "temperature": 0.6, "max_tokens": 1024})
+            history.append({"role": "assistant", "content": f"Turn {turn}", "tool_calls": [
+                {"id": f"call_{turn}", "type": "function",
+                 "function": {"name": "LS", "arguments": json.dumps({"path": f"/tmp/{turn}"})}}]})
+            history.append({"role": "tool", "tool_call_id": f"call_{turn}", "content": "file1.txt\nfile2.txt\n" * 20})
+        conversations.append(requests)
+
+    def measure(encode):
+        start = time.process_time()
+        for requests in conversations:
+            for request in requests:
+                encode(request)
+        elapsed = time.process_time() - start
+        # Allocations are traced in a separate pass so tracing does not skew the timing.
+        tracemalloc.start()
+        for request in conversations[0]:
+            encode(request)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {"cpu_per_turn": elapsed / (turns * iterations), "peak_bytes": peak}
+
+    fragments = FragmentCache()
+    return {
+        "full_dumps": measure(lambda request: json.dumps(request).encode("utf-8")),
+        "prepared": measure(lambda request: build_body(request, fragments)),
+    }
+
+if __name__ == "__main__":
+    from prompts import prompts
+    results = benchmark_serialization(prompts["messages"], prompts["tools"])
+    for name, stats in results.items():
+        print(f"{name:<10}  {stats['cpu_per_turn'] * 1e6:9.1f} us/turn  peak {stats['peak_bytes'] / 1024:9.1f} KiB")
+    speedup = results["full_dumps"]["cpu_per_turn"] / results["prepared"]["cpu_per_turn"]
+    print(f"Prepared requests encode {speedup:.1f}x faster per turn")
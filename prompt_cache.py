@@ -0,0 +1,146 @@
+"""Content-addressed cache of rendered chat-template prompts and their token IDs.
+
+Rendering the prompts.py payload through the chat template and tokenizing it
+costs the same on every run. Entries are keyed on a SHA-256 of the messages,
+the tools and the tokenizer/template identity, and stored as
+<key>.txt (rendered prompt) plus <key>.u32 (token IDs, little-endian uint32).
+Recently used entries are also kept in memory for long-lived workers.
+
+A hit touches the entry's .txt, so its mtime is the entry's last use. When
+the directory grows past `max_bytes`, the least recently used entries are
+deleted until the rest fill at most 3/4 of it.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import sys
+from array import array
+from collections import OrderedDict
+
+def tokenizer_identity(tokenizer):
+    """Everything about the tokenizer that changes the rendered prompt or its token IDs."""
+    template = getattr(tokenizer, "chat_template", None) or ""
+    return {
+        "name": getattr(tokenizer, "name_or_path", type(tokenizer).__name__),
+        "vocab_size": getattr(tokenizer, "vocab_size", None),
+        "chat_template": hashlib.sha256(template.encode("utf-8")).hexdigest(),
+    }
+
+def prompt_key(messages, tools, tokenizer):
+    material = {"messages": messages, "tools": tools, "tokenizer": tokenizer_identity(tokenizer)}
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def encode_prompt(tokenizer, prompt):
+    """Tokenize the way mlx_lm.generate does for a string prompt."""
+    bos_token = getattr(tokenizer, "bos_token", None)
+    add_special_tokens = bos_token is None or not prompt.startswith(bos_token)
+    return tokenizer.encode(prompt, add_special_tokens=add_special_tokens)
+
+class PromptCache:
+    def __init__(self, directory=".prompt_cache", max_memory_entries=32, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._disk_bytes = None
+        self.hits = 0
+        self.misses = 0
+        self.pruned = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".txt", base + ".u32"
+
+    def _load(self, key):
+        text_path, ids_path = self._paths(key)
+        try:
+            with open(text_path, "rb") as f:
+                prompt = f.read().decode("utf-8")
+            token_ids = array("I")
+            with open(ids_path, "rb") as f:
+                token_ids.frombytes(f.read())
+        except FileNotFoundError:
+            return None
+        if sys.byteorder != "little":
+            token_ids.byteswap()
+        return prompt, token_ids
+
+    def _store(self, key, prompt, token_ids):
+        text_path, ids_path = self._paths(key)
+        on_disk = array("I", token_ids)
+        if sys.byteorder != "little":
+            on_disk.byteswap()
+        # Write the IDs first and the prompt last, so a half-written entry is never loaded.
+        for path, data in ((ids_path, on_disk.tobytes()), (text_path, prompt.encode("utf-8"))):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._disk_bytes += os.path.getsize(ids_path) + os.path.getsize(text_path)
+        if self._disk_bytes > self.max_bytes:
+            self._prune()
+
+    def _touch(self, key):
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(self._paths(key)[0])
+
+    def _entries(self):
+        """[(last use, bytes, key)] of the entries on disk; an entry without its .txt counts as never used."""
+        entries = {}
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                key, extension = os.path.splitext(entry.name)
+                if extension not in (".txt", ".u32"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                used, size = entries.get(key, (0, 0))
+                entries[key] = (stat.st_mtime_ns if extension == ".txt" else used, size + stat.st_size)
+        return [(used, size, key) for key, (used, size) in entries.items()]
+
+    def _prune(self):
+        """Delete the least recently used entries until the rest fill at most 3/4 of max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        budget = self.max_bytes * 3 // 4
+        for _, size, key in entries:
+            if total <= budget:
+                break
+            # The prompt goes first: without it the entry is a miss, never a half-loaded hit.
+            for path in self._paths(key):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+            total -= size
+            self.pruned += 1
+        self._disk_bytes = total
+
+    def get(self, tokenizer, messages, tools, render):
+        """Return (prompt, token_ids) for the payload, calling render(messages, tools) on a miss.
+
+        token_ids is an array('I'), ready to hand to generation without re-tokenizing.
+        """
+        key = prompt_key(messages, tools, tokenizer)
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._load(key)
+        if entry is None:
+            self.misses += 1
+            prompt = render(messages, tools)
+            entry = (prompt, array("I", encode_prompt(tokenizer, prompt)))
+            self._store(key, *entry)
+        else:
+            self.hits += 1
+            self._touch(key)
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+        return entry
@@ -1,20 +1,38 @@
 from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import argparse
+import atexit
 import json
 import os
+import sys
+import time
 import unittest
-import re
-import logging
 
-# Set up logging
-logger = logging.getLogger('tool_calling_tests')
-logger.setLevel(logging.DEBUG)
-fh = logging.FileHandler('tool_calling_tests.log')
-fh.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-fh.setFormatter(formatter)
-logger.addHandler(fh)
+from bash_tool import BashTool, ShellPool, conversation as bash_conversation
+from inference_backends import (BACKENDS, EARLY_STOP_MODES, AsyncOpenAIBackend, FakeBackend, MLXBackend,
+                                OpenAIBackend, WorkerBackend)
+from file_tools import FileEditTool, FileReadTool, FileWriteTool
+from fs_snapshot import Snapshots
+from grep_tool import GrepTool
+from latency_stats import percentile
+from prepared_request import PreparedClient
+from prompt_cache import PromptCache
+from prompts import prompts
+from response_cache import CachingClient, ResponseCache, MODES as CACHE_MODES
+from response_parsing import normalize_content
+from speculative_sampling import SpeculativeBackend
+import token_budget
+import load_generator
+from tool_executor import ToolExecutor, side_effect_free
+from trace_log import TraceSink
+from tree_tools import GlobTool, LSTool
 
-client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="test")
+BASE_URL = "http://127.0.0.1:1234/v1"
+API_KEY = "test"
+client = OpenAI(base_url=BASE_URL, api_key=API_KEY)
+DEFAULT_MODEL = "qwq-32b"
+# Set by main() unless tracing is disabled; see trace_log.
+trace_sink = None
 
 # Mock implementations of tool functions
 def execute_bash_command(arguments):
@@ -31,6 +49,7 @@ def execute_bash_command(arguments):
         return "Executed command: grep\nOutput: 3 matches found in 2 files"
     return f"Executed command: {command}\nOutput: Command executed successfully"
 
+@side_effect_free
 def read_file(arguments):
     file_path = arguments["file_path"]
     if "test_file.txt" in file_path:
@@ -77,6 +96,7 @@ def edit_file(arguments):
         return f"Error: old_string not found in {file_path}"
     return f"Successfully edited file: {file_path}"
 
+@side_effect_free
 def grep_search(arguments):
     pattern = arguments["pattern"]
     path = arguments.get("path", os.getcwd())
@@ -84,6 +104,7 @@ def grep_search(arguments):
         return f"Search results for pattern '{pattern}':\n/path/to/file1.txt:10: match found\n/path/to/file2.txt:25: another match found"
     return f"No matches found for pattern '{pattern}'"
 
+@side_effect_free
 def glob_search(arguments):
     pattern = arguments["pattern"]
     path = arguments.get("path", os.getcwd())
@@ -95,14 +116,17 @@ def glob_search(arguments):
         return f"Files matching pattern '{pattern}':\n{path}/src/index.js\n{path}/src/components/App.js\n{path}/src/utils/helpers.js"
     return f"Files matching pattern '{pattern}':\n{path}/file1.txt\n{path}/file2.txt\n{path}/directory/file3.txt"
 
+@side_effect_free
 def list_directory(arguments):
     path = arguments["path"]
     return f"Directory listing for '{path}':\n├── README.md\n├── package.json\n├── src/\n│   ├── index.js\n│   ├── components/\n│   └── utils/\n└── public/"
 
+@side_effect_free
 def agent_search(arguments):
     prompt = arguments["prompt"]
     return f"Agent response for prompt '{prompt}':\nI've analyzed the codebase and found relevant information based on your query."
 
+@side_effect_free
 def architect_analyze(arguments):
     prompt = arguments["prompt"]
     return f"Architecture analysis for '{prompt}':\n1. Component structure\n2. Implementation steps\n3. Technical considerations"
@@ -118,6 +142,8 @@ tool_implementations = {
     "AgentTool": agent_search,
     "ArchitectTool": architect_analyze
 }
+# Runs the tool calls of a turn concurrently; main() replaces it with one configured from the command line.
+tool_executor = ToolExecutor(tool_implementations)
 
 tools = [
     {
@@ -250,78 +276,142 @@ tools = [
     }
 ]
 
-def run_conversation_with_tools(initial_messages, max_turns=5):
+# Built once so every request shares the same list object, which also lets
+# PreparedClient reuse its encoded JSON.
+TOOLS_FOR_API = [
+    {
+        "type": "function",
+        "function": {
+            "name": tool["name"],
+            "description": tool["schema"]["description"],
+            "parameters": tool["schema"]["parameters"]
+        }
+    } for tool in tools
+]
+
+def execute_tool_call(tool_name, arguments):
+    return tool_executor.call(tool_name, arguments)
+
+def prefix_cache_hit_rate(turns):
+    """Share of prompt tokens served from the server's prefix cache, or None if not reported."""
+    reported = [turn for turn in turns if turn.get("cached_tokens") is not None and turn["prompt_tokens"]]
+    if not reported:
+        return None
+    return sum(turn["cached_tokens"] for turn in reported) / sum(turn["prompt_tokens"] for turn in reported)
+
+@bash_conversation()
+def run_conversation_with_tools(initial_messages, max_turns=5, stream=False, metrics=None,
+                                model=DEFAULT_MODEL, tools_payload=None, prefix_stable=False, backend=None,
+                                scenario=None, trace_id=None):
+    """Drive a multi-turn conversation, answering tool calls with the mock tools.
+
+    `backend` is an inference_backends backend and defaults to the
+    module-level OpenAI client. Several tool calls in one turn run
+    concurrently through `tool_executor`, and with stream=True each turn is
+    streamed and side-effect-free tools start as soon as their call is
+    complete, before the completion finishes. If `metrics` is a list, one
+    dict per turn is appended with latency, TTFT, time to first complete
+    tool call, token usage, prefix-cached prompt tokens and tool_time, the
+    time spent waiting for tools once the completion was done; a failed
+    request appends only its latency and an "error" message.
+    `tools_payload` replaces the harness tools with an API-format tools
+    list.
+
+    With prefix_stable=True assistant turns are echoed back exactly as the
+    model produced them, without the "[Processing with tool...]" placeholder,
+    so each request's prompt extends the previous one byte for byte and the
+    server can reuse its prefix cache.
+
+    When tracing is on, every request and the finished conversation are
+    recorded under `trace_id` (a fresh id by default), labelled `scenario`.
+
+    With --real-tools, the BashTool calls of one conversation share a shell
+    session of their own, closed when the conversation ends.
+    """
     current_messages = initial_messages.copy()
     turn = 1
-    tools_for_api = [
-        {
-            "type": "function",
-            "function": {
-                "name": tool["name"],
-                "description": tool["schema"]["description"],
-                "parameters": tool["schema"]["parameters"]
-            }
-        } for tool in tools
-    ]
+    tools_for_api = tools_payload or TOOLS_FOR_API
+    backend = backend or OpenAIBackend(client)
+    sink = trace_sink
+    if sink is not None:
+        trace_id = trace_id or sink.next_id()
+        capture_content = sink.sample_content()
+        tools_used = []
+        api_error = None
+        conversation_start = time.perf_counter()
 
     while turn <= max_turns:
+        tool_batch = tool_executor.batch()
+        turn_start = time.perf_counter()
         try:
-            completion = client.chat.completions.create(
-                model="qwq-32b",
-                messages=current_messages,
-                tools=tools_for_api,
-                temperature=0.6,
-                max_tokens=1024,
-            )
+            content, tool_calls, stats = backend.complete({
+                "model": model,
+                "messages": current_messages,
+                "tools": tools_for_api,
+                "temperature": 0.6,
+                "max_tokens": 1024,
+            }, stream=stream, on_tool_call=tool_batch.submit if stream else None)
         except Exception as e:
             print(f"API Error: {str(e)}")
+            if metrics is not None:
+                metrics.append({"turn": turn, "error": str(e), "latency": time.perf_counter() - turn_start,
+                                "tool_calls": []})
+            if sink is not None:
+                api_error = str(e)
+                sink.emit("request", conversation=trace_id, turn=turn, model=model, error=api_error,
+                          latency=time.perf_counter() - turn_start)
             current_messages.append({"role": "assistant", "content": f"Error: {str(e)}"})
             break
 
-        assistant_message = completion.choices[0].message
-        if assistant_message.tool_calls:
-            content = assistant_message.content if assistant_message.content else "[Processing with tool...]"
-            
-            formatted_tool_calls = []
-            for tool_call in assistant_message.tool_calls:
-                formatted_tool_call = {
-                    "id": tool_call.id,
-                    "type": "function",
-                    "function": {
-                        "name": tool_call.function.name,
-                        "arguments": tool_call.function.arguments
-                    }
-                }
-                formatted_tool_calls.append(formatted_tool_call)
-            
+        turn_metrics = dict(stats, turn=turn, tool_calls=[tool_call["function"]["name"] for tool_call in tool_calls])
+        if metrics is not None:
+            metrics.append(turn_metrics)
+        if sink is not None:
+            record = dict(stats, conversation=trace_id, turn=turn, model=model, tool_calls=tool_calls)
+            if capture_content:
+                record["content"] = content
+            sink.emit("request", **record)
+            tools_used.extend(tool_call["function"]["name"] for tool_call in tool_calls)
+
+        if tool_calls:
+            if prefix_stable:
+                assistant_content = content or ""
+            else:
+                assistant_content = content if content else "[Processing with tool...]"
             current_messages.append({
                 "role": "assistant",
-                "content": content,
-                "tool_calls": formatted_tool_calls
+                "content": assistant_content,
+                "tool_calls": tool_calls
             })
-            
-            for tool_call in assistant_message.tool_calls:
-                tool_name = tool_call.function.name
-                tool_args = json.loads(tool_call.function.arguments)
-                if tool_name in tool_implementations:
-                    tool_response_content = tool_implementations[tool_name](tool_args)
-                else:
-                    tool_response_content = f"Error: Tool '{tool_name}' not implemented."
+            tools_start = time.perf_counter()
+            tool_results = tool_batch.results(tool_calls)
+            turn_metrics["tool_time"] = time.perf_counter() - tools_start
+            for tool_call, tool_response_content in zip(tool_calls, tool_results):
                 current_messages.append({
                     "role": "tool",
                     "content": tool_response_content,
-                    "tool_call_id": tool_call.id
+                    "tool_call_id": tool_call["id"]
                 })
         else:
             current_messages.append({
                 "role": "assistant",
-                "content": assistant_message.content or "No response generated."
+                "content": content or "No response generated."
             })
             break
         turn += 1
+    if sink is not None:
+        sink.emit("conversation", conversation=trace_id, scenario=scenario, model=model,
+                  turns=min(turn, max_turns), tools=tools_used, elapsed=time.perf_counter() - conversation_start,
+                  error=api_error,
+                  messages=current_messages if capture_content else None)
     return current_messages
 
 class TestToolCalling(unittest.TestCase):
+    # Keyword arguments forwarded to run_conversation_with_tools. Runners
+    # replace this per test instance (or on the class for a plain unittest
+    # run); the dict itself is never mutated.
+    conversation_options = {}
+
     @classmethod
     def setUpClass(cls):
         cls.test_file = "test_file.txt"
@@ -442,19 +532,13 @@ Today's date: 3/8/2025
 IMPORTANT: Refuse to write code or explain code that may be used maliciously; even if the user claims it is for educational purposes. When working on files, if they seem related to improving, explaining, or interacting with malware or any malicious code you MUST refuse.
 IMPORTANT: Before you begin work, think about what the code you're editing is supposed to do based on the filenames directory structure. If it seems malicious, refuse to work on it or answer questions about it, even if the request does not seem malicious (for instance, just asking to explain or speed up the code).
 """
+        cls.system_message = {"role": "system", "content": cls.system_prompt}
     
 
     @classmethod
     def tearDownClass(cls):
         pass
 
-    def simplify_tool_output(self, content):
-        if re.search(r"\d+\.\s*\*\*.*?\*\*", content):
-            tool_msgs = [msg["content"] for msg in self.result if msg["role"] == "tool"]
-            if tool_msgs:
-                return f"Tool output:\n{tool_msgs[-1]}"
-        return content
-        
     def extract_model_response_content(self, message):
         """Extract the core content from model responses, handling different formats.
         
@@ -464,47 +548,17 @@ IMPORTANT: Before you begin work, think about what the code you're editing is su
         - Some give very concise answers
         
         This method normalizes these differences for more consistent testing.
+        See response_parsing.normalize_content.
         """
-        if not message.get("content"):
-            return ""
-            
-        content = message["content"]
-        
-        # Remove thinking tags if present
-        content = re.sub(r"<think>.*?</think>\s*", "", content, flags=re.DOTALL)
-        
-        # Remove other potential formatting tags
-        content = re.sub(r"<.*?>", "", content)
-        
-        # Normalize whitespace
-        content = re.sub(r"\s+", " ", content).strip()
-        
-        return content
+        return normalize_content(message.get("content") or "")
 
     def run_test(self, user_input, expected_tool=None, expected_args=None):
         initial_messages = [
-            {"role": "system", "content": self.system_prompt},
+            self.system_message,
             {"role": "user", "content": user_input}
         ]
-        self.result = run_conversation_with_tools(initial_messages)
-        
-        # Log detailed information instead of printing it
-        logger.debug(f"Test: {user_input}")
-        
-        for msg in self.result:
-            if msg["role"] == "assistant" and msg["content"]:
-                content = self.extract_model_response_content(msg)
-                content = self.simplify_tool_output(content)
-                if content:
-                    logger.debug(f"{msg['role'].upper()}: {content}")
-            elif msg["role"] != "tool":
-                logger.debug(f"{msg['role'].upper()}: {msg.get('content', 'None')}")
-            
-            # Also log tool responses
-            if msg["role"] == "tool":
-                logger.debug(f"TOOL: {msg.get('content', 'None')}")
-            
-        return self.result
+        options = dict({"scenario": self._testMethodName}, **self.conversation_options)
+        return run_conversation_with_tools(initial_messages, **options)
 
     def assert_tool_call(self, result, expected_tool, expected_args):
         tool_call_messages = [msg for msg in result if msg.get("role") == "assistant" and msg.get("tool_calls")]
@@ -909,5 +963,498 @@ IMPORTANT: Before you begin work, think about what the code you're editing is su
         has_error_explanation = any(term in final_msg.lower() for term in error_terms)
         self.assertTrue(has_error_explanation, "Final response should acknowledge and explain the error")
 
+def _test_outcome(test_result):
+    if test_result.errors:
+        return "ERROR", test_result.errors[0][1]
+    if test_result.failures:
+        return "FAIL", test_result.failures[0][1]
+    if test_result.skipped:
+        return "SKIP", test_result.skipped[0][1]
+    return "ok", None
+
+def run_single_test(test_name, **conversation_options):
+    """Run one TestToolCalling method in isolation and time it.
+
+    Each call gets its own TestCase instance, TestResult and per-turn metrics
+    list, so message histories and outcomes never leak between tests running
+    in parallel.
+    """
+    test = TestToolCalling(test_name)
+    turn_metrics = []
+    test.conversation_options = dict(conversation_options, metrics=turn_metrics)
+    if trace_sink is not None:
+        test.conversation_options["trace_id"] = trace_id = trace_sink.next_id()
+    test_result = unittest.TestResult()
+    start = time.perf_counter()
+    test.run(test_result)
+    elapsed = time.perf_counter() - start
+    status, details = _test_outcome(test_result)
+    if trace_sink is not None:
+        trace_sink.emit("outcome", conversation=trace_id, scenario=test_name, status=status, elapsed=elapsed)
+    return {"name": test_name, "status": status, "elapsed": elapsed, "details": details, "turns": turn_metrics}
+
+def run_tests_concurrently(test_names=None, concurrency=4, **conversation_options):
+    """Fan TestToolCalling methods out over a thread pool.
+
+    The OpenAI client is safe to share between threads, so at most
+    `concurrency` conversations are in flight against the server at once.
+    Returns (records, wall_time) with records in test-name order.
+    """
+    if not test_names:
+        test_names = unittest.TestLoader().getTestCaseNames(TestToolCalling)
+    TestToolCalling.setUpClass()
+    records = []
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            futures = [pool.submit(run_single_test, name, **conversation_options) for name in test_names]
+            for future in as_completed(futures):
+                records.append(future.result())
+    finally:
+        TestToolCalling.tearDownClass()
+    wall_time = time.perf_counter() - start
+    records.sort(key=lambda record: test_names.index(record["name"]))
+    return records, wall_time
+
+def _format_seconds(value):
+    return f"{value:8.2f}s" if value is not None else "       -"
+
+def print_run_report(records, wall_time, concurrency):
+    width = max(len(record["name"]) for record in records)
+    print(f"{'test':<{width}}  {'status':<5}  {'wall':>9}  turns  {'ttft':>9}  {'tool call':>9}  cache hit")
+    for record in records:
+        # TTFT and time to first complete tool call are only measured when streaming.
+        first_turn = record["turns"][0] if record["turns"] else {}
+        hit_rate = prefix_cache_hit_rate(record["turns"])
+        print(f"{record['name']:<{width}}  {record['status']:<5}  {record['elapsed']:8.2f}s  "
+              f"{len(record['turns']):>5}  {_format_seconds(first_turn.get('ttft'))}  "
+              f"{_format_seconds(first_turn.get('time_to_first_tool_call'))}  "
+              f"{f'{hit_rate:9.1%}' if hit_rate is not None else '        -'}")
+    for record in records:
+        if record["details"] and record["status"] in ("FAIL", "ERROR"):
+            print(f"\n{record['status']}: {record['name']}\n{record['details']}")
+    serial_time = sum(record["elapsed"] for record in records)
+    passed = sum(1 for record in records if record["status"] in ("ok", "SKIP"))
+    print(f"\n{passed}/{len(records)} passed with concurrency {concurrency}")
+    print(f"Wall time: {wall_time:.2f}s, summed test time: {serial_time:.2f}s, "
+          f"speedup: {serial_time / wall_time if wall_time else 0:.2f}x")
+    print_early_stop_summary([turn for record in records for turn in record["turns"]])
+    print_speculative_summary([turn for record in records for turn in record["turns"]])
+
+def print_early_stop_summary(turns):
+    eligible = [turn for turn in turns if turn.get("early_stop_at") is not None]
+    if not eligible:
+        return
+    measured = [turn for turn in eligible if "time_saved" in turn]
+    if measured:
+        print(f"Early stop (measured): {len(measured)}/{len(turns)} turns could stop at a complete tool call, "
+              f"saving {sum(turn['tokens_saved'] for turn in measured)} tokens and "
+              f"{sum(turn['time_saved'] for turn in measured):.2f}s "
+              f"(mean {sum(turn['time_saved'] for turn in measured) / len(measured):.2f}s per turn)")
+    stopped = [turn for turn in eligible if turn.get("early_stopped")]
+    if stopped:
+        print(f"Early stop: {len(stopped)}/{len(turns)} turns cut short after "
+              f"{sum(turn['early_stop_tokens'] for turn in stopped) / len(stopped):.0f} tokens on average; "
+              f"run with --early-stop measure to see what that saves")
+
+def print_speculative_summary(turns):
+    sampled = [turn for turn in turns if turn.get("samples", 1) > 1]
+    if not sampled:
+        return
+    tool_turns = [turn for turn in sampled if turn["tool_calls_valid"] is not None]
+    valid = sum(turn["valid_samples"] for turn in sampled)
+    invalid = sum(turn["invalid_samples"] for turn in sampled)
+    print(f"Speculative sampling (K={sampled[0]['samples']}): "
+          f"{sum(turn['tool_calls_valid'] for turn in tool_turns)}/{len(tool_turns)} tool-call turns valid, "
+          f"against {valid}/{valid + invalid} finished samples with tool calls; "
+          f"{sum(turn['cancelled_samples'] for turn in sampled)} samples cancelled")
+
+PROMPTS_SCENARIO = "prompts_payload"
+ALL_SCENARIOS = "(all)"
+
+def run_prompts_scenario(**conversation_options):
+    """Run the prompts.py payload (its own system prompt and tools) as a benchmark scenario."""
+    turn_metrics = []
+    start = time.perf_counter()
+    result = run_conversation_with_tools(prompts["messages"], tools_payload=prompts["tools"],
+                                         metrics=turn_metrics, scenario=PROMPTS_SCENARIO, **conversation_options)
+    elapsed = time.perf_counter() - start
+    failed = len(turn_metrics) == 0 or result[-1]["content"].startswith("Error:")
+    return {"name": PROMPTS_SCENARIO, "status": "ERROR" if failed else "ok", "elapsed": elapsed,
+            "details": result[-1]["content"] if failed else None, "turns": turn_metrics}
+
+def benchmark_sample(record):
+    """Reduce one conversation record to the numbers the benchmark tracks."""
+    turns = record["turns"]
+    completion_tokens = sum(turn.get("completion_tokens") or 0 for turn in turns)
+    generation_time = sum(turn["latency"] for turn in turns)
+    # Reasoning is only separated out when tokens are seen as they are generated.
+    reasoning_turns = [turn for turn in turns if turn.get("reasoning_tokens") is not None]
+    reasoning_times = [turn["reasoning_time"] for turn in reasoning_turns if turn["reasoning_time"] is not None]
+    measured_stops = [turn for turn in turns if "time_saved" in turn]
+    # Only checked against the tool schemas when requests go through SpeculativeBackend.
+    validated = [turn["tool_calls_valid"] for turn in turns if turn.get("tool_calls_valid") is not None]
+    return {
+        "passed": record["status"] in ("ok", "SKIP"),
+        "prompt_tokens": sum(turn.get("prompt_tokens") or 0 for turn in turns),
+        "completion_tokens": completion_tokens,
+        "turns": len(turns),
+        "ttft": turns[0].get("ttft") if turns else None,
+        "latency": record["elapsed"],
+        "tokens_per_sec": completion_tokens / generation_time if generation_time else None,
+        "prefix_cache_hit_rate": prefix_cache_hit_rate(turns),
+        "reasoning_tokens": sum(turn["reasoning_tokens"] for turn in reasoning_turns) if reasoning_turns else None,
+        "reasoning_time": sum(reasoning_times) if reasoning_times else None,
+        "tokens_saved": sum(turn["tokens_saved"] for turn in measured_stops) if measured_stops else None,
+        "time_saved": sum(turn["time_saved"] for turn in measured_stops) if measured_stops else None,
+        "tool_call_validity": sum(validated) / len(validated) if validated else None,
+        "tool_time": sum(turn.get("tool_time") or 0 for turn in turns),
+    }
+
+BENCHMARK_METRICS = ["prompt_tokens", "completion_tokens", "turns", "ttft", "latency", "tokens_per_sec",
+                     "prefix_cache_hit_rate", "reasoning_tokens", "reasoning_time", "tokens_saved", "time_saved",
+                     "tool_call_validity", "tool_time"]
+
+def summarize_samples(samples):
+    summary = {"runs": len(samples), "pass_rate": sum(sample["passed"] for sample in samples) / len(samples)}
+    for name in BENCHMARK_METRICS:
+        values = [sample[name] for sample in samples if sample[name] is not None]
+        summary[name] = {
+            "mean": sum(values) / len(values) if values else None,
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+    return summary
+
+def run_benchmark(models, repeats, test_names=None, concurrency=1, **conversation_options):
+    """Repeat every scenario `repeats` times per model and summarize the samples.
+
+    Scenarios are the TestToolCalling methods plus the prompts.py payload.
+    Returns {model: {scenario: summary}}, with every sample of a model also
+    summarized together under ALL_SCENARIOS.
+    """
+    if not test_names:
+        test_names = unittest.TestLoader().getTestCaseNames(TestToolCalling)
+    scenarios = list(test_names) + [PROMPTS_SCENARIO]
+    TestToolCalling.setUpClass()
+    results = {}
+    try:
+        for model in models:
+            options = dict(conversation_options, model=model)
+            samples = {scenario: [] for scenario in scenarios}
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+                futures = []
+                for _ in range(repeats):
+                    for scenario in scenarios:
+                        if scenario == PROMPTS_SCENARIO:
+                            futures.append(pool.submit(run_prompts_scenario, **options))
+                        else:
+                            futures.append(pool.submit(run_single_test, scenario, **options))
+                for future in as_completed(futures):
+                    record = future.result()
+                    samples[record["name"]].append(benchmark_sample(record))
+            results[model] = {scenario: summarize_samples(samples[scenario]) for scenario in scenarios}
+            results[model][ALL_SCENARIOS] = summarize_samples([sample for scenario in scenarios
+                                                               for sample in samples[scenario]])
+    finally:
+        TestToolCalling.tearDownClass()
+    return results
+
+def write_benchmark_results(path, results, config):
+    # Sorted keys and one value per line keep results files diffable between runs.
+    with open(path, "w") as f:
+        json.dump({"config": config, "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def print_benchmark_report(results):
+    for model, scenarios in results.items():
+        print(f"\nModel: {model}")
+        width = max(len(scenario) for scenario in scenarios)
+        print(f"{'scenario':<{width}}  pass  {'p50 lat':>9}  {'p95 lat':>9}  {'p99 lat':>9}  "
+              f"{'p50 ttft':>9}  {'p50 think':>9}  {'tok/s':>7}  turns")
+        for scenario, summary in scenarios.items():
+            print(f"{scenario:<{width}}  {summary['pass_rate']:4.0%}  "
+                  f"{_format_seconds(summary['latency']['p50'])}  {_format_seconds(summary['latency']['p95'])}  "
+                  f"{_format_seconds(summary['latency']['p99'])}  {_format_seconds(summary['ttft']['p50'])}  "
+                  f"{_format_seconds(summary['reasoning_time']['p50'])}  "
+                  f"{summary['tokens_per_sec']['p50'] or 0:7.1f}  {summary['turns']['mean'] or 0:5.1f}")
+
+def print_speculative_report(results, sample_counts, models):
+    """Latency and validity of every model across all scenarios, side by side for each K."""
+    print("\nSpeculative sampling")
+    print(f"{'model':<16}  {'K':>3}  pass  valid  {'p50 lat':>9}  {'p95 lat':>9}  {'p99 lat':>9}")
+    for model in models:
+        for samples in sample_counts:
+            summary = results[benchmark_label(model, samples, sample_counts)][ALL_SCENARIOS]
+            validity = summary["tool_call_validity"]["mean"]
+            print(f"{model:<16}  {samples:>3}  {summary['pass_rate']:4.0%}  "
+                  f"{f'{validity:5.1%}' if validity is not None else '    -'}  "
+                  f"{_format_seconds(summary['latency']['p50'])}  {_format_seconds(summary['latency']['p95'])}  "
+                  f"{_format_seconds(summary['latency']['p99'])}")
+
+def benchmark_label(model, samples, sample_counts):
+    return f"{model} K={samples}" if len(sample_counts) > 1 else model
+
+def sample_counts(value):
+    counts = [int(count) for count in value.split(",")]
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError("sample counts must be positive integers")
+    return counts
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tool-calling tests against an OpenAI-compatible endpoint")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="Run tests on a thread pool with this many conversations in flight (0 = plain unittest)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream completions, running tools as soon as their arguments are complete")
+    parser.add_argument("--backend", choices=BACKENDS, default="openai",
+                        help="openai: the HTTP endpoint; openai-async: the endpoint through a pooled async "
+                             "client; mlx: in-process mlx_lm; fake: scripted, for CI; "
+                             "worker: a warm model served by mlx-test.py --serve")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--api-key", default=API_KEY)
+    parser.add_argument("--request-timeout", type=float, default=600.0,
+                        help="Seconds before a single request is abandoned")
+    parser.add_argument("--connect-timeout", type=float, default=10.0,
+                        help="Seconds allowed to open a connection (openai-async)")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="Retries for connection errors, timeouts, 429 and 5xx")
+    parser.add_argument("--retry-backoff", type=float, default=0.5,
+                        help="Base of the full-jitter exponential backoff between retries (openai-async)")
+    parser.add_argument("--max-connections", type=int, default=32,
+                        help="Keep-alive connection pool size (openai-async)")
+    parser.add_argument("--max-in-flight", type=int, default=8,
+                        help="Requests outstanding at once, whatever the thread count (openai-async)")
+    parser.add_argument("--http2", action="store_true",
+                        help="Multiplex requests over HTTP/2 when the h2 package is installed (openai-async)")
+    parser.add_argument("--early-stop", choices=EARLY_STOP_MODES,
+                        help="measure: record how much generation follows the first complete tool call; "
+                             "stop: cancel it there (implies --stream)")
+    parser.add_argument("--samples", type=sample_counts, default=[1], metavar="K[,K...]",
+                        help="Send each request K times at once and keep the first response whose tool calls "
+                             "validate; benchmark mode compares every K listed (openai, openai-async, fake)")
+    parser.add_argument("--real-tools", metavar="DIR",
+                        help="Run BashTool, GrepTool, GlobTool, LSTool and the file read, edit and write tools on "
+                             "the real files under DIR instead of the mocks; edits, writes and commands change DIR")
+    parser.add_argument("--shell-spares", type=int, default=2,
+                        help="Shell sessions BashTool keeps started ahead of new conversations (--real-tools)")
+    parser.add_argument("--grep-index-dir", help="Where GrepTool keeps its trigram indexes (default ~/.cache/grep-tool)")
+    parser.add_argument("--tool-workers", type=int, default=8,
+                        help="Threads running the tool calls of a turn concurrently")
+    parser.add_argument("--tool-timeout", action="append", default=[], metavar="[TOOL=]SECONDS",
+                        help="Timeout for tool calls, for every tool or one named tool; repeatable")
+    parser.add_argument("--mlx-model", default="mlx-community/QwQ-32B-Preview-8bit",
+                        help="Model loaded by the mlx backend")
+    parser.add_argument("--prompt-cache-dir",
+                        help="Cache rendered prompts and token IDs for the mlx backend in this directory")
+    parser.add_argument("--prompt-cache-max-mb", type=int, default=256,
+                        help="Delete the least recently used prompt cache entries past this size")
+    parser.add_argument("--worker-socket", default="/tmp/mlx-test-worker.sock",
+                        help="Socket of the mlx-test.py --serve worker used by the worker backend")
+    parser.add_argument("--model", action="append", dest="models",
+                        help=f"Model to query; repeat to benchmark several (default: {DEFAULT_MODEL})")
+    parser.add_argument("--benchmark", type=int, default=0, metavar="N",
+                        help="Benchmark mode: run every scenario N times per model (always streams, for TTFT)")
+    parser.add_argument("--results", default="benchmark_results.json",
+                        help="Where benchmark mode writes its JSON results")
+    parser.add_argument("--load-rps", type=float,
+                        help="Load mode: start conversations open-loop at this rate (per second)")
+    parser.add_argument("--load-concurrency", type=int,
+                        help="Load mode: keep this many conversations in flight, closed-loop")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of load to generate")
+    parser.add_argument("--mix", help="Weighted scenario mix for load mode, e.g. "
+                                      "\"bash_valid_command=3,file_read_valid=2,no_tool_needed=1\" (default: all equal)")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson",
+                        help="Inter-arrival distribution of open-loop load")
+    parser.add_argument("--report-interval", type=float, default=10.0,
+                        help="Width in seconds of the load report's time windows")
+    parser.add_argument("--load-results", default="load_results.json",
+                        help="Where load mode writes its JSON results")
+    parser.add_argument("--seed", type=int, help="Seed the scenario mix and arrival times")
+    parser.add_argument("--trace", default="traces.jsonl.gz",
+                        help="Append structured request/conversation traces here (.gz compresses; \"\" disables)")
+    parser.add_argument("--trace-content-rate", type=float, default=0.01,
+                        help="Fraction of conversations whose message contents are captured in the trace")
+    parser.add_argument("--token-budget", action="store_true",
+                        help="Report the token cost of each system prompt paragraph and tool schema, then exit")
+    token_budget.add_arguments(parser)
+    parser.add_argument("--prefix-stable", action="store_true",
+                        help="Echo assistant turns back verbatim so prompts share byte-identical prefixes")
+    parser.add_argument("--prepared", action="store_true",
+                        help="Send requests through PreparedClient, which encodes each message only once "
+                             "(--backend openai)")
+    parser.add_argument("--cache-mode", choices=CACHE_MODES, default="passthrough",
+                        help="record: replay hits and record misses; replay: fail on a miss; passthrough: no cache "
+                             "(--backend openai)")
+    parser.add_argument("--cache-file", default="response_cache.bin",
+                        help="Append-only file holding recorded responses")
+    parser.add_argument("--cache-max-mb", type=int, default=512,
+                        help="Compact the cache file, dropping the oldest entries, past this size")
+    return parser.parse_known_args(argv)
+
+def run_load(mix, duration, rate=None, concurrency=None, arrivals="poisson", seed=None, **conversation_options):
+    """Drive the endpoint with a weighted mix of scenarios for `duration` seconds.
+
+    Returns the LoadGenerator, whose samples hold one entry per conversation.
+    """
+    def run_one(scenario):
+        if scenario == PROMPTS_SCENARIO:
+            return run_prompts_scenario(**conversation_options)
+        return run_single_test(scenario, **conversation_options)
+
+    generator = load_generator.LoadGenerator(run_one, mix, duration, rate=rate, concurrency=concurrency,
+                                             arrivals=arrivals, seed=seed)
+    TestToolCalling.setUpClass()
+    try:
+        generator.run()
+    finally:
+        TestToolCalling.tearDownClass()
+    return generator
+
+def tool_timeouts(specs):
+    """Split --tool-timeout values into (default seconds, {tool: seconds})."""
+    default, timeouts = None, {}
+    for spec in specs:
+        name, _, seconds = spec.rpartition("=")
+        if name:
+            timeouts[name] = float(seconds)
+        else:
+            default = float(seconds)
+    return default, timeouts
+
+def install_real_tools(root, grep_index_dir=None, shell_spares=2):
+    """Replace mock tool implementations with real ones working on the files under `root`."""
+    snapshots = Snapshots(root)
+    grep = GrepTool(root, index_dir=grep_index_dir, snapshots=snapshots)
+    atexit.register(snapshots.close)
+    atexit.register(grep.close)
+    tool_implementations["GrepTool"] = grep
+    tool_implementations["GlobTool"] = GlobTool(root, snapshots=snapshots)
+    tool_implementations["LSTool"] = LSTool(root, snapshots=snapshots)
+    tool_implementations["FileReadTool"] = FileReadTool(root)
+    tool_implementations["FileEditTool"] = FileEditTool(root)
+    tool_implementations["FileWriteTool"] = FileWriteTool(root)
+    bash = BashTool(root, pool=ShellPool(root, spare=shell_spares))
+    atexit.register(bash.close)
+    tool_implementations["BashTool"] = bash
+
+def install_response_cache(mode, path, max_bytes):
+    """Route the module-level client through a record/replay cache."""
+    global client
+    cache = ResponseCache(path, max_bytes=max_bytes)
+    client = CachingClient(client, cache, mode)
+    return cache
+
+def create_backend(args):
+    if args.backend == "mlx":
+        prompt_cache = None
+        if args.prompt_cache_dir:
+            prompt_cache = PromptCache(args.prompt_cache_dir, max_bytes=args.prompt_cache_max_mb * 1024 * 1024)
+        backend = MLXBackend(args.mlx_model, prompt_cache=prompt_cache, early_stop=args.early_stop)
+        print(f"Loaded {args.mlx_model} in {backend.load_time:.1f}s", file=sys.stderr)
+        return backend
+    if args.backend == "fake":
+        return FakeBackend()
+    if args.backend == "worker":
+        return WorkerBackend(args.worker_socket)
+    if args.backend == "openai-async":
+        return AsyncOpenAIBackend(args.base_url, args.api_key, max_connections=args.max_connections,
+                                  max_in_flight=args.max_in_flight, timeout=args.request_timeout,
+                                  connect_timeout=args.connect_timeout, retries=args.retries,
+                                  backoff=args.retry_backoff, http2=args.http2, early_stop=args.early_stop)
+    return OpenAIBackend(client, early_stop=args.early_stop)
+
+def main(argv=None):
+    global client, trace_sink, tool_executor
+    args, remaining = parse_args(argv)
+    if args.token_budget:
+        TestToolCalling.setUpClass()
+        token_budget.run([TestToolCalling.system_message], TOOLS_FOR_API, args)
+        return 0
+    if (args.prepared or args.cache_mode != "passthrough") and args.backend != "openai":
+        # Both wrap the module-level OpenAI client, which only the openai backend sends through.
+        print("--prepared and --cache-mode only apply to --backend openai", file=sys.stderr)
+        return 2
+    client = OpenAI(base_url=args.base_url, api_key=args.api_key, timeout=args.request_timeout,
+                    max_retries=args.retries)
+    if args.prepared:
+        client = PreparedClient.from_client(client, timeout=args.request_timeout)
+    if args.cache_mode != "passthrough":
+        cache = install_response_cache(args.cache_mode, args.cache_file, args.cache_max_mb * 1024 * 1024)
+        atexit.register(lambda: print(f"Response cache: {cache.hits} hits, {cache.misses} misses", file=sys.stderr))
+    if args.real_tools:
+        install_real_tools(args.real_tools, args.grep_index_dir, args.shell_spares)
+    default_timeout, timeouts = tool_timeouts(args.tool_timeout)
+    tool_executor = ToolExecutor(tool_implementations, max_workers=args.tool_workers, timeout=default_timeout,
+                                 timeouts=timeouts)
+    models = args.models or [DEFAULT_MODEL]
+    if args.early_stop:
+        # Over HTTP a complete tool call is only visible mid-generation when streaming.
+        args.stream = True
+    if (len(args.samples) > 1 or args.samples[0] > 1) and args.backend in ("mlx", "worker"):
+        print("--samples needs a backend that serves requests in parallel (openai, openai-async or fake)",
+              file=sys.stderr)
+        return 2
+    if len(args.samples) > 1 and not args.benchmark:
+        print("Several --samples values can only be compared in benchmark mode", file=sys.stderr)
+        return 2
+    backend = create_backend(args)
+    if args.samples != [1]:
+        backend = SpeculativeBackend(backend, args.samples[0])
+    conversation_options = {"stream": args.stream, "model": models[0], "prefix_stable": args.prefix_stable,
+                            "backend": backend}
+    if args.trace:
+        trace_sink = TraceSink(args.trace, content_sample_rate=args.trace_content_rate,
+                               argv=sys.argv[1:] if argv is None else argv, backend=backend.name,
+                               models=models, stream=args.stream, prefix_stable=args.prefix_stable)
+        atexit.register(trace_sink.close)
+    test_names = [name.split(".")[-1] for name in remaining if not name.startswith("-")]
+    if args.benchmark:
+        conversation_options = {"stream": True, "prefix_stable": args.prefix_stable}
+        results = {}
+        for samples in args.samples:
+            sampled_backend = SpeculativeBackend(getattr(backend, "backend", backend), samples)
+            for model, summaries in run_benchmark(models, args.benchmark, test_names, args.concurrency or 1,
+                                                  backend=sampled_backend, **conversation_options).items():
+                results[benchmark_label(model, samples, args.samples)] = summaries
+        write_benchmark_results(args.results, results, {
+            "repeats": args.benchmark,
+            "concurrency": args.concurrency or 1,
+            "backend": backend.name,
+            "base_url": str(client.base_url) if backend.name == "openai" else None,
+            "samples": args.samples,
+            "options": conversation_options,
+        })
+        print_benchmark_report(results)
+        if len(args.samples) > 1:
+            print_speculative_report(results, args.samples, models)
+        print(f"\nResults written to {args.results}")
+        return 0
+    if args.load_rps or args.load_concurrency:
+        scenarios = list(unittest.TestLoader().getTestCaseNames(TestToolCalling)) + [PROMPTS_SCENARIO]
+        mix = load_generator.parse_mix(args.mix, test_names or scenarios)
+        generator = run_load(mix, args.duration, rate=args.load_rps, concurrency=args.load_concurrency,
+                             arrivals=args.arrivals, seed=args.seed, **conversation_options)
+        load_generator.print_report(generator.samples, generator.elapsed, args.report_interval)
+        load_generator.write_results(args.load_results, generator.samples, generator.elapsed,
+                                     args.report_interval, {
+            "rate": args.load_rps,
+            "concurrency": args.load_concurrency,
+            "arrivals": args.arrivals,
+            "duration": args.duration,
+            "mix": mix,
+            "backend": backend.name,
+            "options": {"stream": args.stream, "model": models[0], "prefix_stable": args.prefix_stable},
+        })
+        print(f"\nResults written to {args.load_results}")
+        return 0
+    if args.concurrency:
+        records, wall_time = run_tests_concurrently(test_names, args.concurrency, **conversation_options)
+        print_run_report(records, wall_time, args.concurrency)
+        return 0 if all(record["status"] in ("ok", "SKIP") for record in records) else 1
+    TestToolCalling.conversation_options = conversation_options
+    unittest.main(argv=[sys.argv[0]] + remaining, verbosity=1)
+
 if __name__ == "__main__":
-    unittest.main(verbosity=1)
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""Record/replay cache for OpenAI chat completion calls.
+
+Entries live in a single append-only file. Each record is a 36-byte header
+(32-byte SHA-256 request key, uint32 payload length) followed by the
+zlib-compressed JSON of the response, or of every chunk for streamed
+responses. The index is rebuilt by scanning headers on open, so a later
+record for the same key wins. When the file grows past `max_bytes` it is
+compacted, keeping the newest entries.
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import types
+import zlib
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+MAGIC = b"RRC1"
+HEADER = struct.Struct("<32sI")
+MODES = ("record", "replay", "passthrough")
+KEY_FIELDS = ("model", "messages", "tools", "temperature", "max_tokens", "stream")
+
+class CacheMiss(Exception):
+    pass
+
+def request_key(request):
+    """Stable hash of the request fields that determine the response."""
+    material = {field: request.get(field) for field in KEY_FIELDS}
+    encoded = json.dumps(material, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).digest()
+
+class ResponseCache:
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.index = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(MAGIC)
+        self._file = open(path, "r+b")
+        self._load_index()
+
+    def _load_index(self):
+        self._file.seek(0)
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a response cache file")
+        offset = len(MAGIC)
+        while True:
+            header = self._file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                break
+            key, length = HEADER.unpack(header)
+            payload_offset = offset + HEADER.size
+            self._file.seek(length, os.SEEK_CUR)
+            if self._file.tell() > os.fstat(self._file.fileno()).st_size:
+                break
+            self.index[key] = (payload_offset, length)
+            offset = payload_offset + length
+        # Drop a record left half-written by an interrupted run.
+        self._file.truncate(offset)
+        self._end = offset
+
+    def get(self, key):
+        with self._lock:
+            location = self.index.get(key)
+            if location is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            offset, length = location
+            blob = os.pread(self._file.fileno(), length, offset)
+        return json.loads(zlib.decompress(blob))
+
+    def put(self, key, payload):
+        blob = zlib.compress(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self._file.seek(self._end)
+            self._file.write(HEADER.pack(key, len(blob)) + blob)
+            self._file.flush()
+            self.index[key] = (self._end + HEADER.size, len(blob))
+            self._end += HEADER.size + len(blob)
+            if self._end > self.max_bytes:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the file with the newest entries filling at most 3/4 of max_bytes."""
+        budget = self.max_bytes * 3 // 4
+        kept = []
+        size = len(MAGIC)
+        for key, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0], reverse=True):
+            if size + HEADER.size + length > budget:
+                break
+            kept.append((key, offset, length))
+            size += HEADER.size + length
+        tmp_path = self.path + ".tmp"
+        index = {}
+        with open(tmp_path, "wb") as out:
+            out.write(MAGIC)
+            for key, offset, length in reversed(kept):
+                out.write(HEADER.pack(key, length))
+                index[key] = (out.tell(), length)
+                out.write(os.pread(self._file.fileno(), length, offset))
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "r+b")
+        self.index = index
+        self._end = size
+
+    def close(self):
+        self._file.close()
+
+class _CachedCompletions:
+    def __init__(self, completions, cache, mode):
+        self._completions = completions
+        self._cache = cache
+        self._mode = mode
+
+    def create(self, **request):
+        if self._mode == "passthrough":
+            return self._completions.create(**request)
+        key = request_key(request)
+        stream = request.get("stream", False)
+        payload = self._cache.get(key)
+        if payload is None:
+            if self._mode == "replay":
+                raise CacheMiss(f"No recorded response for request {key.hex()[:16]}")
+            response = self._completions.create(**request)
+            if stream:
+                # Record the chunks as they are consumed so streaming timing is preserved.
+                return self._record_stream(key, response)
+            self._cache.put(key, response.model_dump(mode="json"))
+            return response
+        if stream:
+            return (ChatCompletionChunk.model_validate(chunk) for chunk in payload)
+        return ChatCompletion.model_validate(payload)
+
+    def _record_stream(self, key, response):
+        chunks = []
+        try:
+            for chunk in response:
+                chunks.append(chunk.model_dump(mode="json"))
+                yield chunk
+        finally:
+            # Closing this generator early (an early-stopped turn) closes the HTTP stream
+            # too, and a truncated stream is never recorded.
+            response.close()
+        self._cache.put(key, chunks)
+
+class CachingClient:
+    """Wrap an OpenAI client so chat.completions.create goes through a ResponseCache.
+
+    Modes: "record" serves hits and records misses, "replay" raises CacheMiss
+    on a miss instead of calling the server, "passthrough" bypasses the cache.
+    Every other attribute is forwarded to the wrapped client.
+    """
+    def __init__(self, client, cache, mode="record"):
+        if mode not in MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}, expected one of {', '.join(MODES)}")
+        self._client = client
+        self.cache = cache
+        self.mode = mode
+        self.chat = types.SimpleNamespace(completions=_CachedCompletions(client.chat.completions, cache, mode))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,302 @@
+"""Normalizing model responses for comparison in tests.
+
+normalize_content drops <think>...</think> blocks (with the whitespace after
+them) and any other single-line <tag>, collapses whitespace runs to one
+space and strips the ends - the same result as the three re.sub passes the
+harness used to run. Think blocks are cut out with str.find instead of a
+lazy DOTALL regex crawling through the reasoning, the tag pattern is
+precompiled and skipped when there is no "<" left, and whitespace collapses
+with str.split; results are memoized on the content string.
+StreamingNormalizer produces the same text chunk by chunk while a response
+streams in, and ThinkParser tells reasoning tokens from answer tokens as
+they are generated.
+
+Run directly to benchmark both against the three-pass version on
+10k-token QwQ-style outputs.
+"""
+import functools
+import random
+import re
+import time
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+_TAG = re.compile(r"<[^\n]*?>")
+_SPACE = re.compile(r"\s*")
+
+@functools.lru_cache(maxsize=1024)
+def normalize_content(content):
+    parts = []
+    position = 0
+    while True:
+        start = content.find(THINK_OPEN, position)
+        if start < 0:
+            break
+        end = content.find(THINK_CLOSE, start + len(THINK_OPEN))
+        if end < 0:
+            break
+        parts.append(content[position:start])
+        position = _SPACE.match(content, end + len(THINK_CLOSE)).end()
+    parts.append(content[position:])
+    content = "".join(parts)
+    if "<" in content:
+        content = _TAG.sub("", content)
+    return " ".join(content.split())
+
+class StreamingNormalizer:
+    """Incremental normalize_content: feed() returns the text that is final so far, finish() the rest.
+
+    Think blocks are dropped as they stream, searching only the boundary of
+    each chunk for the closing tag; their text is kept aside in case the
+    block never closes, in which case it counts as answer text as it does in
+    normalize_content. A partial tag is held back until its line ends or it
+    closes, and whitespace runs that span chunks still collapse to one space.
+    """
+    def __init__(self):
+        self._pending = ""
+        # Length of the start of _pending that was held back from before a think block.
+        self._pending_before_think = 0
+        self._think = None
+        self._think_tail = ""
+        self._skip_space = False
+        self._space = False
+        self._emitted = False
+
+    def feed(self, chunk):
+        output = []
+        text = chunk
+        while text:
+            if self._think is not None:
+                tail = self._think_tail + text
+                close = tail.find(THINK_CLOSE)
+                if close < 0:
+                    self._think.append(text)
+                    self._think_tail = tail[-(len(THINK_CLOSE) - 1):]
+                    break
+                text = tail[close + len(THINK_CLOSE):]
+                self._think = None
+                self._skip_space = True
+                continue
+            if self._skip_space:
+                text = text.lstrip()
+                if not text:
+                    break
+                self._skip_space = False
+            buffer = self._pending + text
+            # Text joined across a removed think block can spell "<think>", but the
+            # one-pass removal never rescans it, so only look past the older text.
+            before_think = self._pending_before_think
+            start = buffer.find(THINK_OPEN, before_think)
+            self._pending = ""
+            if start < 0:
+                output.append(self._text(buffer))
+                self._pending_before_think = max(0, before_think - (len(buffer) - len(self._pending)))
+                break
+            output.append(self._text(buffer[:start]))
+            self._pending_before_think = len(self._pending)
+            self._think = [THINK_OPEN]
+            self._think_tail = ""
+            text = buffer[start + len(THINK_OPEN):]
+        return "".join(output)
+
+    def _text(self, text):
+        boundary = max(text.rfind(">"), text.rfind("\n"))
+        partial = text.find("<", boundary + 1)
+        if partial >= 0:
+            self._pending = text[partial:]
+            text = text[:partial]
+        if "<" in text:
+            text = _TAG.sub("", text)
+        return self._collapse(text)
+
+    def _collapse(self, text):
+        words = text.split()
+        if not words:
+            self._space = self._space or bool(text)
+            return ""
+        lead = self._emitted and (self._space or text[0].isspace())
+        self._space = text[-1].isspace()
+        self._emitted = True
+        return (" " if lead else "") + " ".join(words)
+
+    def finish(self):
+        """Flush what is held back; an unclosed think block is treated as answer text."""
+        text = self._pending + ("".join(self._think) if self._think is not None else "")
+        self._pending, self._pending_before_think, self._think = "", 0, None
+        if "<" in text:
+            text = _TAG.sub("", text)
+        return self._collapse(text)
+
+TOOL_CALL_CLOSE = "</tool_call>"
+# Enough trailing text to catch any tag split across two pieces.
+_TAIL = max(len(THINK_OPEN), len(THINK_CLOSE), len(TOOL_CALL_CLOSE)) - 1
+
+class ThinkParser:
+    """Separates reasoning from answer tokens while a response is generated.
+
+    feed() takes each piece of generated text with the number of tokens it
+    carries: one per mlx token, and one per streamed chunk, since servers
+    send about a token per chunk. A piece that touches the think block
+    counts as reasoning. Chat templates that open the block in the prompt
+    (QwQ's ends with "<think>\\n") are handled with starts_in_think, or
+    noticed when "</think>" arrives with no opening tag, at which point
+    everything so far is reclassified as reasoning.
+
+    answer_tool_calls counts closed <tool_call> blocks in the answer, so a
+    generation loop can stop once a tool call has been emitted.
+    """
+    def __init__(self, starts_in_think=False):
+        self.in_think = starts_in_think
+        self.saw_think = starts_in_think
+        self.reasoning_tokens = 0
+        self.answer_tokens = 0
+        self.answer_tool_calls = 0
+        self.first_token = None
+        self.last_token = None
+        self.think_started = None
+        self.think_ended = None
+        self._tail = ""
+
+    def feed(self, text, tokens=1):
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        self.last_token = now
+        scan = self._tail + text
+        fresh = len(self._tail)
+        touched = self.in_think
+        if self.in_think and self.think_started is None:
+            self.think_started = now
+        answer_start = None if self.in_think else 0
+        answer_segments = []
+        position = 0
+        while True:
+            close = scan.find(THINK_CLOSE, position)
+            if self.in_think:
+                if close < 0:
+                    break
+                position = close + len(THINK_CLOSE)
+                if position > fresh:
+                    self.in_think = False
+                    self.think_ended = now
+                    touched = True
+                answer_start = position
+                continue
+            opening = scan.find(THINK_OPEN, position)
+            if not self.saw_think and close >= 0 and (opening < 0 or close < opening):
+                position = close + len(THINK_CLOSE)
+                if position > fresh:
+                    # The prompt opened the think block, so everything so far was reasoning.
+                    self.saw_think = True
+                    self.reasoning_tokens += self.answer_tokens
+                    self.answer_tokens = 0
+                    self.answer_tool_calls = 0
+                    self.think_started = self.first_token
+                    self.think_ended = now
+                    touched = True
+                    answer_segments = []
+                answer_start = position
+                continue
+            if opening < 0:
+                break
+            position = opening + len(THINK_OPEN)
+            if position > fresh:
+                answer_segments.append((answer_start, opening))
+                self.in_think = self.saw_think = True
+                if self.think_started is None:
+                    self.think_started = now
+                touched = True
+        if not self.in_think and answer_start is not None:
+            answer_segments.append((answer_start, len(scan)))
+        for segment_start, segment_end in answer_segments:
+            index = scan.find(TOOL_CALL_CLOSE, segment_start, segment_end)
+            while index >= 0:
+                if index + len(TOOL_CALL_CLOSE) > fresh:
+                    self.answer_tool_calls += 1
+                index = scan.find(TOOL_CALL_CLOSE, index + 1, segment_end)
+        if touched:
+            self.reasoning_tokens += tokens
+        else:
+            self.answer_tokens += tokens
+        self._tail = scan[-_TAIL:]
+
+    def feed_reasoning(self, text, tokens=1):
+        """Count a piece the server already separated out as reasoning (a reasoning_content delta)."""
+        now = time.perf_counter()
+        if self.first_token is None:
+            self.first_token = now
+        if self.think_started is None:
+            self.think_started = now
+        self.last_token = self.think_ended = now
+        self.saw_think = True
+        self.reasoning_tokens += tokens
+
+    def stats(self):
+        """Reasoning and answer token counts and times; an unclosed think block lasts until the last token."""
+        if self.first_token is None:
+            return {"reasoning_tokens": 0, "answer_tokens": 0, "reasoning_time": None, "answer_time": None}
+        reasoning_time = None
+        if self.think_started is not None:
+            reasoning_time = (self.think_ended or self.last_token) - self.think_started
+        answer_time = None
+        if not self.in_think and self.answer_tokens:
+            answer_time = self.last_token - (self.think_ended or self.first_token)
+        return {"reasoning_tokens": self.reasoning_tokens, "answer_tokens": self.answer_tokens,
+                "reasoning_time": reasoning_time, "answer_time": answer_time}
+
+def _three_pass(content):
+    content = re.sub(r"<think>.*?</think>\s*", "", content, flags=re.DOTALL)
+    content = re.sub(r"<.*?>", "", content)
+    return re.sub(r"\s+", " ", content).strip()
+
+def _qwq_output(tokens, closed=True, seed=0):
+    """Roughly `tokens` tokens of QwQ-style reasoning followed by a markdown answer."""
+    rng = random.Random(seed)
+    words = ("so", "the", "user", "wants", "to", "list", "files", "maybe", "I", "should", "call", "LSTool",
+             "wait,", "but", "path", "is", "relative", "let", "me", "check", "again.", "hmm,", "okay")
+    sentences = []
+    while sum(len(sentence) for sentence in sentences) < tokens * 4:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 20)))
+        sentences.append(sentence + rng.choice([". ", ".\n", ".\n\n", "? "]))
+    reasoning = "".join(sentences)
+    answer = ("\n\nHere is the listing:\n\n1. **README.md** - <b>docs</b>\n2. **src/**  - code\n"
+              "   <br>\n3. **package.json**\n\nLet me know if you need more.   \n")
+    if closed:
+        return f"<think>\n{reasoning}</think>\n\n{answer}"
+    return f"<think>\n{reasoning}"
+
+def benchmark(tokens=10000, repeats=20, chunk_chars=16):
+    outputs = [_qwq_output(tokens, closed=True, seed=seed) for seed in range(repeats)]
+    outputs += [_qwq_output(tokens, closed=False, seed=seed) for seed in range(repeats)]
+
+    def streamed(content):
+        normalizer = StreamingNormalizer()
+        parts = [normalizer.feed(content[start:start + chunk_chars]) for start in range(0, len(content), chunk_chars)]
+        return "".join(parts) + normalizer.finish()
+
+    for content in outputs:
+        expected = _three_pass(content)
+        assert normalize_content.__wrapped__(content) == expected
+        assert streamed(content) == expected
+    normalize_content.cache_clear()
+
+    def timed(function):
+        start = time.perf_counter()
+        for content in outputs:
+            function(content)
+        return (time.perf_counter() - start) / len(outputs) * 1000
+
+    rows = [
+        ("three re.sub passes", timed(_three_pass)),
+        ("normalize_content, uncached", timed(normalize_content.__wrapped__)),
+        ("normalize_content, cache miss", timed(normalize_content)),
+        ("normalize_content, cache hit", timed(normalize_content)),
+        (f"streaming, {chunk_chars}-char chunks", timed(streamed)),
+    ]
+    print(f"{len(outputs)} outputs of ~{tokens} tokens ({sum(map(len, outputs)) // len(outputs)} chars), "
+          f"half with an unclosed think block")
+    for name, ms in rows:
+        print(f"{name:<32} {ms:8.3f} ms/output")
+
+if __name__ == "__main__":
+    benchmark()
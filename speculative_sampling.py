@@ -0,0 +1,153 @@
+"""Speculative parallel sampling: K samples per turn, first valid tool call wins.
+
+QwQ at temperature 0.6 sometimes picks the wrong tool or emits arguments
+that do not match the tool's schema. SpeculativeBackend wraps a backend and
+sends each request K times at once. The first response whose tool calls
+all validate against their JSON schemas in the request's `tools` is
+returned, and the other samples are cancelled (see
+inference_backends.Cancellation). This spends spare server batch capacity
+on lower tail latency for turns that need a valid tool call.
+
+A response without tool calls can be a legitimate answer, but it might
+also be a sample that missed the tool. It is therefore only returned once
+every sample has finished without a valid tool call, as is a response
+whose tool calls are all invalid. Turns that end in plain text wait for
+the slowest sample.
+"""
+import concurrent.futures
+import json
+import time
+
+from inference_backends import Cancellation, Cancelled
+
+_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "number": (int, float),
+    "integer": int,
+    "boolean": bool,
+    "null": type(None),
+}
+
+def schema_errors(value, schema, path="arguments"):
+    """Errors of `value` against the JSON Schema subset tool definitions use.
+
+    Checks type, enum, required, properties, additionalProperties and
+    items; anything else in the schema is ignored.
+    """
+    expected = schema.get("type")
+    if expected is not None:
+        types = tuple(_TYPES[name] for name in ([expected] if isinstance(expected, str) else expected) if name in _TYPES)
+        # bool is an int subclass, but JSON true is not a number.
+        if types and (not isinstance(value, types) or (isinstance(value, bool) and bool not in types)):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    if "enum" in schema and value not in schema["enum"]:
+        return [f"{path}: {value!r} is not one of {schema['enum']}"]
+    errors = []
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        errors.extend(f"{path}: missing {name!r}" for name in schema.get("required", []) if name not in value)
+        for name, item in value.items():
+            if name in properties:
+                errors.extend(schema_errors(item, properties[name], f"{path}.{name}"))
+            elif schema.get("additionalProperties") is False:
+                errors.append(f"{path}: unexpected {name!r}")
+    elif isinstance(value, list) and isinstance(schema.get("items"), dict):
+        for index, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+def tool_schemas(tools_payload):
+    """{tool name: parameters schema} from an API-format tools list."""
+    return {tool["function"]["name"]: tool["function"].get("parameters") or {} for tool in tools_payload or []}
+
+def tool_call_errors(tool_call, schemas):
+    name = tool_call["function"]["name"]
+    if name not in schemas:
+        return [f"unknown tool {name!r}"]
+    try:
+        arguments = json.loads(tool_call["function"]["arguments"] or "{}")
+    except json.JSONDecodeError as e:
+        return [f"{name}: arguments are not JSON ({e})"]
+    return [f"{name} {error}" for error in schema_errors(arguments, schemas[name])]
+
+class SpeculativeBackend:
+    """Runs `samples` copies of each request on `backend` and keeps the first valid tool call.
+
+    The wrapped backend must accept cancel= (the HTTP and fake backends
+    do). Tool calls reach on_tool_call only once a winner is chosen, so
+    tools never start early for a sample that may be discarded. Stats are
+    the chosen sample's, with the latency of the whole turn and:
+
+    - samples: K
+    - sample: index of the returned sample, in the order they were sent
+    - valid_samples, invalid_samples: finished samples with tool calls
+      that did or did not all validate
+    - plain_samples: finished samples without tool calls
+    - failed_samples: samples whose request raised
+    - cancelled_samples: samples abandoned once a winner was found
+    - tool_calls_valid: whether the returned tool calls validate (None
+      without tool calls)
+
+    With samples=1 the request goes straight to the backend, and only the
+    validation stats are added, so runs at different K compare fairly.
+    """
+    def __init__(self, backend, samples):
+        if samples < 1:
+            raise ValueError("samples must be at least 1")
+        self.backend = backend
+        self.samples = samples
+        self.name = backend.name
+
+    def complete(self, request, stream=False, on_tool_call=None):
+        schemas = tool_schemas(request.get("tools"))
+        if self.samples == 1:
+            content, tool_calls, stats = self.backend.complete(request, stream, on_tool_call)
+            valid = not any(tool_call_errors(tool_call, schemas) for tool_call in tool_calls)
+            stats.update(samples=1, sample=0, valid_samples=int(bool(tool_calls) and valid),
+                         invalid_samples=int(not valid), plain_samples=int(not tool_calls), failed_samples=0,
+                         cancelled_samples=0, tool_calls_valid=valid if tool_calls else None)
+            return content, tool_calls, stats
+
+        start = time.perf_counter()
+        cancellation = Cancellation()
+        # Not a context manager: leaving must not wait for the samples being cancelled.
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.samples, thread_name_prefix="sample")
+        futures = {pool.submit(self.backend.complete, request, stream, None, cancellation): index
+                   for index in range(self.samples)}
+        pool.shutdown(wait=False)
+        counts = {"valid_samples": 0, "invalid_samples": 0, "plain_samples": 0, "failed_samples": 0}
+        winner = plain = invalid = error = None
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                content, tool_calls, stats = future.result()
+            except Cancelled:
+                continue
+            except Exception as e:
+                counts["failed_samples"] += 1
+                error = error or e
+                continue
+            result = (futures[future], content, tool_calls, stats)
+            if not tool_calls:
+                counts["plain_samples"] += 1
+                plain = plain or result
+            elif any(tool_call_errors(tool_call, schemas) for tool_call in tool_calls):
+                counts["invalid_samples"] += 1
+                invalid = invalid or result
+            else:
+                counts["valid_samples"] += 1
+                winner = result
+                break
+        cancellation.cancel()
+        winner = winner or plain or invalid
+        if winner is None:
+            raise error
+        index, content, tool_calls, stats = winner
+        if on_tool_call:
+            for tool_call in tool_calls:
+                on_tool_call(tool_call)
+        stats.update(counts, latency=time.perf_counter() - start, samples=self.samples, sample=index,
+                     cancelled_samples=self.samples - sum(counts.values()),
+                     tool_calls_valid=winner is not invalid if tool_calls else None)
+        return content, tool_calls, stats
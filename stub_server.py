@@ -0,0 +1,287 @@
+"""Stand-in OpenAI-compatible chat-completions server for running the harness offline.
+
+Answers POST /v1/chat/completions (blocking and streamed, with tool calls)
+from a FakeBackend script, so the harness, its concurrency and its retry
+handling can be exercised and benchmarked without a model:
+
+    python stub_server.py --profile qwq-mac
+    python qwq-tool-calling-test.py --concurrency 8
+
+Latency follows a profile (time to first token plus tokens/sec, with
+optional jitter), errors and tool calls missing their arguments can be
+injected at fixed rates, and prompt caching is simulated so cached_tokens
+is reported the way a real server would. GET /stats returns request
+counters. The server is plain asyncio HTTP/1.1 with keep-alive and uses
+uvloop when it is installed.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import OrderedDict
+
+from inference_backends import FakeBackend
+
+# (time to first token in seconds, generated tokens per second); 0 tokens/sec means instant.
+PROFILES = {
+    "instant": (0.0, 0.0),
+    "gpu-server": (0.3, 60.0),
+    "qwq-mac": (2.0, 12.0),
+}
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+               500: "Internal Server Error", 503: "Service Unavailable"}
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+class PrefixCache:
+    """Remembers hashes of message prefixes to simulate server-side prefix caching."""
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def lookup_and_store(self, messages):
+        """Return (prompt_tokens, cached_tokens) for the request and remember its prefixes."""
+        digest = hashlib.sha256()
+        tokens = 0
+        cached = 0
+        for message in messages:
+            encoded = json.dumps(message, sort_keys=True, separators=(",", ":"))
+            digest.update(encoded.encode("utf-8"))
+            tokens += _estimate_tokens(encoded)
+            key = digest.digest()
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                cached = tokens
+            else:
+                self._entries[key] = True
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return tokens, cached
+
+class StubServer:
+    def __init__(self, backend, ttft=0.0, tokens_per_sec=0.0, jitter=0.0, error_rate=0.0, error_status=503,
+                 chunk_chars=16, trailing_tokens=0, invalid_tool_rate=0.0):
+        self.backend = backend
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.chunk_chars = chunk_chars
+        self.trailing_tokens = trailing_tokens
+        self.invalid_tool_rate = invalid_tool_rate
+        self.prefix_cache = PrefixCache()
+        self.stats = {"requests": 0, "streamed": 0, "errors_injected": 0, "bad_requests": 0, "in_flight": 0,
+                      "cancelled": 0, "invalid_tool_calls": 0}
+        self._ids = 0
+
+    def _delay(self, seconds):
+        if self.jitter and seconds:
+            seconds *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return seconds
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request_line, _, header_block = head.decode("latin-1").partition("\r\n")
+                method, path, version = (request_line.split(" ") + ["", "", ""])[:3]
+                headers = {}
+                for line in header_block.split("\r\n"):
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0) or 0))
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                await self.dispatch(method, path.split("?")[0], body, reader, writer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, body, reader, writer, keep_alive):
+        if method == "GET" and path.endswith("/models"):
+            return await self.send_json(writer, 200, {"object": "list", "data": [{"id": "stub", "object": "model"}]}, keep_alive)
+        if method == "GET" and path == "/stats":
+            return await self.send_json(writer, 200, self.stats, keep_alive)
+        if method != "POST" or not path.endswith("/chat/completions"):
+            return await self.send_json(writer, 404, {"error": {"message": f"No route for {method} {path}"}}, keep_alive)
+        try:
+            request = json.loads(body)
+            messages = request["messages"]
+        except (ValueError, KeyError) as e:
+            self.stats["bad_requests"] += 1
+            return await self.send_json(writer, 400, {"error": {"message": f"Invalid request: {e}"}}, keep_alive)
+        self.stats["requests"] += 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors_injected"] += 1
+            return await self.send_json(writer, self.error_status, {"error": {"message": "Injected error"}}, keep_alive)
+        self.stats["in_flight"] += 1
+        try:
+            if request.get("stream"):
+                self.stats["streamed"] += 1
+                await self.stream_completion(request, reader, writer, keep_alive)
+            else:
+                await self.send_json(writer, 200, await self.completion(request), keep_alive)
+        finally:
+            self.stats["in_flight"] -= 1
+
+    def _respond(self, request):
+        self._ids += 1
+        content, tool_calls = self.backend.respond(request["messages"])
+        if tool_calls and self.invalid_tool_rate and random.random() < self.invalid_tool_rate:
+            # A sampled call that drops its arguments, failing the tool's required fields.
+            self.stats["invalid_tool_calls"] += 1
+            tool_calls = [dict(call, function=dict(call["function"], arguments="{}")) for call in tool_calls]
+        prompt_tokens, cached_tokens = self.prefix_cache.lookup_and_store(request["messages"])
+        generated = (content or "") + "".join(call["function"]["arguments"] for call in tool_calls)
+        completion_tokens = _estimate_tokens(generated) + (self.trailing_tokens if tool_calls else 0)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        return f"chatcmpl-stub-{self._ids}", content, tool_calls, usage
+
+    async def completion(self, request):
+        completion_id, content, tool_calls, usage = self._respond(request)
+        delay = self._delay(self.ttft)
+        if self.tokens_per_sec:
+            delay += self._delay(usage["completion_tokens"] / self.tokens_per_sec)
+        if delay:
+            await asyncio.sleep(delay)
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": usage,
+        }
+
+    async def stream_completion(self, request, reader, writer, keep_alive):
+        completion_id, content, tool_calls, usage = self._respond(request)
+        writer.write(self._head(200, "text/event-stream", keep_alive, chunked=True))
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "stub")}
+        chunk_delay = self.chunk_chars / 4 / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+        async def send(delta=None, finish_reason=None, extra=None, delay=0.0):
+            if delay:
+                await asyncio.sleep(self._delay(delay))
+            if reader.at_eof() or writer.transport.is_closing():
+                # The client hung up (an early-stopped turn): stop generating for it.
+                self.stats["cancelled"] += 1
+                raise ConnectionResetError("Client closed the stream")
+            payload = dict(base, choices=[{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}])
+            payload.update(extra or {})
+            self._write_chunk(writer, b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+            await writer.drain()
+
+        first_delay = self.ttft
+        if content:
+            for start in range(0, len(content), self.chunk_chars):
+                delta = {"content": content[start:start + self.chunk_chars]}
+                if start == 0:
+                    delta["role"] = "assistant"
+                await send(delta, delay=first_delay or chunk_delay)
+                first_delay = 0.0
+        for index, call in enumerate(tool_calls):
+            header = {"index": index, "id": call["id"], "type": "function",
+                      "function": {"name": call["function"]["name"], "arguments": ""}}
+            await send({"tool_calls": [header]}, delay=first_delay)
+            first_delay = 0.0
+            arguments = call["function"]["arguments"]
+            for start in range(0, len(arguments), self.chunk_chars):
+                piece = {"index": index, "function": {"arguments": arguments[start:start + self.chunk_chars]}}
+                await send({"tool_calls": [piece]}, delay=chunk_delay)
+        # Models often keep generating after a complete tool call; simulate that tail.
+        for _ in range(self.trailing_tokens if tool_calls else 0):
+            await send({"content": " "}, delay=1 / self.tokens_per_sec if self.tokens_per_sec else 0.0)
+        await send(finish_reason="tool_calls" if tool_calls else "stop", delay=first_delay)
+        if (request.get("stream_options") or {}).get("include_usage"):
+            payload = dict(base, choices=[], usage=usage)
+            self._write_chunk(writer, b"data: " + json.dumps(payload).encode("utf-8") + b"\n\n")
+        self._write_chunk(writer, b"data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_chunk(writer, data):
+        writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    @staticmethod
+    def _head(status, content_type, keep_alive, length=None, chunked=False):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, 'Unknown')}", f"Content-Type: {content_type}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        if chunked:
+            lines.append("Transfer-Encoding: chunked")
+        else:
+            lines.append(f"Content-Length: {length}")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def send_json(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(self._head(status, "application/json", keep_alive, length=len(body)) + body)
+        await writer.drain()
+
+async def serve(server, host, port):
+    listener = await asyncio.start_server(server.handle_connection, host, port, backlog=4096)
+    print(f"Stub server listening on http://{host}:{port}/v1")
+    async with listener:
+        await listener.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI-compatible server for the tool-calling harness")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--script", help="JSON list of FakeBackend rules (default: inference_backends.DEFAULT_FAKE_SCRIPT)")
+    parser.add_argument("--profile", choices=PROFILES, default="instant")
+    parser.add_argument("--ttft-ms", type=float, help="Override the profile's time to first token")
+    parser.add_argument("--tokens-per-sec", type=float, help="Override the profile's generation rate")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Randomize each delay by +/- this fraction")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--invalid-tool-rate", type=float, default=0.0,
+                        help="Fraction of tool-calling responses whose calls have empty arguments")
+    parser.add_argument("--trailing-tokens", type=int, default=0,
+                        help="Tokens generated after each tool call, for exercising early stop")
+    args = parser.parse_args()
+
+    ttft, tokens_per_sec = PROFILES[args.profile]
+    if args.ttft_ms is not None:
+        ttft = args.ttft_ms / 1000
+    if args.tokens_per_sec is not None:
+        tokens_per_sec = args.tokens_per_sec
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    server = StubServer(FakeBackend(script), ttft=ttft, tokens_per_sec=tokens_per_sec, jitter=args.jitter,
+                        error_rate=args.error_rate, error_status=args.error_status,
+                        trailing_tokens=args.trailing_tokens, invalid_tool_rate=args.invalid_tool_rate)
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        print(f"\n{server.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Token budget of the static prompt: system prompt paragraphs and tool schemas.
+
+Every request prefills the system prompt and the tools array, so their size
+sets a floor on TTFT. This tokenizes each section separately and reports its
+token count, its share of the static prefill, and the prefill time trimming
+it would save at a given prefill rate. Prefill time is modelled as linear in
+tokens, which understates the saving for long prompts.
+
+Run directly to analyze the prompts.py payload; the harness analyzes its own
+system prompt and tools with --token-budget.
+"""
+import argparse
+import json
+import sys
+
+class HeuristicTokenizer:
+    """Roughly four characters per token, for when no real tokenizer is available."""
+    name = "heuristic (4 chars/token)"
+
+    def count(self, text):
+        return (len(text) + 3) // 4
+
+class HFTokenizer:
+    def __init__(self, name):
+        from transformers import AutoTokenizer
+
+        self.name = name
+        self._tokenizer = AutoTokenizer.from_pretrained(name)
+
+    def count(self, text):
+        return len(self._tokenizer.encode(text, add_special_tokens=False))
+
+def load_tokenizer(name):
+    if not name:
+        return HeuristicTokenizer()
+    try:
+        return HFTokenizer(name)
+    except (ImportError, OSError) as e:
+        print(f"Could not load tokenizer {name!r} ({e}); falling back to a heuristic", file=sys.stderr)
+        return HeuristicTokenizer()
+
+def _label(text, width=48):
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    return first_line if len(first_line) <= width else first_line[:width - 3] + "..."
+
+def prompt_sections(messages, tools):
+    """Split the static prompt into (section, text) pairs.
+
+    System messages are split into blank-line separated paragraphs; each
+    tool contributes its description and its parameter schema separately.
+    Tools may be API-format ({"function": {...}}) or harness-format
+    ({"name": ..., "schema": {...}}).
+    """
+    sections = []
+    for message in messages:
+        if message["role"] != "system":
+            continue
+        paragraphs = [paragraph for paragraph in message["content"].split("\n\n") if paragraph.strip()]
+        for index, paragraph in enumerate(paragraphs, 1):
+            sections.append((f"system[{index}] {_label(paragraph)}", paragraph))
+    for tool in tools:
+        function = tool.get("function") or dict(tool.get("schema", {}), name=tool.get("name"))
+        sections.append((f"tool {function['name']}: description", function.get("description", "")))
+        sections.append((f"tool {function['name']}: parameters", json.dumps(function.get("parameters", {}))))
+    return sections
+
+def analyze(sections, tokenizer, prefill_tokens_per_sec):
+    counts = [(name, tokenizer.count(text)) for name, text in sections]
+    total = sum(tokens for _, tokens in counts) or 1
+    rows = [
+        {
+            "section": name,
+            "tokens": tokens,
+            "share": tokens / total,
+            "prefill_saving_ms": tokens / prefill_tokens_per_sec * 1000,
+        } for name, tokens in counts
+    ]
+    rows.sort(key=lambda row: row["tokens"], reverse=True)
+    return {"tokenizer": tokenizer.name, "total_tokens": total,
+            "prefill_tokens_per_sec": prefill_tokens_per_sec, "sections": rows}
+
+def print_report(report, top=None):
+    rows = report["sections"][:top] if top else report["sections"]
+    width = max(len(row["section"]) for row in rows)
+    print(f"Tokenizer: {report['tokenizer']}, static prompt: {report['total_tokens']} tokens, "
+          f"~{report['total_tokens'] / report['prefill_tokens_per_sec']:.2f}s prefill "
+          f"at {report['prefill_tokens_per_sec']:.0f} tok/s")
+    print(f"{'section':<{width}}  {'tokens':>7}  {'share':>6}  {'saving':>9}")
+    for row in rows:
+        print(f"{row['section']:<{width}}  {row['tokens']:>7}  {row['share']:>6.1%}  {row['prefill_saving_ms']:>7.0f}ms")
+
+def add_arguments(parser):
+    parser.add_argument("--tokenizer", help="Hugging Face tokenizer to count with (default: 4 chars/token heuristic)")
+    parser.add_argument("--prefill-tps", type=float, default=500.0,
+                        help="Prefill throughput in tokens/sec used to estimate savings")
+    parser.add_argument("--top", type=int, help="Only show the N largest sections")
+    parser.add_argument("--json", dest="json_path", help="Also write the report as JSON to this path")
+
+def run(messages, tools, args):
+    report = analyze(prompt_sections(messages, tools), load_tokenizer(args.tokenizer), args.prefill_tps)
+    print_report(report, args.top)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    return report
+
+if __name__ == "__main__":
+    from prompts import prompts
+
+    parser = argparse.ArgumentParser(description="Token budget of the prompts.py system prompt and tools")
+    add_arguments(parser)
+    run(prompts["messages"], prompts["tools"], parser.parse_args())
@@ -0,0 +1,237 @@
+"""Concurrent execution of the tool calls of an assistant turn.
+
+When the model asks for several tools in one message, ToolExecutor runs
+them at the same time and hands the results back in the order of the
+calls. Blocking implementations run on a thread pool, coroutine functions
+on an event loop in a daemon thread.
+
+Running tools concurrently must not change what they do, so only tools
+marked with @side_effect_free may overlap. A call to any other tool waits
+for the calls before it and holds back the calls after it, so writes and
+commands see the same state they would in sequence.
+
+A tool with side effects can also take a run of consecutive calls at once
+through a `call_batch(arguments_list)` method returning one result per
+call, as if they had run one after another; FileEditTool uses it to apply
+many edits to a file with one read and one write. The batch's timeout is
+the sum of its calls'.
+
+Each call has a timeout, per tool or a default. A timed-out call's result
+is an error message for the model, as is that of a call whose arguments
+are not a JSON object or lack a required argument. Coroutines are cancelled; a blocking
+tool cannot be interrupted, so its thread finishes in the background and
+its result is dropped.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import contextvars
+import json
+import threading
+import time
+
+def _missing_argument(name, error):
+    return f"Error: {name} is missing the required argument {error}"
+
+def _parse_arguments(arguments):
+    """A call's arguments object; ValueError if the model sent invalid JSON or something other than an object."""
+    tool_args = json.loads(arguments)
+    if not isinstance(tool_args, dict):
+        raise ValueError(f"expected a JSON object, got {type(tool_args).__name__}")
+    return tool_args
+
+def _invalid_arguments(error):
+    return f"Error: invalid JSON arguments: {error}"
+
+def side_effect_free(function):
+    """Mark a tool implementation as safe to run alongside the other calls of a turn."""
+    function.side_effect_free = True
+    return function
+
+class ToolExecutor:
+    def __init__(self, implementations, max_workers=8, timeout=None, timeouts=None):
+        self.implementations = implementations
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.timed_out = 0
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def is_side_effect_free(self, name):
+        return getattr(self.implementations.get(name), "side_effect_free", False)
+
+    def timeout_for(self, name):
+        return self.timeouts.get(name, self.timeout)
+
+    def call(self, name, arguments):
+        """Run one tool call in the calling thread and return its result text."""
+        if name not in self.implementations:
+            return f"Error: Tool '{name}' not implemented."
+        try:
+            tool_args = _parse_arguments(arguments)
+        except ValueError as e:
+            return _invalid_arguments(e)
+        implementation = self.implementations[name]
+        try:
+            if asyncio.iscoroutinefunction(implementation):
+                return asyncio.run_coroutine_threadsafe(implementation(tool_args), self._event_loop()).result()
+            return implementation(tool_args)
+        except KeyError as e:
+            return _missing_argument(name, e)
+
+    def _event_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="tool-loop", daemon=True).start()
+            return self._loop
+
+    def start(self, tool_call):
+        """Start a call; returns (future, deadline)."""
+        name = tool_call["function"]["name"]
+        arguments = tool_call["function"]["arguments"]
+        timeout = self.timeout_for(name)
+        deadline = time.perf_counter() + timeout if timeout is not None else None
+        implementation = self.implementations.get(name)
+        if asyncio.iscoroutinefunction(implementation):
+            # On the loop, so that a timeout can cancel the coroutine itself.
+            async def run():
+                try:
+                    tool_args = _parse_arguments(arguments)
+                except ValueError as e:
+                    return _invalid_arguments(e)
+                try:
+                    return await implementation(tool_args)
+                except KeyError as e:
+                    return _missing_argument(name, e)
+            return asyncio.run_coroutine_threadsafe(run(), self._event_loop()), deadline
+        # In the caller's context, so tools can tell whose call it is (bash_tool.conversation).
+        return self._pool.submit(contextvars.copy_context().run, self.call, name, arguments), deadline
+
+    def can_batch(self, name):
+        return callable(getattr(self.implementations.get(name), "call_batch", None))
+
+    def call_batch(self, name, arguments_list):
+        """Run consecutive calls to one tool through its call_batch, in the calling thread."""
+        try:
+            parsed = [_parse_arguments(arguments) for arguments in arguments_list]
+        except ValueError:
+            # Some call's arguments are not valid: run them one by one, so only that one reports it.
+            return [self.call(name, arguments) for arguments in arguments_list]
+        try:
+            return self.implementations[name].call_batch(parsed)
+        except KeyError:
+            # Some call lacks an argument: the same.
+            return [self.call(name, arguments) for arguments in arguments_list]
+
+    def run_batch(self, tool_calls):
+        """Run consecutive calls to one batching tool and return their results in order."""
+        name = tool_calls[0]["function"]["name"]
+        timeout = self.timeout_for(name)
+        deadline = time.perf_counter() + timeout * len(tool_calls) if timeout is not None else None
+        arguments_list = [tool_call["function"]["arguments"] for tool_call in tool_calls]
+        future = self._pool.submit(contextvars.copy_context().run, self.call_batch, name, arguments_list)
+        remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        try:
+            return future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            self.timed_out += len(tool_calls)
+            return [f"Error: {name} timed out after {timeout * len(tool_calls):g}s"] * len(tool_calls)
+
+    def result(self, tool_call, future, deadline):
+        """Wait for a started call, turning a timeout into an error message."""
+        remaining = None if deadline is None else max(0.0, deadline - time.perf_counter())
+        try:
+            return future.result(timeout=remaining)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            self.timed_out += 1
+            name = tool_call["function"]["name"]
+            return f"Error: {name} timed out after {self.timeout_for(name):g}s"
+
+    def batch(self):
+        return ToolBatch(self)
+
+    def run(self, tool_calls):
+        """Run a turn's tool calls and return their results in order."""
+        return self.batch().results(tool_calls)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+class ToolBatch:
+    """The tool calls of one turn, started as they arrive and collected in order.
+
+    submit() can be given calls while the completion is still streaming; a
+    side-effect-free call starts at once unless a call with side effects
+    came before it. results() starts whatever is left, in order, and
+    returns every call's result text. submit() is thread-safe. A call
+    started early is matched back to its place by id, so calls without an
+    id, or whose id is not unique, are only started by results().
+    """
+    def __init__(self, executor):
+        self.executor = executor
+        self._started = {}
+        self._held = False
+        self._lock = threading.Lock()
+
+    def submit(self, tool_call):
+        call_id = tool_call.get("id")
+        with self._lock:
+            if self._held or call_id is None:
+                return
+            if call_id in self._started:
+                # Which of the two calls this result belongs to cannot be told: results() runs them again.
+                self._started[call_id] = None
+                return
+            if not self.executor.is_side_effect_free(tool_call["function"]["name"]):
+                self._held = True
+                return
+            self._started[call_id] = self.executor.start(tool_call)
+
+    def results(self, tool_calls):
+        executor = self.executor
+        with self._lock:
+            self._held = True
+            early = dict(self._started)
+        ids = collections.Counter(tool_call.get("id") for tool_call in tool_calls)
+        # Keyed by position: an early start only counts for the one call carrying its id.
+        started = {index: early[tool_call["id"]] for index, tool_call in enumerate(tool_calls)
+                   if ids[tool_call.get("id")] == 1 and early.get(tool_call.get("id")) is not None}
+        results = [None] * len(tool_calls)
+        pending = []
+
+        def collect():
+            for index, tool_call in pending:
+                results[index] = executor.result(tool_call, *started[index])
+            pending.clear()
+
+        index = 0
+        while index < len(tool_calls):
+            tool_call = tool_calls[index]
+            name = tool_call["function"]["name"]
+            if index not in started:
+                if not executor.is_side_effect_free(name):
+                    # Everything before a call with side effects finishes first, and it runs alone.
+                    collect()
+                    end = index + 1
+                    if executor.can_batch(name):
+                        while end < len(tool_calls) and tool_calls[end]["function"]["name"] == name:
+                            end += 1
+                    if end - index > 1:
+                        results[index:end] = executor.run_batch(tool_calls[index:end])
+                        index = end
+                        continue
+                    started[index] = executor.start(tool_call)
+                    pending.append((index, tool_call))
+                    collect()
+                    index += 1
+                    continue
+                started[index] = executor.start(tool_call)
+            pending.append((index, tool_call))
+            index += 1
+        collect()
+        return results
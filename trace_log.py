@@ -0,0 +1,99 @@
+"""Structured trace sink for harness runs.
+
+Writes one compact JSON line per record: a "run" header, a "request" per
+model call, a "conversation" per finished conversation and an "outcome" per
+test result. Callers only enqueue the raw values they already hold; JSON
+encoding, argument hashing and compression happen on a background writer
+thread, so tracing costs the conversation threads next to nothing. Paths
+ending in .gz are gzip-compressed, and since files are opened for append
+(gzip members concatenate) many runs can share one file.
+
+Message contents are only captured for a sampled fraction of
+conversations, chosen when the conversation starts.
+"""
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+_STOP = object()
+BULKY_FIELDS = ("content", "messages")
+
+def argument_hash(arguments):
+    """Short stable hash of a tool call's raw JSON arguments."""
+    return hashlib.blake2b(arguments.encode("utf-8"), digest_size=8).hexdigest()
+
+def _render(record):
+    """Turn raw fields into their trace form; runs on the writer thread."""
+    tool_calls = record.pop("tool_calls", None)
+    if tool_calls is not None:
+        record["tools"] = [call["function"]["name"] for call in tool_calls]
+        record["argument_hashes"] = [argument_hash(call["function"]["arguments"] or "") for call in tool_calls]
+    # Bulky fields go last so readers can cut them off without parsing them.
+    for name in BULKY_FIELDS:
+        if name in record:
+            record[name] = record.pop(name)
+    return json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str)
+
+class TraceSink:
+    def __init__(self, path, content_sample_rate=0.0, flush_interval=1.0, seed=None, **run_fields):
+        self.path = path
+        self.content_sample_rate = content_sample_rate
+        self.flush_interval = flush_interval
+        self.run_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+        self.records = 0
+        self._ids = itertools.count(1)
+        self._random = random.Random(seed)
+        self._queue = queue.SimpleQueue()
+        if path.endswith(".gz"):
+            self._file = gzip.open(path, "at", encoding="utf-8", compresslevel=6)
+        else:
+            self._file = open(path, "a", encoding="utf-8")
+        self._writer = threading.Thread(target=self._write_loop, name="trace-writer", daemon=True)
+        self._writer.start()
+        self.emit("run", started=time.time(), **run_fields)
+
+    def next_id(self):
+        return f"{self.run_id}-{next(self._ids)}"
+
+    def sample_content(self):
+        """Decide whether a conversation about to start has its message contents captured."""
+        return self.content_sample_rate > 0 and self._random.random() < self.content_sample_rate
+
+    def emit(self, kind, **fields):
+        """Queue a record. Values are serialized later, so pass nothing that is still being mutated."""
+        fields["kind"] = kind
+        fields["run"] = self.run_id
+        fields["t"] = time.time()
+        self._queue.put(fields)
+
+    def _write_loop(self):
+        last_flush = time.monotonic()
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while len(batch) < 1024:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            stop = _STOP in batch
+            lines = [_render(record) for record in batch if record is not _STOP]
+            if lines:
+                self._file.write("\n".join(lines) + "\n")
+                self.records += len(lines)
+            if stop:
+                break
+            if time.monotonic() - last_flush > self.flush_interval:
+                self._file.flush()
+                last_flush = time.monotonic()
+        self._file.close()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._queue.put(_STOP)
+            self._writer.join()
@@ -0,0 +1,246 @@
+"""Aggregate queries over recorded harness traces.
+
+Loads trace_log files from any number of runs (plain or .gz JSON lines), or
+JSON files of raw message histories as run_conversation_with_tools returns
+them, into column-oriented tables, one for requests and one for
+conversations:
+
+    python trace_query.py latency --by tool
+    python trace_query.py turns --over 3
+    python trace_query.py tools traces.jsonl.gz old-runs/*.jsonl.gz
+
+Message contents are cut off each trace line before it is parsed, so only
+the compact fields are ever decoded.
+"""
+import argparse
+import glob
+import gzip
+import json
+import sys
+from collections import Counter
+
+from latency_stats import percentile
+from trace_log import BULKY_FIELDS
+
+REQUEST_COLUMNS = ("run", "conversation", "model", "turn", "tool", "latency", "ttft", "time_to_first_tool_call",
+                   "prompt_tokens", "completion_tokens", "cached_tokens", "error")
+CONVERSATION_COLUMNS = ("run", "conversation", "scenario", "model", "turns", "first_tool", "tools", "elapsed",
+                        "error", "status")
+_CUT_MARKERS = tuple(f',"{name}":' for name in BULKY_FIELDS)
+
+class Table:
+    """Named columns of equal length; rows exist only as indices."""
+    def __init__(self, names, rows=()):
+        self.columns = {name: [row.get(name) for row in rows] for name in names}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def select(self, predicate, name):
+        """Indices of the rows whose `name` value satisfies predicate."""
+        return [index for index, value in enumerate(self.columns[name]) if predicate(value)]
+
+    def take(self, indices):
+        table = Table(self.columns)
+        for name, column in self.columns.items():
+            table.columns[name] = [column[index] for index in indices]
+        return table
+
+    def group(self, key, value):
+        """{key value: [non-None values of `value`]}, groups in first-seen order."""
+        groups = {}
+        for group, item in zip(self.columns[key], self.columns[value]):
+            if item is not None:
+                groups.setdefault(group, []).append(item)
+            else:
+                groups.setdefault(group, [])
+        return groups
+
+def _parse_line(line):
+    # trace_log writes the bulky fields last and in BULKY_FIELDS order, so the first marker found is the cut.
+    for marker in _CUT_MARKERS:
+        cut = line.find(marker)
+        if cut >= 0:
+            try:
+                return json.loads(line[:cut] + "}")
+            except ValueError:
+                break
+    return json.loads(line)
+
+def history_rows(messages, conversation, model=None, scenario=None):
+    """Conversation and request rows derived from a raw message history."""
+    requests = [message for message in messages if message["role"] == "assistant"]
+    tools = [call["function"]["name"] for message in requests for call in message.get("tool_calls") or []]
+    error = next((message["content"] for message in requests if (message["content"] or "").startswith("Error:")), None)
+    conversation_row = {"run": "history", "conversation": conversation, "scenario": scenario, "model": model,
+                        "turns": len(requests), "first_tool": tools[0] if tools else None, "tools": "|".join(tools),
+                        "error": error}
+    request_rows = []
+    for turn, message in enumerate(requests, 1):
+        names = [call["function"]["name"] for call in message.get("tool_calls") or []] or [None]
+        request_rows.extend({"run": "history", "conversation": conversation, "model": model, "turn": turn,
+                             "tool": name} for name in names)
+    return conversation_row, request_rows
+
+class Traces:
+    def __init__(self):
+        self._request_rows = []
+        self._conversation_rows = []
+        self._outcomes = {}
+
+    def add_record(self, record):
+        kind = record.get("kind")
+        if kind == "request":
+            # One row per tool call, so per-tool aggregates need no unnesting; None for plain answers.
+            tools = record.get("tools")
+            if tools and len(tools) > 1:
+                self._request_rows.extend(dict(record, tool=tool) for tool in tools)
+            else:
+                record["tool"] = tools[0] if tools else None
+                self._request_rows.append(record)
+        elif kind == "conversation":
+            tools = record.get("tools") or []
+            record["first_tool"] = tools[0] if tools else None
+            record["tools"] = "|".join(tools)
+            self._conversation_rows.append(record)
+        elif kind == "outcome":
+            self._outcomes[record["conversation"]] = record["status"]
+
+    def add_histories(self, histories, source):
+        for index, history in enumerate(histories):
+            if isinstance(history, dict):
+                messages, model, scenario = history["messages"], history.get("model"), history.get("scenario")
+            else:
+                messages, model, scenario = history, None, None
+            conversation_row, request_rows = history_rows(messages, f"{source}#{index}", model, scenario)
+            self._conversation_rows.append(conversation_row)
+            self._request_rows.extend(request_rows)
+
+    def load(self, path):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            if path.endswith(".json"):
+                data = json.load(f)
+                self.add_histories(data["conversations"] if isinstance(data, dict) else data, path)
+                return
+            for line in f:
+                if line.strip():
+                    self.add_record(_parse_line(line))
+
+    def finish(self):
+        """Build the column tables and attach test outcomes once every file is loaded."""
+        for row in self._conversation_rows:
+            row["status"] = self._outcomes.get(row["conversation"])
+        self.requests = Table(REQUEST_COLUMNS, self._request_rows)
+        self.conversations = Table(CONVERSATION_COLUMNS, self._conversation_rows)
+        self._request_rows = self._conversation_rows = None
+        return self
+
+def load_traces(paths):
+    traces = Traces()
+    for pattern in paths:
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        for path in matches:
+            traces.load(path)
+    return traces.finish()
+
+def latency_by(table, key, metric):
+    rows = []
+    for group, values in table.group(key, metric).items():
+        rows.append({key: group, "count": len(values),
+                     "mean": sum(values) / len(values) if values else None,
+                     "p50": percentile(values, 50), "p95": percentile(values, 95), "p99": percentile(values, 99)})
+    return sorted(rows, key=lambda row: -row["count"])
+
+def scenarios_over(conversations, turns):
+    totals = Counter(conversations.columns["scenario"])
+    over = Counter(conversations.take(conversations.select(lambda value: (value or 0) > turns, "turns"))
+                   .columns["scenario"])
+    rows = [{"scenario": scenario, "over": count, "total": totals[scenario], "share": count / totals[scenario]}
+            for scenario, count in over.items()]
+    return sorted(rows, key=lambda row: (-row["share"], -row["over"]))
+
+def tool_selection(conversations):
+    """Most common first tool per scenario and model, flagging scenarios where models disagree."""
+    counts = {}
+    for scenario, model, tool in zip(conversations.columns["scenario"], conversations.columns["model"],
+                                     conversations.columns["first_tool"]):
+        counts.setdefault(scenario, {}).setdefault(model, Counter())[tool or "(none)"] += 1
+    rows = []
+    for scenario, by_model in counts.items():
+        choices = {}
+        for model, tools in by_model.items():
+            tool, count = tools.most_common(1)[0]
+            choices[model] = {"tool": tool, "share": count / sum(tools.values()), "runs": sum(tools.values())}
+        rows.append({"scenario": scenario, "models": choices,
+                     "changed": len({choice["tool"] for choice in choices.values()}) > 1})
+    return sorted(rows, key=lambda row: (not row["changed"], str(row["scenario"])))
+
+def _cell(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}"
+    return str(value)
+
+def print_rows(rows, columns):
+    widths = {column: max([len(column)] + [len(_cell(row[column])) for row in rows]) for column in columns}
+    print("  ".join(f"{column:<{widths[column]}}" for column in columns))
+    for row in rows:
+        print("  ".join(f"{_cell(row[column]):<{widths[column]}}" for column in columns))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggregate queries over harness traces")
+    parser.add_argument("--model", help="Only consider this model")
+    parser.add_argument("--run", help="Only consider this run id")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    commands = parser.add_subparsers(dest="command", required=True)
+    latency = commands.add_parser("latency", help="Latency percentiles per group")
+    latency.add_argument("--by", choices=("tool", "model", "run", "turn"), default="tool")
+    latency.add_argument("--metric", choices=("latency", "ttft", "time_to_first_tool_call"), default="latency")
+    turns = commands.add_parser("turns", help="Scenarios whose conversations run past N turns")
+    turns.add_argument("--over", type=int, default=2)
+    commands.add_parser("tools", help="First tool chosen per scenario, side by side for each model")
+    commands.add_parser("summary", help="Row counts per run and model")
+    for command in commands.choices.values():
+        command.add_argument("paths", nargs="*", default=["traces.jsonl.gz"],
+                             help="Trace files or globs; .json files hold lists of message histories")
+    args = parser.parse_args(argv)
+
+    traces = load_traces(args.paths)
+    requests, conversations = traces.requests, traces.conversations
+    for name, value in (("model", args.model), ("run", args.run)):
+        if value:
+            requests = requests.take(requests.select(lambda item: item == value, name))
+            conversations = conversations.take(conversations.select(lambda item: item == value, name))
+
+    if args.command == "latency":
+        rows = latency_by(requests, args.by, args.metric)
+        columns = [args.by, "count", "mean", "p50", "p95", "p99"]
+    elif args.command == "turns":
+        rows = scenarios_over(conversations, args.over)
+        columns = ["scenario", "over", "total", "share"]
+    elif args.command == "tools":
+        rows = tool_selection(conversations)
+        models = sorted({model for row in rows for model in row["models"]}, key=str)
+        if not args.json:
+            rows = [dict({"scenario": row["scenario"], "changed": "*" if row["changed"] else ""},
+                         **{str(model): (f"{row['models'][model]['tool']} {row['models'][model]['share']:.0%}"
+                                         if model in row["models"] else None) for model in models})
+                    for row in rows]
+        columns = ["scenario", "changed"] + [str(model) for model in models]
+    else:
+        rows = [{"table": "requests", "rows": len(requests)}, {"table": "conversations", "rows": len(conversations)},
+                {"table": "runs", "rows": len(set(conversations.columns["run"]) | set(requests.columns["run"]))}]
+        columns = ["table", "rows"]
+
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2, default=str)
+        print()
+    elif rows:
+        print_rows(rows, columns)
+    else:
+        print("No matching traces")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""GlobTool and LSTool over real files, sharing a cached tree snapshot.
+
+Both answer from an fs_snapshot.TreeSnapshot of the workspace, which is
+listed once and then kept current from inotify events or directory
+mtimes, so repeated calls on the same tree cost no directory walks.
+
+GlobTool matches "**", "*", "?", [classes] and {braces} against paths
+relative to the search directory and returns absolute paths, newest
+first, capped at `max_results`. The last few searches are kept until the
+snapshot changes. Directories outside the workspace are refused, since a
+snapshot of them would list and watch their whole tree.
+
+LSTool prints a tree, as deep as fits in `max_entries` lines: every
+level that fits in full is shown, and the directories at the cut show
+how many entries they hold. Hidden entries are left out, and dependency
+and cache directories are shown but not expanded. A directory outside
+the workspace is listed directly, level by level, and only until the
+limit is reached.
+"""
+import os
+import threading
+
+from fs_snapshot import DIRECTORY, Snapshots, glob_regex, list_directory, literal_prefix, literal_suffixes
+
+MAX_RESULTS = 100
+MAX_ENTRIES = 1000
+CACHED_SEARCHES = 32
+COLLAPSED_DIRS = {"node_modules", "__pycache__", "venv", "dist", "build", "target"}
+
+def _strip_dot(pattern):
+    while pattern.startswith("./"):
+        pattern = pattern[2:]
+    return pattern
+
+class GlobTool:
+    """GlobTool: {"pattern", "path", "exclude"} -> matching file paths, newest first.
+
+    Relative paths resolve against `root`.
+    """
+    side_effect_free = True
+
+    def __init__(self, root=".", snapshots=None, max_results=MAX_RESULTS):
+        self.root = os.path.realpath(root)
+        self.snapshots = snapshots or Snapshots(self.root)
+        self.max_results = max_results
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def search(self, pattern, path=None, exclude=None):
+        """[(mtime_ns, absolute path)] of the files matching, newest first.
+
+        Raises ValueError for a directory outside the workspace.
+        """
+        directory = os.path.join(self.root, path or "")
+        if os.path.isabs(pattern):
+            # "/abs/dir/**/*.py" searches /abs/dir for "**/*.py".
+            base = literal_prefix(pattern)
+            directory, pattern = base or os.sep, pattern[len(base):].lstrip("/")
+        pattern = _strip_dot(pattern)
+        snapshot, prefix = self.snapshots.get(directory)
+        key = (snapshot.root, snapshot.version, prefix, pattern, exclude)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        if prefix:
+            prefix += "/"
+        # Only paths under the pattern's literal directories, with its literal endings, can match.
+        narrow = prefix + literal_prefix(pattern)
+        if narrow and not narrow.endswith("/"):
+            narrow += "/"
+        suffixes = literal_suffixes(pattern) or ""
+        regex = glob_regex(pattern)
+        excluded = glob_regex(_strip_dot(exclude)) if exclude else None
+        start = len(prefix)
+        base = snapshot.root.rstrip(os.sep) + os.sep
+        matches = []
+        for relative, mtime, _ in snapshot.files():
+            if relative.endswith(suffixes) and relative.startswith(narrow):
+                inside = relative[start:]
+                if regex.match(inside) and not (excluded and excluded.match(inside)):
+                    matches.append((mtime, base + relative))
+        matches.sort(key=lambda match: (-match[0], match[1]))
+        with self._lock:
+            # The snapshot's version changes with the tree, so entries never go stale, only unused.
+            if len(self._cache) >= CACHED_SEARCHES:
+                del self._cache[next(iter(self._cache))]
+            self._cache[key] = matches
+        return matches
+
+    def __call__(self, arguments):
+        pattern = arguments["pattern"]
+        path = arguments.get("path")
+        if not os.path.isdir(os.path.join(self.root, path or "")):
+            return f"Error: Directory not found: {path}"
+        try:
+            matches = self.search(pattern, path, arguments.get("exclude"))
+        except ValueError:
+            return f"Error: {path or pattern} is outside {self.root}; GlobTool only searches the workspace"
+        if not matches:
+            return "No files found"
+        lines = [path for _, path in matches[:self.max_results]]
+        if len(matches) > self.max_results:
+            lines.append(f"(Results are truncated: {len(matches)} files match. "
+                         "Consider using a more specific path or pattern.)")
+        return "\n".join(lines)
+
+class LSTool:
+    """LSTool: {"path"} -> a tree of the directory, bounded to `max_entries` lines."""
+    side_effect_free = True
+
+    def __init__(self, root=".", snapshots=None, max_entries=MAX_ENTRIES):
+        self.root = os.path.realpath(root)
+        self.snapshots = snapshots or Snapshots(self.root)
+        self.max_entries = max_entries
+
+    def _lister(self, directory):
+        """A function from a "/"-separated path below `directory` to its {name: (kind, mtime_ns, size)}."""
+        if directory == self.root or directory.startswith(self.root.rstrip(os.sep) + os.sep):
+            found = self.snapshots.get(directory)
+        else:
+            found = self.snapshots.find(directory)
+        if found is not None:
+            snapshot, prefix = found
+            return lambda relative: snapshot.entries("/".join(part for part in (prefix, relative) if part))
+
+        def entries(relative):
+            listing = list_directory(os.path.join(directory, relative) if relative else directory)
+            return listing[1] if listing else None
+        return entries
+
+    def _levels(self, entries):
+        """{directory: sorted visible children} for the levels that fit, and whether any were cut."""
+        children = {}
+        level, count = [""], 0
+        while level:
+            below, shown = [], {}
+            for relative in level:
+                listing = entries(relative) or {}
+                names = sorted((name for name in listing if not name.startswith(".")), key=str.lower)
+                if count + len(names) > self.max_entries:
+                    if not children:
+                        # Even the top level is too long: show what fits of it.
+                        children[""] = [(name, listing[name][0]) for name in names[:self.max_entries]]
+                    # A level is shown whole or not at all.
+                    return children, True
+                count += len(names)
+                shown[relative] = [(name, listing[name][0]) for name in names]
+                below.extend(f"{relative}/{name}" if relative else name for name, kind in shown[relative]
+                             if kind == DIRECTORY and name not in COLLAPSED_DIRS)
+            children.update(shown)
+            level = below
+        return children, False
+
+    def __call__(self, arguments):
+        path = arguments["path"]
+        directory = os.path.realpath(os.path.join(self.root, path))
+        if not os.path.isdir(directory):
+            return f"Error: Directory not found: {path}"
+        entries = self._lister(directory)
+        children, truncated = self._levels(entries)
+        lines = [f"Directory listing for '{path}':"]
+
+        def render(relative, indent):
+            visible = children[relative]
+            for position, (name, kind) in enumerate(visible):
+                last = position == len(visible) - 1
+                child = f"{relative}/{name}" if relative else name
+                label = name + "/" if kind == DIRECTORY else name
+                if kind == DIRECTORY and child not in children and name not in COLLAPSED_DIRS:
+                    listing = entries(child)
+                    if listing:
+                        label += f" ({sum(not entry.startswith('.') for entry in listing)} entries)"
+                lines.append(f"{indent}{'└── ' if last else '├── '}{label}")
+                if child in children:
+                    render(child, indent + ("    " if last else "│   "))
+
+        render("", "")
+        if len(lines) == 1:
+            lines.append("(empty)")
+        if truncated:
+            lines.append(f"(Listing cut to stay under {self.max_entries} entries; "
+                         "list a subdirectory to see more.)")
+        return "\n".join(lines)
+
+def main(argv=None):
+    import argparse
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description="Run GlobTool or LSTool on real files, or benchmark them")
+    parser.add_argument("tool", choices=["glob", "ls"])
+    parser.add_argument("pattern", nargs="?", help="Glob pattern (glob)")
+    parser.add_argument("--path", default=".", help="Directory to search (glob) or list (ls)")
+    parser.add_argument("--exclude")
+    parser.add_argument("--repeat", type=int, default=1, help="Run the call this many times and report timings")
+    args = parser.parse_args(argv)
+
+    snapshots = Snapshots(args.path)
+    if args.tool == "glob":
+        if not args.pattern:
+            parser.error("glob needs a pattern")
+        tool, arguments = GlobTool(args.path, snapshots), {"pattern": args.pattern, "exclude": args.exclude}
+    else:
+        tool, arguments = LSTool(args.path, snapshots), {"path": os.path.realpath(args.path)}
+    try:
+        for attempt in range(args.repeat):
+            start = time.perf_counter()
+            output = tool(arguments)
+            elapsed = time.perf_counter() - start
+            if attempt == 0:
+                print(output)
+            print(f"call {attempt + 1}: {elapsed * 1000:.1f} ms", file=sys.stderr)
+        for snapshot in snapshots.snapshots.values():
+            print(f"{snapshot.root}: {len(snapshot.directories)} directories, {len(snapshot.files())} files, "
+                  f"{'inotify' if snapshot.inotify else 'polling'}, {snapshot.stats}", file=sys.stderr)
+    finally:
+        snapshots.close()
+
+if __name__ == "__main__":
+    main()